@@ -0,0 +1,267 @@
+"""
+Run the pipeline end-to-end on synthetic inputs and report performance.
+
+For each size, synthetic inputs are generated into a fresh workspace and
+each stage is run in its own process (from the workspace, so the relative
+paths in script_config.ini resolve there). Wall time, peak resident memory
+and throughput are recorded per stage and written to a json and csv report
+in benchmarks/results. The import time of each module is also checked
+against its budget (see startup.py).
+
+Usage:
+
+    python benchmarks/run_benchmarks.py --sizes small medium
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import threading
+import subprocess
+import pandas as pd
+
+import startup
+import synthetic
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.join(BENCH_PATH, '..')
+SCRIPTS_PATH = os.path.join(REPO_PATH, 'scripts')
+
+#stage name, command, and the count used for throughput
+STAGES = [
+    ('preprocess', [os.path.join(SCRIPTS_PATH, 'preprocess.py')], 'premises'),
+    ('oa_list', [os.path.join(SCRIPTS_PATH, 'oa_list.py')], 'aps'),
+    ('prems', [os.path.join(SCRIPTS_PATH, 'prems.py')], 'premises'),
+    ('sc', [os.path.join(SCRIPTS_PATH, 'sc.py')], 'msoas'),
+    ('ns', [os.path.join(SCRIPTS_PATH, 'ns.py')], 'msoas'),
+    ('sectors', [os.path.join(SCRIPTS_PATH, 'sectors.py')], 'msoas'),
+    ('maup', [os.path.join(SCRIPTS_PATH, 'maup.py')], 'premises'),
+    ('raster', [os.path.join(SCRIPTS_PATH, 'raster.py')], 'aps'),
+    ('effort', [os.path.join(SCRIPTS_PATH, 'effort.py')], 'gps_fixes'),
+    ('capture', [os.path.join(SCRIPTS_PATH, 'capture.py'),
+        os.path.join('data', 'test_capture.csv')], 'beacons'),
+    ('vis', [os.path.abspath(__file__), '--vis-prep'], 'msoas'),
+]
+
+#runs a stage script and, on exit, writes its own peak resident memory (kB)
+#from /proc. The peak reported by wait4 or getrusage for a child carries
+#over the parent's peak across fork and exec, so is not used where /proc is
+#available.
+MEASURE = """
+import os, sys, atexit, runpy
+
+def report(path=sys.argv[1]):
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            peak = [line.split()[1] for line in f if line.startswith('VmHWM:')]
+        with open(path, 'w') as f:
+            f.write(peak[0] if peak else '')
+
+atexit.register(report)
+sys.argv = sys.argv[2:]
+sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def run_stage(command, workspace, log_path, timeout=None):
+    """
+    Run one stage in a child process, returning its exit code, wall time (s)
+    and peak resident memory (MB).
+
+    """
+    path_peak = log_path + '.peak'
+    if os.path.exists(path_peak):
+        os.remove(path_peak)
+
+    start = time.perf_counter()
+
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-c', MEASURE, path_peak] + command,
+            cwd=workspace,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, process.kill)
+            timer.start()
+
+        _, status, usage = os.wait4(process.pid, 0)
+
+        if timer is not None:
+            timer.cancel()
+
+    if os.WIFEXITED(status):
+        status = os.WEXITSTATUS(status)
+    else:
+        status = -os.WTERMSIG(status)
+    process.returncode = status
+
+    wall_time = time.perf_counter() - start
+
+    peak = ''
+    if os.path.exists(path_peak):
+        with open(path_peak) as f:
+            peak = f.read().strip()
+        os.remove(path_peak)
+
+    if peak:
+        peak_rss_mb = int(peak) / 1024
+    else:
+        #without /proc (e.g. macOS, where ru_maxrss is in bytes), or if the
+        #stage was killed before reporting
+        scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+        peak_rss_mb = usage.ru_maxrss / scale
+
+    return status, wall_time, peak_rss_mb
+
+
+def run_size(size, stages, timeout=None):
+    """
+    Generate inputs for one size and run every requested stage.
+
+    """
+    workspace = os.path.join(BENCH_PATH, 'workspace', size)
+    if os.path.exists(workspace):
+        shutil.rmtree(workspace)
+
+    print('Generating synthetic inputs ({})'.format(size))
+    start = time.perf_counter()
+    counts = synthetic.generate(workspace, size)
+    print('Generated {} in {:.1f}s'.format(counts, time.perf_counter() - start))
+
+    logs = os.path.join(workspace, 'logs')
+    os.makedirs(logs)
+
+    output = []
+
+    for name, command, unit in STAGES:
+
+        if name not in stages:
+            continue
+
+        print('-- Running {} ({})'.format(name, size))
+        log_path = os.path.join(logs, name + '.log')
+        status, wall_time, peak_rss_mb = run_stage(command, workspace, log_path, timeout)
+
+        output.append({
+            'size': size,
+            'stage': name,
+            'status': 'ok' if status == 0 else 'failed ({})'.format(status),
+            'wall_time_s': round(wall_time, 3),
+            'peak_rss_mb': round(peak_rss_mb, 1),
+            'unit': unit,
+            'units': counts[unit],
+            'throughput_per_s': round(counts[unit] / wall_time, 2),
+            'log': os.path.relpath(log_path, REPO_PATH),
+        })
+        print('   {status} in {wall_time_s}s, peak {peak_rss_mb} MB'.format(**output[-1]))
+
+    return output
+
+
+def run_vis_prep():
+    """
+    Run the data preparation steps of vis.py (without plotting).
+
+    """
+    sys.path.append(os.path.join(REPO_PATH, 'vis'))
+    import vis
+    import core
+
+    lookup = vis.process_lookup(core.load_oa_lookup())
+
+    data_ns = pd.read_csv(core.get_path('ns_results'))
+    data_ns = vis.add_lut_data_to_ns(data_ns, lookup, ['low', 'baseline', 'high'])
+
+    data_sc = []
+    for filename in sorted(os.listdir(vis.RESULTS_PATH)):
+        if filename.startswith('all_buffered_points_'):
+            data = pd.read_csv(os.path.join(vis.RESULTS_PATH, filename))
+            data['buffer_size'] = filename.split('_')[-1]
+            data_sc.append(data)
+    data_sc = vis.process_sc_data(pd.concat(data_sc, ignore_index=True))
+    data_sc = vis.add_lut_data_to_sc(data_sc, lookup)
+
+    print('Prepared {} ns and {} sc rows'.format(len(data_ns), len(data_sc)))
+
+
+def write_report(results, startup_results):
+    """
+    Write the results as json (with machine details and import times) and
+    csv.
+
+    """
+    folder = os.path.join(BENCH_PATH, 'results')
+    os.makedirs(folder, exist_ok=True)
+
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+
+    report = {
+        'created': stamp,
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+        },
+        'startup': startup_results,
+        'results': results,
+    }
+
+    path = os.path.join(folder, 'benchmark_{}.json'.format(stamp))
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    pd.DataFrame(results).to_csv(path.replace('.json', '.csv'), index=False)
+
+    return path
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=['small'],
+        choices=list(synthetic.SIZES.keys()))
+    parser.add_argument('--stages', nargs='+', default=[s[0] for s in STAGES],
+        choices=[s[0] for s in STAGES])
+    parser.add_argument('--timeout', type=float, default=None,
+        help='maximum time (s) for a single stage')
+    parser.add_argument('--vis-prep', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.vis_prep:
+        run_vis_prep()
+        sys.exit(0)
+
+    print('Checking module import times')
+    startup_results = startup.check_startup()
+    for item in startup_results:
+        print('-- {module}: {import_time_s}s (budget {budget_s}s) {status}'.format(**item))
+
+    results = []
+    for size in args.sizes:
+        results += run_size(size, args.stages, args.timeout)
+
+    path = write_report(results, startup_results)
+    print('Report written to {}'.format(path))
+
+    failed = False
+
+    if any(item['status'] != 'ok' for item in results):
+        print('Some stages failed, see their logs')
+        failed = True
+
+    if any(item['status'] != 'ok' for item in startup_results):
+        print('Some modules are over their import time budget')
+        failed = True
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,121 @@
+"""
+Check how long the pipeline modules take to import.
+
+Each module is imported in a fresh interpreter (best of several runs) and
+its import time compared with a budget. Heavy dependencies should only be
+loaded in the code paths that need them, so each module also lists the
+packages it must not load on import (e.g. sc.py never plots).
+
+Usage:
+
+    python benchmarks/startup.py
+
+Exits with a non-zero status if any module is over budget.
+
+"""
+import os
+import sys
+import json
+import subprocess
+
+BENCH_PATH = os.path.dirname(os.path.abspath(__file__))
+REPO_PATH = os.path.join(BENCH_PATH, '..')
+
+#module, folder, import time budget (s), packages which must not be loaded
+MODULES = [
+    ('core', 'scripts', 0.25, ['pandas']),
+    ('schemas', 'scripts', 0.25, ['pandas']),
+    ('instrument', 'scripts', 0.25, ['pandas']),
+    ('run', 'scripts', 0.25, ['pandas']),
+    ('population', 'scripts', 0.25, ['pandas']),
+    ('subset', 'scripts', 1.5, ['geopandas']),
+    ('ingest', 'scripts', 1.5, ['geopandas']),
+    ('chunks', 'scripts', 1.5, ['geopandas']),
+    ('ap_store', 'scripts', 1.5, ['geopandas']),
+    ('ns', 'scripts', 1.5, ['geopandas', 'matplotlib', 'seaborn']),
+    ('crosswalk', 'scripts', 0.25, ['pandas', 'scipy']),
+    ('sectors', 'scripts', 1.5, ['geopandas', 'scipy']),
+    ('maup', 'scripts', 1.5, ['geopandas', 'scipy']),
+    ('raster', 'scripts', 1.5, ['geopandas', 'scipy']),
+    ('effort', 'scripts', 1.5, ['geopandas', 'scipy', 'pyproj']),
+    ('capture', 'scripts', 1.5, ['geopandas', 'scipy', 'pyproj']),
+    ('boundaries', 'scripts', 2.5, ['matplotlib', 'seaborn', 'pykml']),
+    ('preprocess', 'scripts', 2.5, ['matplotlib', 'seaborn', 'pykml']),
+    ('oa_list', 'scripts', 2.5, ['matplotlib', 'seaborn', 'pykml']),
+    ('prems', 'scripts', 2.5, ['matplotlib', 'seaborn', 'pykml']),
+    ('sc', 'scripts', 2.5, ['matplotlib', 'seaborn', 'pykml']),
+    ('vis', 'vis', 1.5, ['geopandas', 'matplotlib', 'seaborn']),
+]
+
+REPEATS = 3
+
+#run in a child process, printing the import time and loaded packages
+CODE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+print(json.dumps([time.perf_counter() - start, sorted(sys.modules)]))
+"""
+
+
+def measure(module, folder, repeats=REPEATS):
+    """
+    Return the best import time (s) of a module over several fresh
+    interpreters, and the packages it loaded.
+
+    """
+    times = []
+
+    for i in range(repeats):
+        process = subprocess.run(
+            [sys.executable, '-c', CODE.format(module=module)],
+            cwd=os.path.join(REPO_PATH, folder),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        duration, loaded = json.loads(process.stdout.strip().splitlines()[-1])
+        times.append(duration)
+
+    packages = set(name.split('.')[0] for name in loaded)
+
+    return min(times), packages
+
+
+def check_startup(modules=MODULES):
+    """
+    Measure every module against its budget, returning one result per module.
+
+    """
+    output = []
+
+    for module, folder, budget, forbidden in modules:
+
+        duration, packages = measure(module, folder)
+        loaded = [name for name in forbidden if name in packages]
+
+        status = 'ok'
+        if duration > budget:
+            status = 'over budget'
+        if len(loaded) > 0:
+            status = 'loads {}'.format(', '.join(loaded))
+
+        output.append({
+            'module': module,
+            'import_time_s': round(duration, 3),
+            'budget_s': budget,
+            'status': status,
+        })
+
+    return output
+
+
+if __name__ == '__main__':
+
+    results = check_startup()
+
+    for item in results:
+        print('{module:<12} {import_time_s:>6.3f}s (budget {budget_s}s) {status}'.format(**item))
+
+    if any(item['status'] != 'ok' for item in results):
+        sys.exit(1)
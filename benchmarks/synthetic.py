@@ -0,0 +1,486 @@
+"""
+Generate synthetic inputs for benchmarking the pipeline.
+
+Writes a `data` folder with the same layout and file formats as the real
+inputs (MSOA and Scottish IZ boundaries, OA lookups, LAD boundaries,
+premises with WKT, household persons, business counts, WiGLE kml
+files, postcode sectors, a GPS track and a packet capture export), for a regular grid of areas of a chosen size.
+
+"""
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box, MultiPolygon
+
+SIZES = {
+    'small': {
+        'lads': 3,
+        'msoas_per_lad': 4,
+        'oas_per_msoa': 3,
+        'prems_per_oa': 20,
+        'persons_per_oa': 60,
+        'aps_per_km2': 150,
+        'kml_files': 2,
+        'gps_fixes': 2000,
+        'beacons': 20000,
+    },
+    'medium': {
+        'lads': 5,
+        'msoas_per_lad': 16,
+        'oas_per_msoa': 5,
+        'prems_per_oa': 40,
+        'persons_per_oa': 120,
+        'aps_per_km2': 400,
+        'kml_files': 4,
+        'gps_fixes': 20000,
+        'beacons': 200000,
+    },
+    'large': {
+        'lads': 9,
+        'msoas_per_lad': 36,
+        'oas_per_msoa': 8,
+        'prems_per_oa': 60,
+        'persons_per_oa': 180,
+        'aps_per_km2': 800,
+        'kml_files': 8,
+        'gps_fixes': 200000,
+        'beacons': 2000000,
+    },
+}
+
+REGIONS = ['London', 'South East', 'East of England', 'South West',
+    'East Midlands', 'Yorkshire and The Humber']
+
+#south-west corner of the synthetic study area (British National Grid)
+ORIGIN = (500000, 180000)
+MSOA_SIZE = 1000
+
+LOOKUP_FILENAME = (
+    'Output_Area_to_LSOA_to_area_to_Local_Authority_District__December_2017__'
+    'Lookup_with_Area_Classifications_in_Great_Britain.csv'
+)
+LAD_LOOKUP_FILENAME = (
+    'Output_Area_to_LSOA_to_MSOA_to_Local_Authority_District__December_2017__'
+    'Lookup_with_Area_Classifications_in_Great_Britain.csv'
+)
+
+
+def get_areas(params):
+    """
+    Lay out LADs as columns of square MSOAs, with the last LAD in Scotland.
+
+    """
+    rows = int(np.ceil(np.sqrt(params['msoas_per_lad'])))
+
+    output = []
+
+    for lad_idx in range(params['lads']):
+
+        scottish = lad_idx == params['lads'] - 1
+
+        if scottish:
+            lad = 'S120000{:02d}'.format(lad_idx)
+            region = 'Scotland'
+        else:
+            lad = 'E090000{:02d}'.format(lad_idx)
+            region = REGIONS[lad_idx % len(REGIONS)]
+
+        for msoa_idx in range(params['msoas_per_lad']):
+
+            col = lad_idx * rows + msoa_idx % rows
+            row = msoa_idx // rows
+
+            code = len(output)
+            if scottish:
+                msoa = 'S0200{:04d}'.format(code)
+            else:
+                msoa = 'E0200{:04d}'.format(code)
+
+            minx = ORIGIN[0] + col * MSOA_SIZE
+            miny = ORIGIN[1] + row * MSOA_SIZE
+
+            output.append({
+                'lad': lad,
+                'region': region,
+                'msoa': msoa,
+                'scottish': scottish,
+                'bounds': (minx, miny, minx + MSOA_SIZE, miny + MSOA_SIZE),
+            })
+
+    return output
+
+
+def write_boundaries(data_path, areas):
+    """
+    Write MSOA, Scottish IZ and LAD boundaries. Every other MSOA gets a small
+    detached part, so small-shape removal has work to do.
+
+    """
+    features = []
+
+    for idx, area in enumerate(areas):
+        main = box(*area['bounds'])
+        if idx % 2 == 0:
+            minx, miny = area['bounds'][:2]
+            geom = MultiPolygon([
+                box(minx + 50, miny + 50, minx + MSOA_SIZE - 50, miny + MSOA_SIZE - 50),
+                box(minx + 5, miny + 5, minx + 25, miny + 25),
+            ])
+        else:
+            geom = main
+        features.append({'msoa': area['msoa'], 'lad': area['lad'],
+            'scottish': area['scottish'], 'geometry': geom})
+
+    features = gpd.GeoDataFrame(features, crs='epsg:27700')
+
+    folder = os.path.join(data_path, 'msoa_shapes')
+    os.makedirs(folder, exist_ok=True)
+    ew = features.loc[~features['scottish'], ['msoa', 'geometry']]
+    ew = ew.rename(columns={'msoa': 'msoa11cd'})
+    ew.to_file(os.path.join(folder,
+        'Middle_Layer_Super_Output_Areas__December_2011__Boundaries.shp'))
+
+    folder = os.path.join(data_path, 'scottish_iz_shapes')
+    os.makedirs(folder, exist_ok=True)
+    scot = features.loc[features['scottish'], ['msoa', 'geometry']]
+    scot = scot.rename(columns={'msoa': 'InterZone'})
+    scot.to_file(os.path.join(folder, 'SG_IntermediateZone_Bdry_2011.shp'))
+
+    folder = os.path.join(data_path, 'shapes')
+    os.makedirs(folder, exist_ok=True)
+    lads = features.dissolve(by='lad').reset_index()[['lad', 'geometry']]
+    lads = lads.rename(columns={'lad': 'name'})
+    lads.to_file(os.path.join(folder, 'lad_uk_2016-12.shp'))
+
+
+def get_oas(areas, params):
+    """
+    Split each MSOA into strips of Output Areas, each with its own LSOA.
+
+    """
+    output = []
+
+    for area in areas:
+        minx, miny, maxx, maxy = area['bounds']
+        width = (maxx - minx) / params['oas_per_msoa']
+        for idx in range(params['oas_per_msoa']):
+            code = len(output)
+            output.append({
+                'OA11CD': '{}0000{:05d}'.format(area['msoa'][0], code),
+                'LSOA11CD': '{}0100{:04d}'.format(area['msoa'][0], code),
+                'MSOA11CD': area['msoa'],
+                'LAD17CD': area['lad'],
+                'RGN11NM': area['region'],
+                'bounds': (minx + idx * width, miny, minx + (idx + 1) * width, maxy),
+            })
+
+    return output
+
+
+def write_lookups(data_path, oas):
+    """
+    Write the OA to LSOA to MSOA to LAD lookup tables.
+
+    """
+    folder = os.path.join(data_path, 'oa_lut')
+    os.makedirs(folder, exist_ok=True)
+
+    lookup = pd.DataFrame(oas).drop(columns='bounds')
+
+    lookup.to_csv(os.path.join(folder, LOOKUP_FILENAME), index=False)
+    lookup.to_csv(os.path.join(folder, LAD_LOOKUP_FILENAME), index=False)
+
+
+def write_premises(data_path, oas, params, rng):
+    """
+    Write premises for each OA, with building footprints as WKT.
+
+    """
+    classes = np.array(['residential', 'retail', 'office', 'residential'])
+
+    for oa in oas:
+
+        folder = os.path.join(data_path, 'prems_by_lad', oa['LAD17CD'])
+        os.makedirs(folder, exist_ok=True)
+
+        n = params['prems_per_oa']
+        minx, miny, maxx, maxy = oa['bounds']
+        x = rng.uniform(minx + 10, maxx - 20, n)
+        y = rng.uniform(miny + 10, maxy - 20, n)
+        size = rng.uniform(5, 15, n)
+
+        function_class = classes[rng.integers(0, len(classes), n)]
+        residential = function_class == 'residential'
+
+        prems = pd.DataFrame({
+            'mistral_function_class': function_class,
+            'mistral_building_class': np.where(residential, 'house', 'commercial'),
+            'res_count': np.where(residential, 1, 0),
+            'floor_area': np.round(size ** 2 * rng.integers(1, 4, n), 1),
+            'height_toroofbase': np.round(rng.uniform(3, 10, n), 1),
+            'height_torooftop': np.round(rng.uniform(5, 15, n), 1),
+            'nonres_count': np.where(residential, 0, 1),
+            'number_of_floors': rng.integers(1, 4, n),
+            'footprint_area': np.round(size ** 2, 1),
+            'geom': [
+                box(a, b, a + s, b + s).wkt for a, b, s in zip(x, y, size)
+            ],
+        })
+
+        prems.to_csv(os.path.join(folder, oa['OA11CD'] + '.csv'), index=False)
+
+
+def write_households(data_path, oas, params, rng):
+    """
+    Write synthetic household persons (Area, HID, PID, age) for each LAD.
+
+    """
+    folder = os.path.join(data_path, 'hh_demographics_msoa_2018')
+    os.makedirs(folder, exist_ok=True)
+
+    persons = []
+    for oa in oas:
+        n = params['persons_per_oa']
+        persons.append(pd.DataFrame({
+            'LAD': oa['LAD17CD'],
+            'Area': oa['MSOA11CD'],
+            'household': rng.integers(0, n // 2, n),
+            'DC1117EW_C_AGE': rng.integers(0, 95, n),
+        }))
+    persons = pd.concat(persons, ignore_index=True)
+
+    persons['HID'] = persons.groupby(['Area', 'household']).ngroup()
+    persons['PID'] = np.arange(len(persons))
+
+    for lad, data in persons.groupby('LAD'):
+        data = data[['Area', 'HID', 'PID', 'DC1117EW_C_AGE']]
+        filename = 'ass_{}_area11_2018.csv'.format(lad)
+        data.to_csv(os.path.join(folder, filename), index=False)
+
+
+def write_business_counts(data_path, areas, rng):
+    """
+    Write business counts by size band for each area.
+
+    """
+    folder = os.path.join(data_path, 'ons_local_business_counts')
+    os.makedirs(folder, exist_ok=True)
+
+    n = len(areas)
+    counts = pd.DataFrame({
+        'Area': ['msoa2011:{} : Synthetic'.format(a['msoa']) for a in areas],
+        'mnemonic': [a['msoa'] for a in areas],
+        'Micro (0 to 9)': rng.integers(50, 400, n),
+        'Small (10 to 49)': rng.integers(5, 60, n),
+        'Medium-sized (50 to 249)': rng.integers(0, 15, n),
+        '250 to 499': rng.integers(0, 4, n),
+        '500 to 999': rng.integers(0, 2, n),
+        '1000+': rng.integers(0, 2, n),
+    })
+
+    counts.to_csv(os.path.join(folder, 'business_counts.csv'), index=False)
+
+
+def write_pcd_sectors(data_path, areas, rng, sectors_per_lad=3):
+    """
+    Write postcode sectors splitting the area of each LAD.
+
+    """
+    folder = os.path.join(data_path, 'pcd_sector_geotypes')
+    os.makedirs(folder, exist_ok=True)
+
+    lads = pd.Series([a['lad'] for a in areas]).value_counts(sort=False)
+
+    output = []
+
+    for lad_idx, (lad, msoas) in enumerate(lads.items()):
+
+        lad_area_km2 = msoas * (MSOA_SIZE / 1e3) ** 2
+        shares = rng.dirichlet(np.ones(sectors_per_lad))
+
+        for sector_idx, share in enumerate(shares):
+            population = int(rng.integers(2000, 12000))
+            area_km2 = lad_area_km2 * share
+            output.append({
+                'id': 'SY{}{}'.format(lad_idx, sector_idx),
+                'lad': lad,
+                'population': float(population),
+                'area_km2': area_km2,
+                'pop_density_km2': population / area_km2,
+                'lte_4G': int(rng.integers(0, 2)),
+            })
+
+    pd.DataFrame(output).to_csv(os.path.join(folder,
+        'pcd_sector_geotypes.csv'), index=False)
+
+
+def write_gps_trajectories(data_path, areas, params, rng, interval=5):
+    """
+    Write a GPS track driving between random points of the study area,
+    with a fix every few seconds.
+
+    """
+    from pyproj import Transformer
+
+    bounds = np.array([area['bounds'] for area in areas])
+    minx, miny = bounds[:, 0].min(), bounds[:, 1].min()
+    maxx, maxy = bounds[:, 2].max(), bounds[:, 3].max()
+
+    n = params['gps_fixes']
+    speed_kmh = rng.uniform(0, 50, n)
+
+    #head for a new random waypoint every few minutes
+    waypoints = np.column_stack([rng.uniform(minx, maxx, n // 40 + 2),
+        rng.uniform(miny, maxy, n // 40 + 2)])
+    position = np.repeat(np.arange(len(waypoints) - 1), 40)[:n]
+    share = (np.arange(n) % 40) / 40
+    x = waypoints[position, 0] + share * (waypoints[position + 1, 0] - waypoints[position, 0])
+    y = waypoints[position, 1] + share * (waypoints[position + 1, 1] - waypoints[position, 1])
+
+    transformer = Transformer.from_crs('epsg:27700', 'epsg:4326', always_xy=True)
+    lng, lat = transformer.transform(x, y)
+
+    times = pd.Timestamp('2020-03-25 18:45:00', tz='UTC') + pd.to_timedelta(
+        np.arange(n) * interval, unit='s')
+
+    pd.DataFrame({
+        'Date': times.strftime('%d/%m/%Y %H:%M'),
+        'Lat': lat.round(6),
+        'Lng': lng.round(6),
+        'Speed(mph)': (speed_kmh / 1.609).round(),
+        'Speed(km/h)': speed_kmh.round(),
+        'Altitude(ft)': 40,
+        'Altitude(m)': 12,
+        'Accuracy': rng.integers(3, 70, n),
+        'Type': 'GPS',
+        'Date2': times.strftime('%Y-%m-%d %H:%M:%S+00:00'),
+    }).to_csv(os.path.join(data_path, 'gps_trajectories.csv'), index=False)
+
+
+def write_packet_capture(data_path, params, rng, interval=5):
+    """
+    Write a packet capture export of beacon frames during the GPS track,
+    with each network beaconing many times.
+
+    """
+    n = params['beacons']
+    networks = max(n // 20, 1)
+
+    macs = rng.integers(0, 256, (networks, 6))
+    bssids = np.array([':'.join('{:02x}'.format(v) for v in mac) for mac in macs])
+    ssids = np.array(['SynthNet-{}'.format(i) for i in range(networks)])
+    ssids[::10] = 'Wildcard (Broadcast)'
+
+    network = rng.integers(0, networks, n)
+    seconds = np.sort(rng.uniform(0, params['gps_fixes'] * interval, n)).astype(int)
+    start = pd.Timestamp('2020-03-25 18:45:00')
+    times = (start + pd.to_timedelta(seconds, unit='s')).strftime('%H:%M:%S')
+
+    pd.DataFrame({
+        'No.': np.arange(1, n + 1),
+        'Time': times,
+        'Source': bssids[network],
+        'Destination': 'Broadcast',
+        'Protocol': '802.11',
+        'Length': rng.integers(200, 400, n),
+        'Info': ['Beacon frame, SN=0, FN=0, Flags=........, BI=100, SSID={}'.format(ssid)
+            for ssid in ssids[network]],
+    }).to_csv(os.path.join(data_path, 'test_capture.csv'), index=False)
+
+
+def write_kml(data_path, areas, params, rng):
+    """
+    Write WiGLE-format kml files with APs spread over the study area.
+
+    Some networks are seen in more than one drive, as in real campaigns.
+
+    """
+    folder = os.path.join(data_path, 'wigle', 'all_kml_data')
+    os.makedirs(folder, exist_ok=True)
+
+    minx = min(a['bounds'][0] for a in areas)
+    miny = min(a['bounds'][1] for a in areas)
+    maxx = max(a['bounds'][2] for a in areas)
+    maxy = max(a['bounds'][3] for a in areas)
+
+    area_km2 = len(areas) * (MSOA_SIZE / 1000) ** 2
+    n = int(params['aps_per_km2'] * area_km2)
+
+    points = gpd.GeoSeries(gpd.points_from_xy(
+        rng.uniform(minx, maxx, n), rng.uniform(miny, maxy, n)),
+        crs='epsg:27700').to_crs('epsg:4326')
+
+    bssids = rng.integers(0, 2**48, n)
+    drive = rng.integers(0, params['kml_files'], n)
+
+    for file_idx in range(params['kml_files']):
+
+        #each drive also sees ~10% of the networks from other drives
+        seen = (drive == file_idx) | (rng.uniform(0, 1, n) < 0.1)
+
+        placemarks = []
+        for idx in np.flatnonzero(seen):
+            bssid = ':'.join('{:02x}'.format(b) for b in int(bssids[idx]).to_bytes(6, 'big'))
+            placemarks.append(
+                '<Placemark><name>net{idx}</name><description>'
+                'Network ID: {bssid}\nEncryption: WPA2\n'
+                'Time: 2020-03-25T18:45:34.000-00:00\nSignal: {signal:.1f}\n'
+                'Accuracy: {accuracy:.1f}\nType: WIFI</description>'
+                '<Point><coordinates>{x:.6f},{y:.6f}</coordinates></Point>'
+                '</Placemark>'.format(
+                    idx=idx, bssid=bssid,
+                    signal=rng.uniform(-95, -40), accuracy=rng.uniform(2, 50),
+                    x=points.iloc[idx].x, y=points.iloc[idx].y,
+                )
+            )
+
+        path = os.path.join(folder, 'drive_{}.kml'.format(file_idx))
+        with open(path, 'w') as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>'
+                '<Folder><name>Wifi Networks</name>'
+            )
+            f.write('\n'.join(placemarks))
+            f.write('</Folder></Document></kml>\n')
+
+    return n
+
+
+def generate(workspace, size, seed=43):
+    """
+    Generate a full set of synthetic inputs under workspace/data and return
+    counts of what was written.
+
+    """
+    params = SIZES[size]
+    rng = np.random.default_rng(seed)
+
+    data_path = os.path.join(workspace, 'data')
+    os.makedirs(os.path.join(data_path, 'intermediate'), exist_ok=True)
+    os.makedirs(os.path.join(workspace, 'results'), exist_ok=True)
+
+    areas = get_areas(params)
+    oas = get_oas(areas, params)
+
+    write_boundaries(data_path, areas)
+    write_lookups(data_path, oas)
+    write_premises(data_path, oas, params, rng)
+    write_households(data_path, oas, params, rng)
+    write_business_counts(data_path, areas, rng)
+    aps = write_kml(data_path, areas, params, rng)
+    write_pcd_sectors(data_path, areas, rng)
+    write_gps_trajectories(data_path, areas, params, rng)
+    write_packet_capture(data_path, params, rng)
+
+    return {
+        'lads': params['lads'],
+        'msoas': len(areas),
+        'oas': len(oas),
+        'premises': len(oas) * params['prems_per_oa'],
+        'persons': len(oas) * params['persons_per_oa'],
+        'aps': aps,
+        'gps_fixes': params['gps_fixes'],
+        'beacons': params['beacons'],
+    }
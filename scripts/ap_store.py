@@ -0,0 +1,302 @@
+"""
+Partitioned storage for the collected AP data.
+
+Points are split by MSOA code (or by a fixed British National Grid tile)
+and each partition is written as small csv part files, with an index
+recording where each part lives, its row count and bounding box. Workers
+can then load only the partitions they need, and new drives are added as
+new part files without rewriting existing ones. A list of the BSSIDs held
+in each part file finds the partitions holding earlier sightings of newly
+collected networks.
+
+"""
+import os
+import zlib
+import pandas as pd
+
+INDEX_FILENAME = 'index.csv'
+NETWORKS_FILENAME = 'networks.csv'
+TILE_SIZE = 10000
+BUCKETS = 64
+
+
+def get_tile_id(x, y, tile_size=TILE_SIZE):
+    """
+    Return the British National Grid tile id for each easting/northing.
+
+    """
+    tile_x = (x // tile_size).astype(int).astype(str)
+    tile_y = (y // tile_size).astype(int).astype(str)
+
+    return tile_x + '_' + tile_y
+
+
+def get_bucket(key, buckets=BUCKETS):
+    """
+    Hash a partition key into a bucket folder, keeping folder sizes small.
+
+    """
+    return '{:03d}'.format(zlib.crc32(str(key).encode('utf-8')) % buckets)
+
+
+def get_bssid(network_id):
+    """
+    Return the BSSID from WiGLE network id text (e.g. 'Network ID: 00:11:...').
+
+    """
+    return network_id.astype(str).str.replace(r'^Network ID:\s*', '', regex=True).str.lower()
+
+
+def load_index(root):
+    """
+    Load the partition index, or an empty index if no store exists.
+
+    """
+    path = os.path.join(root, INDEX_FILENAME)
+
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=[
+            'scheme', 'partition', 'path', 'batch', 'rows',
+            'minx', 'miny', 'maxx', 'maxy'
+        ])
+
+    return pd.read_csv(path, dtype={'partition': str, 'path': str})
+
+
+def exists(root):
+    """
+    Check whether a store (with an index) already exists.
+
+    """
+    return os.path.exists(os.path.join(root, INDEX_FILENAME))
+
+
+def load_networks(root):
+    """
+    Load the BSSIDs held in each part file, building the list from the part
+    files first for a store written before it was kept.
+
+    """
+    path = os.path.join(root, NETWORKS_FILENAME)
+
+    if os.path.exists(path):
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+    output = [pd.DataFrame(columns=['path', 'bssid'])]
+
+    for path_part in load_index(root)['path']:
+        data = pd.read_csv(os.path.join(root, path_part), usecols=['network_id'],
+            dtype=str, keep_default_na=False)
+        output.append(pd.DataFrame({
+            'path': path_part,
+            'bssid': get_bssid(data['network_id']).unique(),
+        }))
+
+    output = pd.concat(output, ignore_index=True)
+
+    if exists(root):
+        write_networks(output, root)
+
+    return output
+
+
+def write_networks(networks, root):
+    """
+    Write the BSSIDs held in each part file.
+
+    """
+    path = os.path.join(root, NETWORKS_FILENAME)
+    networks.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+
+def find_partitions(root, bssids, scheme='msoa'):
+    """
+    Return the partitions holding any of the given BSSIDs.
+
+    """
+    networks = load_networks(root)
+    paths = networks.loc[networks['bssid'].isin(set(bssids)), 'path']
+
+    index = load_index(root)
+    index = index.loc[(index['scheme'] == scheme) & (index['path'].isin(paths))]
+
+    return index['partition'].unique().tolist()
+
+
+def write_partitions(data, root, scheme='msoa', tile_size=TILE_SIZE):
+    """
+    Append points to the store as a new batch of partition files.
+
+    Points without a partition key (e.g. outside all MSOAs) are skipped
+    under the 'msoa' scheme. Returns the index of the new batch.
+
+    """
+    if not os.path.exists(root):
+        os.makedirs(root)
+
+    index = load_index(root)
+    if len(index) > 0:
+        batch = int(index['batch'].max()) + 1
+    else:
+        batch = 0
+
+    data = pd.DataFrame(data.drop(columns='geometry').assign(
+        x=data.geometry.x.values,
+        y=data.geometry.y.values,
+    ))
+
+    if scheme == 'msoa':
+        keys = data['msoa']
+    elif scheme == 'tile':
+        keys = get_tile_id(data['x'], data['y'], tile_size)
+    else:
+        raise ValueError('Did not recognise partition scheme: {}'.format(scheme))
+
+    networks = load_networks(root)
+
+    new_index = []
+    new_networks = []
+
+    for key, partition in data.groupby(keys, sort=False):
+
+        folder = os.path.join(scheme, get_bucket(key), str(key))
+        if not os.path.exists(os.path.join(root, folder)):
+            os.makedirs(os.path.join(root, folder))
+
+        path = os.path.join(folder, 'part_{}.csv'.format(batch))
+        partition.to_csv(os.path.join(root, path), index=False)
+
+        new_index.append({
+            'scheme': scheme,
+            'partition': str(key),
+            'path': path,
+            'batch': batch,
+            'rows': len(partition),
+            'minx': partition['x'].min(),
+            'miny': partition['y'].min(),
+            'maxx': partition['x'].max(),
+            'maxy': partition['y'].max(),
+        })
+        new_networks.append(pd.DataFrame({
+            'path': path,
+            'bssid': get_bssid(partition['network_id']).unique(),
+        }))
+
+    if len(new_networks) > 0:
+        networks = pd.concat([networks] + new_networks, ignore_index=True)
+    write_networks(networks, root)
+
+    index = pd.concat([index, pd.DataFrame(new_index)], ignore_index=True)
+
+    path = os.path.join(root, INDEX_FILENAME)
+    index.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+    return batch
+
+
+def replace_partitions(data, root, keys, scheme='msoa'):
+    """
+    Replace the contents of the given partitions with new data.
+
+    The new batch is written before the old part files are removed, so an
+    interrupted run never loses points.
+
+    """
+    batch = write_partitions(data, root, scheme=scheme)
+
+    index = load_index(root)
+
+    old = (
+        (index['scheme'] == scheme) &
+        (index['partition'].isin(keys)) &
+        (index['batch'] != batch)
+    )
+
+    for path in index.loc[old, 'path']:
+        if os.path.exists(os.path.join(root, path)):
+            os.remove(os.path.join(root, path))
+
+    networks = load_networks(root)
+    write_networks(networks.loc[~networks['path'].isin(index.loc[old, 'path'])], root)
+
+    index = index.loc[~old]
+
+    path = os.path.join(root, INDEX_FILENAME)
+    index.to_csv(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+
+    return batch
+
+
+def read_parts(root, parts):
+    """
+    Read a set of index rows into a single GeoDataFrame.
+
+    All columns other than the coordinates are read back as text, as they
+    were written, so names like '007' or blank SSIDs keep matching.
+
+    """
+    import geopandas as gpd
+
+    data = [
+        pd.read_csv(os.path.join(root, path), dtype=str, keep_default_na=False)
+        for path in parts['path']
+    ]
+
+    if len(data) == 0:
+        return gpd.GeoDataFrame(geometry=[], crs='epsg:27700')
+
+    data = pd.concat(data, ignore_index=True)
+
+    geometry = gpd.points_from_xy(data['x'].astype(float), data['y'].astype(float))
+    data = data.drop(columns=['x', 'y'])
+
+    return gpd.GeoDataFrame(data, geometry=geometry, crs='epsg:27700')
+
+
+def load_partitions(root, keys, scheme='msoa'):
+    """
+    Load all points held in the given partitions (e.g. a list of MSOAs).
+
+    """
+    index = load_index(root)
+
+    parts = index.loc[
+        (index['scheme'] == scheme) & (index['partition'].isin(keys))
+    ]
+
+    return read_parts(root, parts)
+
+
+def load_bbox(root, bounds, scheme='tile'):
+    """
+    Load the points within a (minx, miny, maxx, maxy) bounding box, only
+    reading partitions whose extent overlaps it.
+
+    """
+    minx, miny, maxx, maxy = bounds
+
+    index = load_index(root)
+
+    parts = index.loc[
+        (index['scheme'] == scheme) &
+        (index['maxx'] >= minx) & (index['minx'] <= maxx) &
+        (index['maxy'] >= miny) & (index['miny'] <= maxy)
+    ]
+
+    data = read_parts(root, parts)
+
+    return data.cx[minx:maxx, miny:maxy]
+
+
+def get_counts(root, scheme='msoa'):
+    """
+    Return the number of stored points per partition, from the index alone.
+
+    """
+    index = load_index(root)
+    index = index.loc[index['scheme'] == scheme]
+
+    return index.groupby('partition')['rows'].sum()
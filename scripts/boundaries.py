@@ -0,0 +1,136 @@
+"""
+Area boundary layers at several levels of simplification.
+
+Preprocessing writes the cleaned area boundaries at full resolution and
+simplified to 10 m and 100 m, each with a spatial index. Consumers pick the
+cheapest level which is accurate enough: coarse layers for prefiltering
+and plotting, full resolution for final membership tests.
+
+"""
+import os
+import pandas as pd
+import geopandas as gpd
+import shapely
+from shapely.prepared import prep
+
+import core
+
+BASE_PATH = core.BASE_PATH
+
+#None is full resolution, otherwise the simplification tolerance (m)
+LEVELS = [None, 10, 100]
+
+
+def get_boundaries_path(level, folder=None):
+    """
+    Return the path of the boundary layer for a simplification level.
+
+    """
+    if folder is None:
+        folder = os.path.join(BASE_PATH, 'intermediate')
+
+    if level is None:
+        filename = 'boundaries_full.shp'
+    else:
+        filename = 'boundaries_{}m.shp'.format(level)
+
+    return os.path.join(folder, filename)
+
+
+def get_max_error(level):
+    """
+    Return the furthest a simplified edge can be from the full resolution
+    edge (m). Shapes are simplified twice (either side of a tiny buffer), so
+    the error can reach twice the tolerance, plus a 1 m margin.
+
+    """
+    if level is None:
+        return 0
+
+    return 2 * level + 1
+
+
+def load_boundaries(level, folder=None):
+    """
+    Load the boundary layer for a simplification level.
+
+    Falls back to output_areas.shp (simplified to 10 m) for environments
+    preprocessed before the levels were written.
+
+    """
+    path = get_boundaries_path(level, folder)
+
+    if not os.path.exists(path):
+        print('Boundary level {} not found, using output_areas.shp'.format(level))
+        path = os.path.join(os.path.dirname(path), 'output_areas.shp')
+
+    data = gpd.read_file(path)
+    data.crs = 'epsg:27700'
+
+    return data
+
+
+def assign_areas(points, fine, coarse=None, tolerance=0):
+    """
+    Return the area code each point falls within.
+
+    If a coarse layer is given, points are first joined to it. A point inside
+    a coarse shape and further than the simplification tolerance from its
+    edge must lie in the same full resolution shape, so only the remaining
+    points (near edges or unmatched) are tested against the fine layer.
+    Points on a shared boundary are given to the first matching area.
+
+    """
+    points = points[['geometry']]
+    codes = pd.Series(None, index=points.index, dtype=object)
+
+    if coarse is not None:
+        joined = gpd.sjoin(points, coarse[['msoa', 'geometry']],
+            how='inner', predicate='within')
+        joined = joined[~joined.index.duplicated(keep='first')]
+
+        #the boundary of each matched shape is built once, then looked up
+        edges = coarse.geometry.loc[joined['index_right'].unique()].boundary
+        edges = edges.loc[joined['index_right']].values
+        distance = gpd.GeoSeries(edges, index=joined.index).distance(
+            points.geometry.loc[joined.index])
+
+        settled = joined.loc[distance > tolerance]
+        codes.loc[settled.index] = settled['msoa']
+
+        points = points.loc[~points.index.isin(settled.index)]
+
+    joined = gpd.sjoin(points, fine[['msoa', 'geometry']],
+        how='inner', predicate='intersects')
+    joined = joined[~joined.index.duplicated(keep='first')]
+    codes.loc[joined.index] = joined['msoa']
+
+    return codes
+
+
+def points_in_area(points, area):
+    """
+    Return the points which intersect an area (e.g. an MSOA boundary or a
+    buffer).
+
+    Points are first cut down to those within the area's bounding box, and
+    only these are tested exactly against the prepared area geometry.
+
+    """
+    if hasattr(area, 'unary_union'):
+        area = area.unary_union
+
+    minx, miny, maxx, maxy = area.bounds
+    candidates = points.cx[minx:maxx, miny:maxy]
+
+    if len(candidates) == 0:
+        return candidates
+
+    if hasattr(shapely, 'prepare'):
+        shapely.prepare(area)
+        mask = shapely.intersects(area, candidates.geometry.values)
+    else:
+        prepared = prep(area)
+        mask = [prepared.intersects(geom) for geom in candidates.geometry]
+
+    return candidates.loc[mask]
@@ -0,0 +1,286 @@
+"""
+Ingest 802.11 beacon frames from packet capture exports.
+
+A capture export (csv with No., Time, Source, Destination, Protocol, Length
+and Info columns, e.g. from Wireshark) is read in chunks. Beacon frames are
+picked out, and the BSSID (the frame source) and SSID (from the Info text)
+extracted with compiled patterns. Repeat beacons of the same network are
+dropped as they stream past, using a bounded set of recently seen networks,
+and each remaining beacon is located at the GPS fix nearest in time (a
+merge-asof against the drive track). The located networks are added to the
+AP store in the same form as WiGLE points.
+
+Beacons from sources with the manufacturer resolved (e.g. Sagemcom_0b:92:60)
+are dropped, as the full BSSID cannot be recovered to match WiGLE points, so
+exports should be made with physical address resolution turned off.
+
+Memory use depends on the chunk size and the size of the seen set, not on
+the length of the capture. A network evicted from the seen set before it
+is seen again is emitted twice, and the store keeps one observation of it.
+
+Capture times hold no date, so are taken to be on the date of the track
+(or one given), on the same clock as the track, rolling over at midnight.
+
+"""
+import os
+import re
+import argparse
+import collections
+
+import numpy as np
+import pandas as pd
+
+import core
+import effort
+import ingest
+import instrument
+import schemas
+from chunks import ChunkAccumulator
+
+CONFIG = core.CONFIG
+DEDUP_KEY = CONFIG['deduplication']['key']
+
+SEEN_SIZE = CONFIG.getint('capture', 'seen_size', fallback=100000)
+MAX_OFFSET = CONFIG.getfloat('capture', 'max_offset', fallback=60)
+CHUNK_SIZE = 100000
+
+BEACON = re.compile(r'^Beacon frame\b')
+SSID = re.compile(r'\bSSID=(.*)$')
+BSSID = re.compile(r'^(?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}$')
+#a MAC address with the manufacturer resolved (Sagemcom_0b:92:60)
+RESOLVED = re.compile(r'^[\w.-]+_(?:[0-9a-fA-F]{2}:){2}[0-9a-fA-F]{2}$')
+#how the export shows a hidden (blank or zeroed) network name
+HIDDEN_SSID = re.compile(r'^(?:Wildcard \(Broadcast\)|(?:\\+000)+)?$')
+
+
+class SeenNetworks(object):
+    """
+    A set of the most recently seen network keys, holding at most max_size
+    (the least recently seen are forgotten first).
+
+    """
+    def __init__(self, max_size=SEEN_SIZE):
+        self.max_size = max_size
+        self.keys = collections.OrderedDict()
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def filter_new(self, keys):
+        """
+        Return a mask of the keys not seen before (the first of any repeats
+        within keys), and record all of them as seen.
+
+        """
+        output = np.zeros(len(keys), dtype=bool)
+
+        for idx, key in enumerate(keys):
+            if key in self.keys:
+                self.keys.move_to_end(key)
+            else:
+                self.keys[key] = None
+                output[idx] = True
+                if len(self.keys) > self.max_size:
+                    self.keys.popitem(last=False)
+
+        return output
+
+
+def parse_beacons(chunk):
+    """
+    Return the frame number, time, BSSID and SSID of the beacon frames in a
+    chunk of a capture export, and the number of beacon frames dropped as
+    their source has the manufacturer resolved.
+
+    """
+    info = chunk['Info'].astype(str)
+    source = chunk['Source'].astype(str)
+
+    resolved = int((info.str.match(BEACON) & source.str.match(RESOLVED)).sum())
+
+    beacons = info.str.match(BEACON) & source.str.match(BSSID)
+    chunk, info, source = chunk.loc[beacons], info.loc[beacons], source.loc[beacons]
+
+    ssid = info.str.extract(SSID, expand=False).fillna('')
+    ssid = ssid.mask(ssid.str.match(HIDDEN_SSID), '')
+
+    return pd.DataFrame({
+        'frame': chunk['No.'].values,
+        'time': chunk['Time'].astype(str).values,
+        'bssid': source.str.lower().values,
+        'ssid': ssid.values,
+    }), resolved
+
+
+def get_network_keys(beacons, key=DEDUP_KEY):
+    """
+    Return the identity used to match repeat beacons of a network,
+    following the deduplication setting used for WiGLE points.
+
+    """
+    if key == 'bssid_ssid':
+        return beacons['bssid'] + '|' + beacons['ssid']
+
+    return beacons['bssid']
+
+
+def get_seconds(times, date, state):
+    """
+    Return capture times (HH:MM:SS) as seconds since the epoch on the given
+    date, adding a day each time the clock runs back past midnight. The
+    state dict carries the day and last time between chunks.
+
+    """
+    parts = times.str.split(':', expand=True).astype(float)
+    seconds = (parts[0] * 3600 + parts[1] * 60 + parts[2]).values
+
+    previous = np.r_[state.get('last', seconds[0]), seconds[:-1]]
+    days = state.get('days', 0) + np.cumsum(seconds < previous - 43200)
+
+    state['last'] = seconds[-1]
+    state['days'] = days[-1]
+
+    start = (pd.Timestamp(date, tz='UTC') - pd.Timestamp(0, tz='UTC')).total_seconds()
+
+    return start + days * 86400 + seconds
+
+
+def locate(beacons, fixes, max_offset=MAX_OFFSET):
+    """
+    Give each beacon the location of the nearest GPS fix in time, dropping
+    beacons with no fix within max_offset seconds.
+
+    """
+    beacons = beacons.sort_values('seconds', kind='stable')
+
+    located = pd.merge_asof(beacons, fixes[['time', 'x', 'y']], left_on='seconds',
+        right_on='time', direction='nearest', tolerance=max_offset)
+
+    return located.dropna(subset=['x', 'y'])
+
+
+@instrument.timed
+def load_capture(path, fixes, date, seen=None, chunksize=CHUNK_SIZE):
+    """
+    Stream a capture export, returning one located observation per new
+    network in the form of WiGLE points (British National Grid).
+
+    """
+    import geopandas as gpd
+
+    if seen is None:
+        seen = SeenNetworks()
+
+    output = ChunkAccumulator()
+    state = {}
+    resolved = 0
+
+    for chunk in schemas.read_csv(path, 'packet_capture', chunksize=chunksize):
+
+        instrument.add_rows(len(chunk))
+
+        beacons, dropped = parse_beacons(chunk)
+        resolved += dropped
+        if len(beacons) == 0:
+            continue
+
+        beacons['seconds'] = get_seconds(beacons['time'], date, state)
+
+        #only located beacons are marked as seen, so a network whose first
+        #beacons have no fix is kept from a later one
+        located = locate(beacons, fixes)
+        new = seen.filter_new(get_network_keys(located).tolist())
+        output.add(located.loc[new])
+
+    if resolved > 0:
+        print('Dropped {} beacons from sources with the manufacturer resolved'.format(
+            resolved))
+
+    if len(output) == 0:
+        return gpd.GeoDataFrame(geometry=[], crs='epsg:27700')
+
+    data = output.to_frame()
+    times = pd.to_datetime(data['seconds'], unit='s', utc=True)
+
+    data = pd.DataFrame({
+        'ap_id': data['frame'].values,
+        'name': data['ssid'].values,
+        'network_id': ('Network ID: ' + data['bssid']).values,
+        'encryption': 'Encryption: Unknown',
+        'time': ('Time: ' + times.dt.strftime('%Y-%m-%dT%H:%M:%S.000-00:00')).values,
+        'signal': 'Signal: ',
+        'accuracy': 'Accuracy: ',
+        'type': 'Type: WIFI',
+        'x': data['x'].values,
+        'y': data['y'].values,
+    })
+
+    geometry = gpd.points_from_xy(data.pop('x'), data.pop('y'))
+
+    return gpd.GeoDataFrame(data, geometry=geometry, crs='epsg:27700')
+
+
+def load_track(path):
+    """
+    Load all fixes of a GPS track, sorted by time.
+
+    """
+    fixes = pd.concat(list(effort.load_fixes(path)), ignore_index=True)
+
+    return fixes.sort_values('time', kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+
+    import boundaries
+    from oa_list import update_collected_data
+
+    parser = argparse.ArgumentParser(description='Add beacons from packet capture '
+        'exports to the AP store.')
+    parser.add_argument('paths', nargs='+', help='capture export csv files')
+    parser.add_argument('--gps', default=core.get_path('gps_trajectories'),
+        help='GPS track of the drive')
+    parser.add_argument('--date', default=None,
+        help='date of the capture (YYYY-MM-DD), by default that of the track')
+    args = parser.parse_args()
+
+    print('Loading the GPS track')
+    fixes = load_track(args.gps)
+    if len(fixes) == 0:
+        raise ValueError('No usable GPS fixes in {}'.format(args.gps))
+
+    date = args.date
+    if date is None:
+        date = pd.to_datetime(fixes['time'].iloc[0], unit='s').strftime('%Y-%m-%d')
+
+    folder = core.INTERMEDIATE_PATH
+    shapes = boundaries.load_boundaries(None, folder)
+    coarse_level = 100
+    coarse_shapes = boundaries.load_boundaries(coarse_level, folder)
+
+    store = core.get_path('ap_store')
+    path_ledger = core.get_path('ingestion_ledger')
+    seen = SeenNetworks()
+
+    for path in args.paths:
+
+        folder_capture, filename = os.path.split(os.path.abspath(path))
+        ledger = ingest.load_ledger(path_ledger)
+        if len(ingest.get_new_files(folder_capture, [filename], ledger, '.csv')) == 0:
+            print('Already ingested {}'.format(filename))
+            continue
+
+        print('Reading beacons from {}'.format(filename))
+        new_data = load_capture(path, fixes, date, seen)
+        print('Located {} networks'.format(len(new_data)))
+
+        if len(new_data) > 0:
+            touched, batch = update_collected_data(new_data, store, shapes,
+                coarse_shapes, coarse_level)
+            ingest.add_to_ledger(path_ledger, folder_capture, [filename], batch)
+            print('Marking {} areas for recomputation'.format(len(touched)))
+            ingest.mark_stale(core.get_path('stale_msoas'), touched)
+
+    instrument.write_report('capture')
@@ -0,0 +1,85 @@
+"""
+Collect data in chunks and materialize it once.
+
+Growing a list or DataFrame by repeated concatenation copies everything
+collected so far on every step. Chunks (per file or per area) are instead
+held here and joined in a single pass at the end.
+
+"""
+import itertools
+import pandas as pd
+
+
+class ChunkAccumulator(object):
+    """
+    Hold chunks of rows until they are needed as one table.
+
+    A chunk can be a list of records (dicts or geojson features) or a
+    DataFrame, but all chunks added should be of the same kind.
+
+    """
+    def __init__(self):
+        self.chunks = []
+        self.rows = 0
+
+
+    def add(self, chunk):
+        """
+        Add a chunk, skipping empty ones.
+
+        """
+        if len(chunk) > 0:
+            self.chunks.append(chunk)
+            self.rows += len(chunk)
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def is_frames(self):
+        """
+        Check whether the chunks held are DataFrames.
+
+        """
+        return len(self.chunks) > 0 and isinstance(self.chunks[0], pd.DataFrame)
+
+
+    def to_list(self):
+        """
+        Return all records as a single list.
+
+        """
+        return list(itertools.chain.from_iterable(self.chunks))
+
+
+    def to_frame(self):
+        """
+        Return all chunks as a single DataFrame.
+
+        """
+        if len(self.chunks) == 0:
+            return pd.DataFrame()
+
+        if self.is_frames():
+            return pd.concat(self.chunks, ignore_index=True)
+
+        return pd.DataFrame.from_records(self.to_list())
+
+
+    def to_geoframe(self, crs=None):
+        """
+        Return all chunks as a single GeoDataFrame. Lists of records are
+        treated as geojson features.
+
+        """
+        import geopandas as gpd
+
+        if len(self.chunks) == 0:
+            return gpd.GeoDataFrame(geometry=[], crs=crs)
+
+        if self.is_frames():
+            data = pd.concat(self.chunks, ignore_index=True)
+            return gpd.GeoDataFrame(data, geometry='geometry', crs=crs)
+
+        return gpd.GeoDataFrame.from_features(self.to_list(), crs=crs)
@@ -0,0 +1,143 @@
+"""
+Configuration, file locations and shared data loaders.
+
+All scripts take their settings from script_config.ini, and the location of
+each file shared between stages, from here. Datasets used by several stages
+(the area lookup, area boundaries and local authority district shapes) are
+loaded through memoized loaders, so a long-lived process loads each only
+once. Loaded data are shared between callers and should be copied before
+being modified.
+
+"""
+import os
+import functools
+import configparser
+
+import schemas
+
+CONFIG = configparser.ConfigParser()
+CONFIG.read(os.path.join(os.path.dirname(__file__), 'script_config.ini'))
+BASE_PATH = CONFIG['file_locations']['base_path']
+RESULTS_PATH = CONFIG['file_locations']['results']
+VIS_PATH = CONFIG['file_locations']['vis']
+
+INTERMEDIATE_PATH = os.path.join(BASE_PATH, 'intermediate')
+
+PATHS = {
+    #inputs
+    'kml': os.path.join(BASE_PATH, 'wigle', 'all_kml_data'),
+    'lad_shapes': os.path.join(BASE_PATH, 'shapes', 'lad_uk_2016-12.shp'),
+    'prems_by_lad': os.path.join(BASE_PATH, 'prems_by_lad'),
+    'business_counts': os.path.join(BASE_PATH, 'ons_local_business_counts',
+        'business_counts.csv'),
+    'gps_trajectories': os.path.join(BASE_PATH, 'gps_trajectories.csv'),
+    'pcd_sectors': os.path.join(BASE_PATH, 'pcd_sector_geotypes',
+        'pcd_sector_geotypes.csv'),
+    'pcd_sector_shapes': os.path.join(BASE_PATH, 'shapes', 'pcd_sectors.shp'),
+    #intermediate outputs
+    'oa_lookup': os.path.join(INTERMEDIATE_PATH, 'oa_lookup.csv'),
+    'oa_list': os.path.join(INTERMEDIATE_PATH, 'oa_list.csv'),
+    'output_areas': os.path.join(INTERMEDIATE_PATH, 'output_areas.shp'),
+    'area_features': os.path.join(INTERMEDIATE_PATH, 'area_features.csv'),
+    'ap_store': os.path.join(INTERMEDIATE_PATH, 'ap_store'),
+    'ingestion_ledger': os.path.join(INTERMEDIATE_PATH, 'ingestion_ledger.csv'),
+    'stale_msoas': os.path.join(INTERMEDIATE_PATH, 'stale_msoas.csv'),
+    'prems_by_lad_msoa': os.path.join(INTERMEDIATE_PATH, 'prems_by_lad_msoa'),
+    'hh_by_lad_msoa': os.path.join(INTERMEDIATE_PATH, 'hh_by_lad_msoa'),
+    'population_store': os.path.join(INTERMEDIATE_PATH, 'population_store'),
+    'maup': os.path.join(INTERMEDIATE_PATH, 'maup'),
+    'crosswalk_msoa_pcd_sector': os.path.join(INTERMEDIATE_PATH,
+        'crosswalk_msoa_pcd_sector.csv'),
+    'crosswalk_msoa_pcd_sector_approx': os.path.join(INTERMEDIATE_PATH,
+        'crosswalk_msoa_pcd_sector_approx.csv'),
+    'hh_data_aggregated': os.path.join(INTERMEDIATE_PATH, 'hh_data_aggregated'),
+    #results
+    'ns_results': os.path.join(RESULTS_PATH, 'estimated_adoption_ns.csv'),
+    'ns_results_pcd_sectors': os.path.join(RESULTS_PATH,
+        'estimated_adoption_ns_pcd_sectors.csv'),
+    'ns_results_pcd_sectors_approx': os.path.join(RESULTS_PATH,
+        'estimated_adoption_ns_pcd_sectors_approx.csv'),
+}
+
+
+def get_path(name):
+    """
+    Return the canonical location of a shared file or folder.
+
+    """
+    return PATHS[name]
+
+
+def get_mtime(path):
+    """
+    Return the latest modification time of a file, or of any file within a
+    folder. Returns None if the path does not exist.
+
+    """
+    if not os.path.exists(path):
+        return None
+
+    latest = os.path.getmtime(path)
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for filename in files:
+                latest = max(latest, os.path.getmtime(os.path.join(root, filename)))
+
+    return latest
+
+
+@functools.lru_cache(maxsize=None)
+def load_oa_lookup(path=None):
+    """
+    Load the area lookup written by preprocess.py (one row per MSOA).
+
+    """
+    if path is None:
+        path = PATHS['oa_lookup']
+
+    return schemas.read_csv(path, 'oa_lookup')
+
+
+@functools.lru_cache(maxsize=None)
+def load_output_areas(path=None):
+    """
+    Load the area boundaries (simplified to 10 m) in British National Grid.
+
+    """
+    import geopandas as gpd
+
+    if path is None:
+        path = PATHS['output_areas']
+
+    data = gpd.read_file(path)
+    data.crs = 'epsg:27700'
+
+    return data
+
+
+@functools.lru_cache(maxsize=None)
+def load_lad_shapes(path=None):
+    """
+    Load the local authority district shapes in British National Grid.
+
+    """
+    import geopandas as gpd
+
+    if path is None:
+        path = PATHS['lad_shapes']
+
+    data = gpd.read_file(path)
+    data.crs = 'epsg:27700'
+
+    return data
+
+
+def clear_cache():
+    """
+    Forget all loaded data, e.g. after a stage rewrites a shared file.
+
+    """
+    load_oa_lookup.cache_clear()
+    load_output_areas.cache_clear()
+    load_lad_shapes.cache_clear()
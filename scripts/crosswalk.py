@@ -0,0 +1,127 @@
+"""
+Sparse crosswalks for moving area results between spatial units.
+
+A crosswalk lists, for each pair of overlapping source and target areas,
+the share of the source area's values which belongs to the target (the
+weights of a source sum to at most 1). It is computed once, stored as a
+csv of (source, target, weight) rows, and turned into a sparse matrix, so
+re-aggregating a result to the target units is a sparse matrix product
+rather than a geometric overlay. Only additive (count) columns should be
+aggregated this way; rates and densities are recomputed from the counts.
+
+"""
+import os
+
+import schemas
+
+
+def from_overlay(source, target, source_id, target_id):
+    """
+    Build an area-weighted crosswalk from the geometric overlay of two
+    GeoDataFrames in the same projected crs.
+
+    """
+    import geopandas as gpd
+
+    source = source[[source_id, 'geometry']].rename(columns={source_id: 'source'})
+    target = target[[target_id, 'geometry']].rename(columns={target_id: 'target'})
+
+    source_area = source.set_index('source').geometry.area
+
+    pieces = gpd.overlay(source, target, how='intersection', keep_geom_type=True)
+    pieces['weight'] = pieces.geometry.area / pieces['source'].map(source_area).values
+
+    output = pieces.groupby(['source', 'target'], as_index=False)['weight'].sum()
+
+    return output.loc[output['weight'] > 0].reset_index(drop=True)
+
+
+def from_shares(source, target, key, source_id, target_id, share):
+    """
+    Build a crosswalk without geometries, splitting each source area across
+    the target areas with the same key (e.g. LAD) in proportion to a target
+    column (e.g. area or population).
+
+    Sources with no target sharing their key are left out.
+
+    """
+    target = target[[key, target_id, share]].rename(columns={target_id: 'target'})
+    total = target.groupby(key)[share].transform('sum')
+    target = target.assign(weight=(target[share] / total).fillna(0))
+
+    source = source[[key, source_id]].rename(columns={source_id: 'source'})
+    output = source.merge(target[[key, 'target', 'weight']], on=key, how='inner')
+
+    output = output.loc[output['weight'] > 0, ['source', 'target', 'weight']]
+
+    return output.reset_index(drop=True)
+
+
+def write(crosswalk, path):
+    """
+    Write a crosswalk to csv.
+
+    """
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    crosswalk.to_csv(path, index=False)
+
+
+def load(path):
+    """
+    Load a crosswalk written by `write`.
+
+    """
+    return schemas.read_csv(path, 'crosswalk')
+
+
+def to_matrix(crosswalk, source_ids, target_ids=None):
+    """
+    Return the crosswalk as a sparse (targets x sources) matrix, with
+    sources ordered as source_ids, and the target ids of its rows (by
+    default, every target reached from source_ids). Pairs whose source is
+    not in source_ids are dropped.
+
+    """
+    import numpy as np
+    import pandas as pd
+    from scipy import sparse
+
+    source_index = pd.Index(source_ids)
+    cols = source_index.get_indexer(crosswalk['source'])
+
+    if target_ids is None:
+        target_ids = pd.unique(crosswalk['target'][cols >= 0])
+    target_index = pd.Index(target_ids)
+
+    rows = target_index.get_indexer(crosswalk['target'])
+    keep = (cols >= 0) & (rows >= 0)
+
+    matrix = sparse.csr_matrix(
+        (crosswalk['weight'].to_numpy(dtype=np.float64)[keep], (rows[keep], cols[keep])),
+        shape=(len(target_index), len(source_index)),
+    )
+
+    return matrix, target_index
+
+
+def aggregate(data, crosswalk, source_id, columns, target_ids=None,
+    target_id='target'):
+    """
+    Aggregate additive columns of a table with one row per source area to
+    the target areas of a crosswalk, returning one row per target area.
+
+    """
+    import pandas as pd
+
+    matrix, targets = to_matrix(crosswalk, data[source_id].values, target_ids)
+
+    values = data[columns].to_numpy(dtype='float64')
+    values[~(values == values)] = 0
+
+    output = pd.DataFrame(matrix @ values, columns=columns)
+    output.insert(0, target_id, targets.values)
+
+    return output
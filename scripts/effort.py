@@ -0,0 +1,256 @@
+"""
+Sampling effort from the GPS tracks of the drives.
+
+Collected AP densities depend on how much of an area was driven as well as
+on how many APs it has. The GPS fixes of the drives are read in chunks,
+projected to British National Grid in bulk, and joined into segments
+between consecutive fixes (breaking the track at long gaps and implausible
+jumps). Segments are densified into short pieces, and the distance driven,
+time spent (dwell) and speed-weighted exposure of each piece are summed on
+the tiles of the density surface grid of raster.py and, through the
+spatial index of the area boundaries, for each MSOA.
+
+Exposure is the distance driven, scaled down at speeds above the reference
+speed, where each AP is in range for fewer scans.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import ap_store
+import core
+import instrument
+import raster
+import schemas
+from chunks import ChunkAccumulator
+
+CONFIG = core.CONFIG
+
+STEP = CONFIG.getfloat('effort', 'step', fallback=25)
+MAX_GAP = CONFIG.getfloat('effort', 'max_gap', fallback=300)
+MAX_ACCURACY = CONFIG.getfloat('effort', 'max_accuracy', fallback=50)
+REFERENCE_SPEED = CONFIG.getfloat('effort', 'reference_speed', fallback=30)
+
+#faster than this (km/h) between two fixes is treated as a GPS error
+MAX_SPEED = 200
+CHUNK_SIZE = 1000000
+
+MEASURES = ['distance_m', 'dwell_s', 'exposure_m']
+
+
+def load_fixes(path, chunksize=CHUNK_SIZE):
+    """
+    Yield chunks of the GPS fixes (x, y, time in seconds and recorded
+    speed), dropping inaccurate fixes.
+
+    """
+    from pyproj import Transformer
+
+    transformer = Transformer.from_crs('epsg:4326', 'epsg:27700', always_xy=True)
+
+    for chunk in schemas.read_csv(path, 'gps_trajectories', chunksize=chunksize):
+
+        instrument.add_rows(len(chunk))
+
+        chunk = chunk.dropna(subset=['Lat', 'Lng', 'Date2'])
+        chunk = chunk.loc[~(chunk['Accuracy'] > MAX_ACCURACY)]
+
+        x, y = transformer.transform(chunk['Lng'].values, chunk['Lat'].values)
+        time = pd.to_datetime(chunk['Date2'], utc=True) - pd.Timestamp(0, tz='UTC')
+
+        fixes = pd.DataFrame({
+            'x': x,
+            'y': y,
+            'time': time.dt.total_seconds().values,
+            'speed_kmh': chunk['Speed(km/h)'].values.astype(np.float64),
+        })
+
+        yield fixes.sort_values('time', kind='stable').reset_index(drop=True)
+
+
+def get_segments(fixes):
+    """
+    Join consecutive fixes into segments, leaving out gaps longer than
+    MAX_GAP and jumps faster than MAX_SPEED.
+
+    """
+    start = fixes.iloc[:-1].reset_index(drop=True)
+    end = fixes.iloc[1:].reset_index(drop=True)
+
+    length = np.hypot(end['x'] - start['x'], end['y'] - start['y'])
+    duration = end['time'] - start['time']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derived = length / duration * 3.6
+
+    keep = (duration > 0) & (duration <= MAX_GAP) & (derived <= MAX_SPEED)
+
+    #the recorded speed where available, or the speed between the fixes
+    speed = pd.concat([start['speed_kmh'], end['speed_kmh']], axis=1).mean(axis=1)
+    speed = speed.fillna(derived)
+
+    return pd.DataFrame({
+        'x0': start['x'],
+        'y0': start['y'],
+        'x1': end['x'],
+        'y1': end['y'],
+        'length': length,
+        'duration': duration,
+        'speed_kmh': speed,
+    }).loc[keep].reset_index(drop=True)
+
+
+def densify(segments, step=STEP):
+    """
+    Split each segment into pieces of at most step metres, returning the
+    midpoint, distance, dwell time and exposure of each piece.
+
+    """
+    pieces = np.maximum(np.ceil(segments['length'].values / step), 1).astype(int)
+
+    index = np.repeat(np.arange(len(segments)), pieces)
+    first = np.repeat(np.cumsum(pieces) - pieces, pieces)
+    share = (np.arange(len(index)) - first + 0.5) / pieces[index]
+
+    segments = segments.iloc[index]
+
+    distance = (segments['length'] / pieces[index]).values
+    speed = segments['speed_kmh'].values
+    weight = np.minimum(1, REFERENCE_SPEED / np.maximum(speed, REFERENCE_SPEED))
+
+    return pd.DataFrame({
+        'x': segments['x0'].values + share * (segments['x1'] - segments['x0']).values,
+        'y': segments['y0'].values + share * (segments['y1'] - segments['y0']).values,
+        'distance_m': distance,
+        'dwell_s': (segments['duration'] / pieces[index]).values,
+        'exposure_m': distance * weight,
+    })
+
+
+def assign_areas(pieces, shapes):
+    """
+    Return the MSOA containing each piece (None outside all areas), using
+    the spatial index of the area shapes.
+
+    """
+    import geopandas as gpd
+
+    points = gpd.points_from_xy(pieces['x'], pieces['y'])
+    point_idx, shape_idx = shapes.sindex.query(points, predicate='within')
+
+    output = np.full(len(pieces), None, dtype=object)
+    output[point_idx] = shapes['msoa'].values[shape_idx]
+
+    return output
+
+
+@instrument.timed
+def get_effort(path, shapes, tiles):
+    """
+    Sum the sampling effort of all tracks on the grid tiles given and for
+    each MSOA. Returns the grids of each tile which was driven through.
+
+    """
+    tiles = set(tiles)
+    grids = {}
+    by_area = ChunkAccumulator()
+
+    previous = None
+
+    for fixes in load_fixes(path):
+
+        #carry the last fix over, so segments span chunk boundaries
+        if previous is not None:
+            fixes = pd.concat([previous, fixes], ignore_index=True)
+        previous = fixes.iloc[-1:]
+
+        pieces = densify(get_segments(fixes))
+        if len(pieces) == 0:
+            continue
+
+        for tile, index in raster.group_by_tile(pieces['x'], pieces['y']).items():
+
+            tile = (int(tile[0]), int(tile[1]))
+            if tile not in tiles:
+                continue
+
+            origin, shape = raster.get_tile_grid(tile)
+            if tile not in grids:
+                grids[tile] = {measure: np.zeros(shape, dtype=np.float32)
+                    for measure in MEASURES}
+
+            subset = pieces.iloc[index]
+            for measure in MEASURES:
+                grids[tile][measure] += raster.rasterize(subset['x'], subset['y'],
+                    origin, shape, subset[measure])
+
+        pieces['msoa'] = assign_areas(pieces, shapes)
+        by_area.add(pieces.groupby('msoa')[MEASURES].sum().reset_index())
+
+    if len(by_area) > 0:
+        by_area = by_area.to_frame().groupby('msoa', as_index=False)[MEASURES].sum()
+    else:
+        by_area = pd.DataFrame(columns=['msoa'] + MEASURES)
+
+    return grids, by_area
+
+
+def add_collected_aps(by_area):
+    """
+    Add the collected APs of each MSOA, per km driven and per km of exposure.
+
+    """
+    counts = ap_store.get_counts(core.get_path('ap_store'))
+
+    by_area['aps_collected'] = by_area['msoa'].map(counts).fillna(0).astype(int)
+
+    driven = (by_area['distance_m'] / 1e3).where(by_area['distance_m'] > 0)
+    exposure = (by_area['exposure_m'] / 1e3).where(by_area['exposure_m'] > 0)
+
+    by_area['aps_per_km'] = by_area['aps_collected'] / driven
+    by_area['aps_per_exposure_km'] = by_area['aps_collected'] / exposure
+
+    return by_area
+
+
+if __name__ == '__main__':
+
+    print('----Working on sampling effort')
+    print('----')
+
+    areas = pd.read_csv(core.get_path('oa_list'))['msoa'].tolist()
+
+    shapes = core.load_output_areas()
+    studied = shapes.loc[shapes['msoa'].isin(areas)]
+
+    #the same tiles as the density surfaces of raster.py
+    tiles = raster.get_tiles(studied.bounds.values)
+
+    print('Processing GPS tracks')
+    grids, by_area = get_effort(core.get_path('gps_trajectories'), shapes, tiles)
+
+    if os.path.exists(core.get_path('ap_store')):
+        by_area = add_collected_aps(by_area)
+
+    print('Drove {:.1f} km over {:.1f} hours within the area boundaries'.format(
+        by_area['distance_m'].sum() / 1e3, by_area['dwell_s'].sum() / 3600))
+
+    folder = os.path.join(core.RESULTS_PATH, 'effort')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    by_area.to_csv(os.path.join(folder, 'effort_msoa.csv'), index=False)
+
+    folder = os.path.join(folder, 'grid')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    for tile, arrays in grids.items():
+        origin, _ = raster.get_tile_grid(tile)
+        np.savez_compressed(raster.get_tile_path(folder, tile),
+            origin=np.array(origin, dtype=np.float64),
+            resolution=np.array(raster.RESOLUTION), **arrays)
+
+    instrument.write_report('effort')
@@ -0,0 +1,133 @@
+"""
+Track which collected (.kml or capture) files have already been ingested.
+
+The ledger records each file's name, size and hash so only new or changed
+drives are parsed, and the stale list records which MSOAs received new
+points and so need recomputing in sc.py. Entries are keyed by name and
+hash, so a re-exported file of the same name is ingested again as a new
+entry (its points are reconciled with the earlier ones by deduplication),
+and the earlier entry keeps the batch holding its points.
+
+"""
+import os
+import hashlib
+import pandas as pd
+
+LEDGER_COLUMNS = ['filename', 'size', 'sha256', 'batch']
+
+
+def get_file_hash(path, block_size=2**20):
+    """
+    Return the sha256 hash of a file, read in blocks.
+
+    """
+    sha = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+def load_ledger(path):
+    """
+    Load the ingestion ledger, or an empty ledger if none exists.
+
+    """
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=LEDGER_COLUMNS)
+
+    return pd.read_csv(path, dtype={'filename': str, 'sha256': str})
+
+
+def get_new_files(folder, files, ledger, extension='.kml'):
+    """
+    Return the kml (or other collected data) files which are not yet in the
+    ledger.
+
+    A file is only hashed when its name and size match a ledger entry, to
+    confirm it has not changed.
+
+    """
+    known = {}
+    for item in ledger.to_dict('records'):
+        known.setdefault((item['filename'], int(item['size'])), set()).add(item['sha256'])
+
+    new_files = []
+
+    for filename in sorted(files):
+
+        if not filename.endswith(extension):
+            continue
+
+        path = os.path.join(folder, filename)
+        size = os.path.getsize(path)
+
+        if (filename, size) not in known:
+            new_files.append(filename)
+        elif get_file_hash(path) not in known[(filename, size)]:
+            new_files.append(filename)
+
+    return new_files
+
+
+def add_to_ledger(path, folder, files, batch):
+    """
+    Record files as ingested in a given batch and write the ledger.
+
+    """
+    ledger = load_ledger(path)
+
+    new_entries = []
+
+    for filename in files:
+        path_file = os.path.join(folder, filename)
+        new_entries.append({
+            'filename': filename,
+            'size': os.path.getsize(path_file),
+            'sha256': get_file_hash(path_file),
+            'batch': batch,
+        })
+
+    new_entries = pd.DataFrame(new_entries, columns=LEDGER_COLUMNS)
+
+    known = ledger.set_index(['filename', 'sha256']).index
+    ledger = ledger.loc[~known.isin(new_entries.set_index(['filename', 'sha256']).index)]
+    ledger = pd.concat([ledger, new_entries], ignore_index=True)
+    ledger = ledger[LEDGER_COLUMNS]
+
+    ledger.to_csv(path, index=False)
+
+    return ledger
+
+
+def load_stale(path):
+    """
+    Load the list of MSOAs marked for recomputation.
+
+    """
+    if not os.path.exists(path):
+        return []
+
+    return pd.read_csv(path, dtype={'msoa': str})['msoa'].tolist()
+
+
+def mark_stale(path, msoas):
+    """
+    Add MSOAs to the list of areas needing recomputation.
+
+    """
+    stale = set(load_stale(path)) | set(msoas)
+
+    stale = pd.DataFrame({'msoa': sorted(stale)})
+    stale.to_csv(path, index=False)
+
+
+def clear_stale(path):
+    """
+    Remove the list of MSOAs marked for recomputation.
+
+    """
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,378 @@
+"""
+Time named spans of the pipeline and write a run report.
+
+Spans record their duration, the rows processed and the process' peak
+memory so far. They can be nested, opened with `span` (a context
+manager), `timed` (a function decorator) or `track` (one span per item
+of a loop, e.g. per MSOA). `write_report` saves all spans as json and csv
+along with a summary of the slowest MSOAs.
+
+Instrumentation is switched on in script_config.ini or with the
+STAWPY_INSTRUMENT environment variable. When off, spans are no-ops.
+
+Separately, `profile` records a function-level profile (cProfile) for a
+configured list of MSOAs, or for the N slowest, and `write_profiles` saves
+them under results/<msoa>/ with a combined top-functions table.
+
+"""
+import os
+import sys
+import time
+import json
+import heapq
+import pstats
+import cProfile
+import functools
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import core
+
+CONFIG = core.CONFIG
+RESULTS_PATH = core.RESULTS_PATH
+
+ENABLED = CONFIG.getboolean('instrumentation', 'enabled', fallback=False)
+if 'STAWPY_INSTRUMENT' in os.environ:
+    ENABLED = os.environ['STAWPY_INSTRUMENT'].lower() in ('1', 'true', 'yes')
+
+PROFILE_MSOAS = CONFIG.get('profiling', 'msoas', fallback='')
+PROFILE_MSOAS = os.environ.get('STAWPY_PROFILE_MSOAS', PROFILE_MSOAS)
+PROFILE_MSOAS = set(m.strip() for m in PROFILE_MSOAS.split(',') if m.strip())
+
+PROFILE_SLOWEST = CONFIG.getint('profiling', 'slowest', fallback=0)
+PROFILE_SLOWEST = int(os.environ.get('STAWPY_PROFILE_SLOWEST', PROFILE_SLOWEST))
+
+SLOWEST_MSOAS = 20
+TOP_FUNCTIONS = 25
+
+RECORDS = []
+ACTIVE = []
+RUN_START = time.perf_counter()
+
+#profiles to save: those requested by name, and a heap of the slowest
+PROFILES = []
+SLOWEST_PROFILES = []
+
+
+def get_peak_rss_mb():
+    """
+    Return the peak resident memory of this process so far (MB).
+
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    #ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if sys.platform == 'darwin':
+        return peak / 1024 ** 2
+
+    return peak / 1024
+
+
+class Span(object):
+    """
+    A named, timed section of a run.
+
+    """
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.rows = 0
+        self.start_time = None
+
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        ACTIVE.append(self)
+        return self
+
+
+    def stop(self):
+        end_time = time.perf_counter()
+        if ACTIVE and ACTIVE[-1] is self:
+            ACTIVE.pop()
+
+        record = {
+            'name': self.name,
+            'parent': ACTIVE[-1].name if ACTIVE else None,
+            'depth': len(ACTIVE),
+            'start_s': round(self.start_time - RUN_START, 6),
+            'duration_s': round(end_time - self.start_time, 6),
+            'rows': self.rows,
+            'peak_rss_mb': get_peak_rss_mb(),
+        }
+        record.update(self.attributes)
+
+        RECORDS.append(record)
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class NullSpan(object):
+    """
+    A span which does nothing, used when instrumentation is off.
+
+    """
+    rows = 0
+
+    def start(self):
+        return self
+
+    def stop(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, **attributes):
+    """
+    Return a span to time a section of code, e.g.
+
+        with instrument.span('load_kml'):
+
+    """
+    if not ENABLED:
+        return NULL_SPAN
+
+    return Span(name, **attributes)
+
+
+def timed(func):
+    """
+    Decorate a function so each call is recorded as a span.
+
+    """
+    name = '{}.{}'.format(func.__module__, func.__name__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return func(*args, **kwargs)
+        with Span(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def track(items, name, label='msoa', **attributes):
+    """
+    Iterate over items, recording each iteration as its own span with the
+    item stored under the given label (e.g. one span per MSOA).
+
+    """
+    if not ENABLED:
+        return items
+
+    return _track(items, name, label, attributes)
+
+
+def _track(items, name, label, attributes):
+
+    for item in items:
+        attributes[label] = item
+        current = Span(name, **attributes).start()
+        try:
+            yield item
+        finally:
+            current.stop()
+
+
+def add_rows(rows):
+    """
+    Add to the count of rows processed by the innermost active span.
+
+    """
+    if ENABLED and ACTIVE:
+        ACTIVE[-1].rows += int(rows)
+
+
+def get_slowest_msoas(records, n=SLOWEST_MSOAS):
+    """
+    Return the n slowest MSOAs, summing all spans recorded for each.
+
+    """
+    totals = {}
+
+    for record in records:
+        msoa = record.get('msoa')
+        if msoa is None:
+            continue
+        if msoa not in totals:
+            totals[msoa] = {'msoa': msoa, 'duration_s': 0, 'rows': 0, 'spans': 0}
+        totals[msoa]['duration_s'] += record['duration_s']
+        totals[msoa]['rows'] += record['rows']
+        totals[msoa]['spans'] += 1
+
+    totals = sorted(totals.values(), key=lambda x: x['duration_s'], reverse=True)
+
+    return totals[:n]
+
+
+def write_report(stage, folder=None):
+    """
+    Write all recorded spans for a stage as json and csv, with a summary of
+    the slowest MSOAs. Returns the path of the json report, or None if
+    instrumentation is off.
+
+    """
+    if not ENABLED:
+        return None
+
+    import pandas as pd
+
+    if folder is None:
+        folder = os.path.join(RESULTS_PATH, 'run_reports')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    stamp = time.strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(folder, '{}_{}'.format(stage, stamp))
+
+    slowest = get_slowest_msoas(RECORDS)
+
+    report = {
+        'stage': stage,
+        'created': stamp,
+        'wall_time_s': round(time.perf_counter() - RUN_START, 6),
+        'peak_rss_mb': get_peak_rss_mb(),
+        'spans': RECORDS,
+        'slowest_msoas': slowest,
+    }
+
+    with open(path + '.json', 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    pd.DataFrame(RECORDS).to_csv(path + '.csv', index=False)
+    pd.DataFrame(slowest).to_csv(path + '_slowest_msoas.csv', index=False)
+
+    print('Slowest areas for {}:'.format(stage))
+    for item in slowest[:5]:
+        print('-- {msoa}: {duration_s:.2f}s'.format(**item))
+    print('Run report written to {}.json'.format(path))
+
+    return path + '.json'
+
+
+def profile(items, label=''):
+    """
+    Iterate over MSOA codes, profiling each iteration (the work done in the
+    loop body) for the configured MSOAs, or for all of them when keeping
+    the N slowest. The label (e.g. the buffer size) names the profile file.
+
+    """
+    if not PROFILE_MSOAS and PROFILE_SLOWEST == 0:
+        return items
+
+    return _profile(items, label)
+
+
+def _profile(items, label):
+
+    for count, msoa in enumerate(items):
+
+        if msoa not in PROFILE_MSOAS and PROFILE_SLOWEST == 0:
+            yield msoa
+            continue
+
+        profiler = cProfile.Profile()
+        start_time = time.perf_counter()
+        profiler.enable()
+        try:
+            yield msoa
+        finally:
+            profiler.disable()
+            duration = time.perf_counter() - start_time
+
+            item = (duration, count, str(msoa), str(label), pstats.Stats(profiler))
+
+            if msoa in PROFILE_MSOAS:
+                PROFILES.append(item)
+            else:
+                heapq.heappush(SLOWEST_PROFILES, item)
+                if len(SLOWEST_PROFILES) > PROFILE_SLOWEST:
+                    heapq.heappop(SLOWEST_PROFILES)
+
+
+def get_top_functions(stats, n=TOP_FUNCTIONS):
+    """
+    Return the functions with the most internal time in a profile.
+
+    """
+    output = []
+
+    for (filename, line, function), values in stats.stats.items():
+        calls, total_calls, total_time, cumulative_time, callers = values
+        output.append({
+            'function': '{}:{}({})'.format(os.path.basename(filename), line, function),
+            'ncalls': total_calls,
+            'tottime_s': round(total_time, 6),
+            'cumtime_s': round(cumulative_time, 6),
+        })
+
+    output = sorted(output, key=lambda x: x['tottime_s'], reverse=True)
+
+    return output[:n]
+
+
+def write_profiles(stage):
+    """
+    Save each kept profile to results/<msoa>/profile_<label>.prof (readable
+    with pstats or snakeviz), and a table of the top functions across all
+    of them. Returns the path of the table, or None if nothing was profiled.
+
+    """
+    profiles = PROFILES + sorted(SLOWEST_PROFILES, reverse=True)
+
+    if len(profiles) == 0:
+        return None
+
+    import pandas as pd
+
+    rows = []
+
+    for duration, count, msoa, label, stats in profiles:
+
+        folder = os.path.join(RESULTS_PATH, msoa)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        filename = 'profile_{}.prof'.format(label) if label else 'profile.prof'
+        stats.dump_stats(os.path.join(folder, filename))
+
+        for item in get_top_functions(stats):
+            item.update({
+                'msoa': msoa,
+                'label': label,
+                'msoa_duration_s': round(duration, 6),
+            })
+            rows.append(item)
+
+    path = os.path.join(RESULTS_PATH, 'profile_top_functions_{}.csv'.format(stage))
+    rows = pd.DataFrame(rows)[[
+        'msoa', 'label', 'msoa_duration_s', 'function',
+        'ncalls', 'tottime_s', 'cumtime_s'
+    ]]
+    rows.to_csv(path, index=False)
+
+    print('Profiles for {} areas written, top functions in {}'.format(
+        len(profiles), path))
+
+    return path
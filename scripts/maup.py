@@ -0,0 +1,395 @@
+"""
+Multi-scale analysis of the modifiable areal unit problem (MAUP).
+
+APs, premises and households are counted once for small base units (the
+part of each studied MSOA within each cell of a fine British National Grid)
+and moved to each zoning (OA, LSOA, MSOA, LAD and regular grids of several
+cell sizes) with a precomputed sparse crosswalk, so every scale is one
+sparse product rather than a geometric overlay. Density statistics are
+then compared across zonings.
+
+Base units nest exactly within MSOAs, LADs and grids whose cell size is a
+multiple of the base cell. OA and LSOA boundaries are not part of the
+inputs, so base units are split between OAs in proportion to the premises
+of each OA they hold, and base units without premises are not counted at
+these scales. Households, known by MSOA, are spread over the base units of
+each MSOA in proportion to residential premises.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import ap_store
+import core
+import crosswalk
+import instrument
+import schemas
+
+BASE_PATH = core.BASE_PATH
+CONFIG = core.CONFIG
+
+BASE_CELL = CONFIG.getint('maup', 'base_cell', fallback=250)
+GRIDS = [
+    int(size) for size in
+    CONFIG.get('maup', 'grids', fallback='500, 1000, 2000').split(',')
+]
+
+QUANTITIES = ['aps', 'premises', 'residential', 'non_residential', 'households']
+
+UNITS_FILENAME = 'units.csv'
+
+
+def get_zonings(grids=GRIDS, base_cell=BASE_CELL):
+    """
+    Return the names of all zonings, from finest to coarsest.
+
+    """
+    for size in grids:
+        if size % base_cell != 0:
+            raise ValueError('Grid size {}m is not a multiple of the {}m base cell'.format(
+                size, base_cell))
+
+    return ['oa', 'lsoa', 'msoa', 'lad'] + ['grid_{}m'.format(size) for size in grids]
+
+
+def get_unit_ids(msoa, cx, cy):
+    """
+    Return the id of the base unit for each MSOA and base cell.
+
+    """
+    return msoa.astype(str) + '_' + cx.astype(str) + '_' + cy.astype(str)
+
+
+@instrument.timed
+def build_units(shapes, lookup, base_cell=BASE_CELL):
+    """
+    Cut each MSOA shape by the base grid, returning one row per base unit
+    with its MSOA, LAD, cell and area.
+
+    """
+    import shapely
+
+    lads = lookup.set_index('msoa')['lad'].astype(str)
+
+    output = []
+
+    for msoa, geometry in zip(shapes['msoa'], shapes.geometry):
+
+        minx, miny, maxx, maxy = geometry.bounds
+        xs = np.arange(int(minx // base_cell), int(maxx // base_cell) + 1)
+        ys = np.arange(int(miny // base_cell), int(maxy // base_cell) + 1)
+        cx, cy = [values.ravel() for values in np.meshgrid(xs, ys)]
+
+        cells = shapely.box(cx * base_cell, cy * base_cell,
+            (cx + 1) * base_cell, (cy + 1) * base_cell)
+        area = shapely.area(shapely.intersection(cells, geometry))
+
+        keep = area > 0
+        output.append(pd.DataFrame({
+            'msoa': msoa,
+            'lad': lads.get(msoa),
+            'cx': cx[keep],
+            'cy': cy[keep],
+            'area_km2': area[keep] / 1e6,
+        }))
+
+    output = pd.concat(output, ignore_index=True)
+    output.insert(0, 'unit', get_unit_ids(output['msoa'], output['cx'], output['cy']))
+
+    return output
+
+
+def get_lads(areas, lookup):
+    """
+    Return the LADs holding the given MSOAs.
+
+    """
+    return lookup.loc[lookup['msoa'].isin(areas), 'lad'].astype(str).unique()
+
+
+@instrument.timed
+def load_premises(areas, lookup, base_cell=BASE_CELL):
+    """
+    Load the premises in the given MSOAs, returning the OA, LSOA, location,
+    base unit and function class of each.
+
+    """
+    import geopandas as gpd
+
+    folder = os.path.join(BASE_PATH, 'intermediate', 'prems_by_lad_msoa')
+    lads = get_lads(areas, lookup)
+
+    output = []
+
+    for lad in lads:
+
+        oas = schemas.read_csv(os.path.join(folder, lad, 'lookup.csv'), 'oa_lut',
+            ['OA11CD', 'LSOA11CD', 'MSOA11CD'])
+        oas = oas.loc[oas['MSOA11CD'].isin(areas)]
+
+        for oa, lsoa, msoa in oas.itertuples(index=False):
+
+            path = os.path.join(BASE_PATH, 'prems_by_lad', lad, oa + '.csv')
+            if not os.path.exists(path):
+                continue
+
+            data = schemas.read_csv(path, 'premises', ['mistral_function_class', 'geom'])
+            if len(data) == 0:
+                continue
+
+            points = gpd.GeoSeries.from_wkt(data['geom']).representative_point()
+
+            output.append(pd.DataFrame({
+                'oa': oa,
+                'lsoa': lsoa,
+                'msoa': msoa,
+                'x': points.x.values,
+                'y': points.y.values,
+                'cx': (points.x.values // base_cell).astype(int),
+                'cy': (points.y.values // base_cell).astype(int),
+                'residential': (data['mistral_function_class'] == 'residential').values,
+            }))
+
+    if len(output) == 0:
+        return pd.DataFrame(columns=['oa', 'lsoa', 'msoa', 'x', 'y', 'unit', 'residential'])
+
+    output = pd.concat(output, ignore_index=True)
+    output['unit'] = get_unit_ids(output['msoa'], output['cx'], output['cy'])
+
+    return output
+
+
+def add_premises(units, premises):
+    """
+    Add premises counts to the base units, and return the share of each
+    unit's premises in each OA.
+
+    """
+    premises = premises.loc[premises['unit'].isin(units['unit'])]
+
+    counts = premises.groupby('unit')['residential'].agg(['size', 'sum'])
+    units['premises'] = units['unit'].map(counts['size']).fillna(0).astype(int)
+    units['residential'] = units['unit'].map(counts['sum']).fillna(0).astype(int)
+    units['non_residential'] = units['premises'] - units['residential']
+
+    shares = premises.groupby(['unit', 'oa', 'lsoa'], as_index=False).size()
+    shares['weight'] = shares['size'] / shares.groupby('unit')['size'].transform('sum')
+
+    return units, shares[['unit', 'oa', 'lsoa', 'weight']]
+
+
+def get_crosswalk(zoning, units, oa_shares, base_cell=BASE_CELL):
+    """
+    Return the (source, target, weight) crosswalk from base units to the
+    zones of a zoning.
+
+    """
+    if zoning in ('oa', 'lsoa'):
+        output = oa_shares.rename(columns={'unit': 'source', zoning: 'target'})
+        output = output.groupby(['source', 'target'], as_index=False)['weight'].sum()
+
+    elif zoning in ('msoa', 'lad'):
+        output = pd.DataFrame({'source': units['unit'], 'target': units[zoning],
+            'weight': 1.0})
+
+    elif zoning.startswith('grid_'):
+        ratio = int(zoning[5:-1]) // base_cell
+        output = pd.DataFrame({
+            'source': units['unit'],
+            'target': (units['cx'] // ratio).astype(str) + '_' + (units['cy'] // ratio).astype(str),
+            'weight': 1.0,
+        })
+
+    else:
+        raise ValueError('Did not recognise zoning: {}'.format(zoning))
+
+    return output
+
+
+def is_current(path, inputs):
+    """
+    Check whether a file exists and is newer than all of its inputs (and
+    every file within input folders).
+
+    """
+    if not os.path.exists(path):
+        return False
+
+    modified = os.path.getmtime(path)
+    inputs = [core.get_mtime(item) for item in inputs]
+
+    return all(item <= modified for item in inputs if item is not None)
+
+
+def prepare(folder, areas, lookup, zonings):
+    """
+    Load the base units and crosswalks for the studied areas, building and
+    storing them first if any input has changed since they were built.
+
+    """
+    path_units = os.path.join(folder, UNITS_FILENAME)
+    inputs = [core.get_path('oa_list'), core.get_path('output_areas'),
+        core.get_path('oa_lookup'),
+        os.path.join(os.path.dirname(__file__), 'script_config.ini')]
+
+    #only the premises folders of the studied LADs, not the whole country
+    for lad in get_lads(areas, lookup):
+        inputs.append(os.path.join(core.get_path('prems_by_lad'), lad))
+        inputs.append(os.path.join(core.get_path('prems_by_lad_msoa'), lad, 'lookup.csv'))
+
+    paths = [os.path.join(folder, 'crosswalk_{}.csv'.format(zoning)) for zoning in zonings]
+
+    if is_current(path_units, inputs) and all(os.path.exists(path) for path in paths):
+        units = pd.read_csv(path_units, dtype={'unit': str, 'msoa': str, 'lad': str})
+        return units, {zoning: crosswalk.load(path) for zoning, path in zip(zonings, paths)}
+
+    print('Building base units and crosswalks')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    shapes = core.load_output_areas()
+    shapes = shapes.loc[shapes['msoa'].isin(areas)]
+
+    units = build_units(shapes, lookup)
+    units, oa_shares = add_premises(units, load_premises(areas, lookup))
+
+    crosswalks = {}
+    for zoning, path in zip(zonings, paths):
+        crosswalks[zoning] = get_crosswalk(zoning, units, oa_shares)
+        crosswalk.write(crosswalks[zoning], path)
+
+    #written last, so an interrupted build is redone
+    units.to_csv(path_units, index=False)
+
+    return units, crosswalks
+
+
+def add_aps(units, areas):
+    """
+    Count the collected APs in each base unit.
+
+    """
+    points = ap_store.load_partitions(core.get_path('ap_store'), areas)
+
+    if len(points) > 0:
+        ids = get_unit_ids(points['msoa'],
+            (points.geometry.x // BASE_CELL).astype(int),
+            (points.geometry.y // BASE_CELL).astype(int))
+        counts = ids.value_counts()
+    else:
+        counts = pd.Series(dtype='int64')
+
+    units['aps'] = units['unit'].map(counts).fillna(0).astype(int)
+
+    return units
+
+
+def add_households(units, lookup):
+    """
+    Spread the households of each MSOA over its base units, by residential
+    premises (or by area, for an MSOA without residential premises).
+
+    """
+    households = lookup.set_index('msoa')['households']
+
+    residential = units.groupby('msoa')['residential'].transform('sum')
+    area = units.groupby('msoa')['area_km2'].transform('sum')
+
+    share = (units['residential'] / residential).where(residential > 0,
+        units['area_km2'] / area)
+
+    units['households'] = units['msoa'].map(households).fillna(0).values * share
+
+    return units
+
+
+@instrument.timed
+def aggregate_zoning(units, xwalk, zoning):
+    """
+    Move the base unit counts and areas to the zones of a zoning, with the
+    density (per km2) of each quantity.
+
+    """
+    output = crosswalk.aggregate(units, xwalk, 'unit', QUANTITIES + ['area_km2'],
+        target_id='zone')
+    output = output.loc[output['area_km2'] > 0].reset_index(drop=True)
+
+    for quantity in QUANTITIES:
+        output['{}_km2'.format(quantity)] = output[quantity] / output['area_km2']
+
+    output.insert(0, 'zoning', zoning)
+
+    return output
+
+
+def summarize(zones):
+    """
+    Summarize how the density of each quantity is distributed over the
+    zones of one zoning, and how it correlates with AP density.
+
+    """
+    output = []
+
+    for quantity in QUANTITIES:
+
+        density = zones['{}_km2'.format(quantity)]
+        mean = density.mean()
+
+        #undefined where either density is the same in every zone
+        with np.errstate(invalid='ignore', divide='ignore'):
+            correlation = density.corr(zones['aps_km2'])
+
+        output.append({
+            'zoning': zones['zoning'].iloc[0],
+            'quantity': quantity,
+            'zones': len(zones),
+            'mean_area_km2': zones['area_km2'].mean(),
+            'total': zones[quantity].sum(),
+            'mean_km2': mean,
+            'median_km2': density.median(),
+            'std_km2': density.std(),
+            'cv': density.std() / mean if mean > 0 else np.nan,
+            'max_km2': density.max(),
+            'corr_aps_km2': correlation,
+        })
+
+    return output
+
+
+if __name__ == '__main__':
+
+    print('----Working on multi-scale (MAUP) analysis')
+    print('----')
+
+    zonings = get_zonings()
+
+    print('Loading the areas with collected data')
+    areas = pd.read_csv(core.get_path('oa_list'))['msoa'].tolist()
+    lookup = core.load_oa_lookup()
+
+    units, crosswalks = prepare(core.get_path('maup'), areas, lookup, zonings)
+
+    print('Counting APs and households in {} base units'.format(len(units)))
+    units = add_aps(units, areas)
+    units = add_households(units, lookup)
+
+    folder = os.path.join(core.RESULTS_PATH, 'maup')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    summary = []
+
+    for zoning in zonings:
+
+        print('Aggregating to {}'.format(zoning))
+        zones = aggregate_zoning(units, crosswalks[zoning], zoning)
+        zones.to_csv(os.path.join(folder, 'zones_{}.csv'.format(zoning)), index=False)
+
+        if len(zones) > 0:
+            summary.extend(summarize(zones))
+
+    pd.DataFrame(summary).to_csv(os.path.join(folder, 'maup_summary.csv'), index=False)
+
+    instrument.write_report('maup')
@@ -4,19 +4,22 @@ Estimate internet adoption for households and businesses using national statisti
 """
 import os
 import csv
-import configparser
 import pandas as pd
-import geopandas as gpd
 import math
 import random
 from tqdm import tqdm
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(os.path.dirname(__file__), 'script_config.ini'))
-BASE_PATH = CONFIG['file_locations']['base_path']
+import core
+import instrument
+import population
+import schemas
+import subset
+
+BASE_PATH = core.BASE_PATH
 
 random.seed(43)
 
+@instrument.timed
 def load_business_data(path):
     """
     Load business count for output areas by employee count.
@@ -26,7 +29,7 @@ def load_business_data(path):
     """
     output = {}
 
-    data = pd.read_csv(path)#[:1000]
+    data = schemas.read_csv(path, 'business_counts')#[:1000]
 
     data = data.to_dict('records')
 
@@ -157,6 +160,7 @@ def internet_access_by_households():
         },
     }
 
+@instrument.timed
 def estimate_business_stats(area_id, bus_counts, bussiness_adoption, lookup,
     ap_coverage_area_low, ap_coverage_area_baseline, ap_coverage_area_high):
     """
@@ -265,7 +269,7 @@ def load_household_deomgraphics(folder, area_id, lookup, hh_adoption, lad_id):
         if not os.path.exists(path):
             return 'oa hh data not found'
 
-        hh_data = pd.read_csv(path)
+        hh_data = schemas.read_csv(path, 'hh_demographics')
 
         hh_data = hh_data.loc[hh_data['Area'] == area_id]
 
@@ -273,13 +277,14 @@ def load_household_deomgraphics(folder, area_id, lookup, hh_adoption, lad_id):
 
     else:
 
-        hh_data = pd.read_csv(path_hh_data)
+        hh_data = schemas.read_csv(path_hh_data, 'hh_demographics')
 
     hh_data = hh_data.to_dict('records')#[:1000]
 
     return hh_data
 
 
+@instrument.timed
 def estimate_hh_stats(area_id, hh_data, hh_adoption, lookup, lad_id):
     """
     Estimate household Wi-Fi adoption.
@@ -289,19 +294,19 @@ def estimate_hh_stats(area_id, hh_data, hh_adoption, lookup, lad_id):
     urban_rural = lookup[area_id]['geotype']
 
     households = set()
+    members = {}
 
     for item in hh_data:
         households.add(item['HID'])
+        members.setdefault(item['HID'], []).append(item)
+
+    instrument.add_rows(len(hh_data))
 
     output = []
 
     for household_id in list(households):#[:10]:
 
-        household_members = []
-
-        for item in hh_data:
-            if household_id == item['HID']:
-                household_members.append(item)
+        household_members = members[household_id]
 
         #treat the oldest person as the head of household
         hh_head = max(household_members, key=lambda x:x['DC1117EW_C_AGE'])
@@ -374,6 +379,7 @@ def get_age(hh_head):
         return '55+'
 
 
+@instrument.timed
 def aggregate_data(business_data, estimated_data, area_id, lookup, lad_id):
     """
     Aggregate all data by output area ready for exporting.
@@ -457,8 +463,7 @@ if __name__ == '__main__':
     ap_coverage_area_high = 300
 
     print('Loading local business counts')
-    path = os.path.join(BASE_PATH, 'ons_local_business_counts', 'business_counts.csv')
-    business_data = load_business_data(path)
+    business_data = load_business_data(core.get_path('business_counts'))
 
     print('Loading local internet access statistics')
     bussiness_adoption = internet_access_by_business()
@@ -467,15 +472,18 @@ if __name__ == '__main__':
     hh_adoption = internet_access_by_households()
 
     print('Load lookup')
-    filename = 'oa_lookup.csv'
-    path = os.path.join(BASE_PATH, 'intermediate', filename)
-    lookup = pd.read_csv(path)
-    lookup = load_lookup(lookup)
+    lookup = load_lookup(core.load_oa_lookup())
+
+    #read households from the population store if it has been built, or
+    #from the per area files otherwise
+    use_store = population.exists()
 
     output = []
 
     print('Exporting adoption results')
-    for area_id in tqdm(business_data.keys()):
+    areas = subset.select(business_data.keys())
+
+    for area_id in instrument.track(tqdm(areas), 'ns_area'):
 
         if area_id in lookup:
             lad_id = lookup[area_id]['lad']
@@ -491,13 +499,18 @@ if __name__ == '__main__':
             bussiness_adoption, lookup, ap_coverage_area_low,
             ap_coverage_area_baseline, ap_coverage_area_high)
 
-        directory = os.path.join(BASE_PATH, 'intermediate', 'hh_by_lad_msoa', lad_id)
-        path_hh = os.path.join(directory, area_id + '.csv')
-        if os.path.exists(path_hh):
-            hh_data = pd.read_csv(path_hh)
-            hh_data = hh_data.to_dict('records')#[:1000]
+        if use_store:
+            hh_data = population.load_area(area_id)
+            if hh_data is None:
+                continue
         else:
-            continue
+            directory = os.path.join(BASE_PATH, 'intermediate', 'hh_by_lad_msoa', lad_id)
+            path_hh = os.path.join(directory, area_id + '.csv')
+            if os.path.exists(path_hh):
+                hh_data = schemas.read_csv(path_hh, 'hh_demographics')
+            else:
+                continue
+        hh_data = hh_data.to_dict('records')#[:1000]
 
         folder = os.path.join(BASE_PATH, 'intermediate', 'hh_data_aggregated', lad_id)
         if not os.path.exists(folder):
@@ -509,7 +522,7 @@ if __name__ == '__main__':
             hh_data_to_write = pd.DataFrame(estimated_hh_data)
             hh_data_to_write.to_csv(path, index=False)
         else:
-            estimated_hh_data = pd.read_csv(path)
+            estimated_hh_data = schemas.read_csv(path, 'hh_estimates')
             estimated_hh_data = estimated_hh_data.to_dict('records')#[:1000]
 
         estimated_data = aggregate_data(estimated_bus_data, estimated_hh_data, area_id, lookup, lad_id)
@@ -518,5 +531,12 @@ if __name__ == '__main__':
 
     print('Exporting adoption results')
     results = pd.DataFrame(output)
-    path = os.path.join(BASE_PATH, '..', 'results', 'estimated_adoption_ns.csv')
+    path = core.get_path('ns_results')
+    if subset.is_active() and os.path.exists(path):
+        print('Updating the subset of areas in the existing results')
+        existing = pd.read_csv(path)
+        existing = existing.loc[~existing['msoa'].isin(areas)]
+        results = pd.concat([existing, results], ignore_index=True)
     results.to_csv(path, index=False)
+
+    instrument.write_report('ns')
@@ -9,23 +9,29 @@ May 2020
 """
 import os
 import csv
-import configparser
 import pandas as pd
 import geopandas as gpd
-from pykml import parser
-import numpy as np
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(os.path.dirname(__file__), 'script_config.ini'))
-BASE_PATH = CONFIG['file_locations']['base_path']
+import ap_store
+import boundaries
+from chunks import ChunkAccumulator
+import core
+import ingest
+import instrument
 
+CONFIG = core.CONFIG
+BASE_PATH = core.BASE_PATH
+DEDUP_KEY = CONFIG['deduplication']['key']
+DEDUP_KEEP = CONFIG['deduplication']['keep']
 
+
+@instrument.timed
 def load_collected_data(folder, files):
     """
     Load all collected data.
 
     """
-    all_data = []
+    all_data = ChunkAccumulator()
 
     for filename in files:
 
@@ -37,20 +43,22 @@ def load_collected_data(folder, files):
 
         data = load_single_file(path)
 
-        all_data = all_data + data
+        all_data.add(data)
 
-    all_data = gpd.GeoDataFrame.from_features(all_data)
-    all_data.crs = 'epsg:4326'
+    all_data = all_data.to_geoframe(crs='epsg:4326')
     all_data = all_data.to_crs('epsg:27700')
 
     return all_data
 
 
+@instrument.timed
 def load_single_file(path):
     """
     Load a single kml file.
 
     """
+    from pykml import parser
+
     with open(path) as f:
         folder = parser.parse(f).getroot().Document.Folder
 
@@ -80,16 +88,155 @@ def load_single_file(path):
                 },
             })
 
+    instrument.add_rows(len(output))
+
     return output
 
 
-def get_oa_list(collected_data, shapes):
+@instrument.timed
+def get_included_files(folder, files, collected_data):
+    """
+    Return the kml files whose points are all held in existing collected
+    points (matched by network id and time).
+
+    """
+    held = set(zip(collected_data['network_id'].astype(str),
+        collected_data['time'].astype(str)))
+
+    output = []
+
+    for filename in sorted(files):
+
+        if not filename.endswith('.kml'):
+            continue
+
+        data = load_single_file(os.path.join(folder, filename))
+        keys = set(
+            (item['properties']['network_id'], item['properties']['time'])
+            for item in data
+        )
+
+        if keys <= held:
+            output.append(filename)
+
+    return output
+
+
+def get_network_key(data, key):
+    """
+    Return the identity used to match repeat sightings of a network.
+
+    """
+    if key == 'bssid':
+        return ap_store.get_bssid(data['network_id'])
+    elif key == 'bssid_ssid':
+        return ap_store.get_bssid(data['network_id']) + '|' + data['name'].astype(str)
+    else:
+        raise ValueError('Did not recognise deduplication key: {}'.format(key))
+
+
+def get_numeric_value(values):
+    """
+    Extract the number from WiGLE description text (e.g. 'Signal: -81.0').
+
+    """
+    values = values.astype(str).str.rsplit(' ', n=1).str[-1]
+
+    return pd.to_numeric(values, errors='coerce')
+
+
+@instrument.timed
+def deduplicate_aps(data, key=DEDUP_KEY, keep=DEDUP_KEEP):
+    """
+    Keep a single observation for each network across the whole campaign.
+
+    Observations are sorted so the best one comes first (strongest signal,
+    or smallest accuracy radius) and the first row per network is kept.
+
+    """
+    if keep == 'signal':
+        score = -get_numeric_value(data['signal'])
+    elif keep == 'accuracy':
+        score = get_numeric_value(data['accuracy'])
+    else:
+        raise ValueError('Did not recognise deduplication keep: {}'.format(keep))
+
+    order = pd.DataFrame({
+        'network_key': get_network_key(data, key).values,
+        'score': score.values,
+    })
+    order = order.sort_values('score', kind='stable', na_position='last')
+    order = order.loc[~order['network_key'].duplicated(keep='first')]
+
+    data = data.iloc[order.index.sort_values()]
+
+    return data
+
+
+@instrument.timed
+def assign_msoa(collected_data, shapes, coarse_shapes=None, coarse_level=None):
+    """
+    Tag each collected point with the code of the area it falls within.
+
+    A single spatial join (using the shapes' spatial index) is carried out
+    for the whole campaign, first against the coarse shapes if given, with
+    only points near their edges tested against the full shapes. Points on
+    a shared boundary are given to the first matching area, and points
+    outside all areas get no code.
+
+    """
+    collected_data['msoa'] = boundaries.assign_areas(
+        collected_data,
+        shapes,
+        coarse_shapes,
+        boundaries.get_max_error(coarse_level)
+    )
+
+    return collected_data
+
+
+@instrument.timed
+def update_collected_data(new_data, store, shapes, coarse_shapes=None,
+    coarse_level=None):
+    """
+    Add newly collected points to the store.
+
+    Only the areas receiving new points, and those already holding any of
+    the new networks, are touched: their existing points are loaded,
+    combined with the new ones and deduplicated again, so each network
+    stays in the store once across the campaign. Returns the list of areas
+    which were updated and the store batch written.
+
+    """
+    new_data = deduplicate_aps(new_data)
+    new_data = assign_msoa(new_data, shapes, coarse_shapes, coarse_level)
+
+    touched = set(new_data['msoa'].dropna())
+    touched |= set(ap_store.find_partitions(store,
+        ap_store.get_bssid(new_data['network_id'])))
+    touched = sorted(touched)
+
+    existing = ap_store.load_partitions(store, touched)
+
+    combined = pd.concat([existing, new_data], ignore_index=True)
+    combined = gpd.GeoDataFrame(combined, geometry='geometry', crs='epsg:27700')
+    combined = deduplicate_aps(combined)
+
+    batch = ap_store.replace_partitions(combined, store, touched)
+
+    return touched, batch
+
+
+@instrument.timed
+def get_oa_list(counts, shapes):
     """
     Count data points per postcode and subset those with data.
 
+    Takes the number of collected points per area (e.g. from the store index).
+
     """
-    f = lambda x:np.sum(collected_data.intersects(x))
-    shapes['waps_collected'] = shapes['geometry'].apply(f)
+    shapes = shapes.copy()
+    shapes['waps_collected'] = shapes['msoa'].map(counts).fillna(0)
 
     shapes = shapes.loc[shapes['waps_collected'] > 0]
 
@@ -100,37 +247,59 @@ def get_oa_list(collected_data, shapes):
 
 if __name__ == '__main__':
 
-    folder = os.path.join(BASE_PATH, 'intermediate')
+    folder = core.INTERMEDIATE_PATH
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-    folder_kml = os.path.join(BASE_PATH, 'wigle', 'all_kml_data')
+    folder_kml = core.get_path('kml')
     files = os.listdir(folder_kml)
 
-    path = os.path.join(folder, 'all_collected_points.shp')
-    if not os.path.exists(path):
-        print('Processing collected points')
-        collected_data = load_collected_data(folder_kml, files)
-        collected_data.to_file(path, crs='epsg:27700')
-        path = os.path.join(folder, 'all_collected_points.csv')
-        collected_data.to_csv(path)
-    else:
-        print('Loading existing processed collected points')
-        collected_data = gpd.read_file(path, crs='epsg:27700')#[:1000]
-
     print('Loading oa area shapes')
-    path = os.path.join(folder, 'output_areas.shp')
-    shapes = gpd.read_file(path)#[:100]
-    shapes.crs = 'epsg:27700'
-    shapes = shapes.to_crs('epsg:27700')
+    shapes = boundaries.load_boundaries(None, folder)
+    coarse_level = 100
+    coarse_shapes = boundaries.load_boundaries(coarse_level, folder)
+
+    store = core.get_path('ap_store')
+    path_ledger = core.get_path('ingestion_ledger')
+    path_stale = core.get_path('stale_msoas')
+
+    path = os.path.join(folder, 'all_collected_points.shp')
+    if not ap_store.exists(store) and os.path.exists(path):
+        print('Moving existing processed collected points into the store')
+        collected_data = gpd.read_file(path, crs='epsg:27700')
+        included = get_included_files(folder_kml, files, collected_data)
+        collected_data = deduplicate_aps(collected_data)
+        if not 'msoa' in collected_data.columns:
+            collected_data = assign_msoa(collected_data, shapes,
+                coarse_shapes, coarse_level)
+        batch = ap_store.write_partitions(collected_data, store, scheme='msoa')
+        ingest.add_to_ledger(path_ledger, folder_kml, included, batch)
+        del collected_data
+
+    print('Checking for new collected data files')
+    ledger = ingest.load_ledger(path_ledger)
+    new_files = ingest.get_new_files(folder_kml, files, ledger)
+    print('Found {} new files'.format(len(new_files)))
+
+    if len(new_files) > 0:
+        print('Processing new collected points')
+        new_data = load_collected_data(folder_kml, new_files)
+        touched, batch = update_collected_data(new_data, store, shapes,
+            coarse_shapes, coarse_level)
+        ingest.add_to_ledger(path_ledger, folder_kml, new_files, batch)
+        print('Marking {} areas for recomputation'.format(len(touched)))
+        ingest.mark_stale(path_stale, touched)
 
     print('Getting oa list')
     valids = ['East of England', 'London', 'South East', 'South West',
         'East Midlands', 'Yorkshire and The Humber']
-    shapes = shapes.loc[shapes['region'].str.startswith(tuple(valids))]
-    oa_list = get_oa_list(collected_data, shapes)
+    shapes = coarse_shapes.loc[coarse_shapes['region'].str.startswith(tuple(valids))]
+    counts = ap_store.get_counts(store)
+    oa_list = get_oa_list(counts, shapes)
 
     print('Writing list')
-    path = os.path.join(folder, 'oa_list.csv')
+    path = core.get_path('oa_list')
     oa_list = pd.DataFrame({'msoa': oa_list})
     oa_list.to_csv(path, index=False)
+
+    instrument.write_report('oa_list')
@@ -0,0 +1,237 @@
+"""
+Memory-mapped store of the synthetic population.
+
+The per area household files written by preprocess.py (one csv per MSOA
+in each LAD folder) are converted once into a single national store. Each
+column is a flat binary array, with persons sorted by MSOA then household,
+and an index records the rows of each MSOA and the first row of each
+household. Columns are opened memory-mapped, so the persons of an area are
+a slice of the arrays rather than a file to open and parse, and every
+process on a machine shares one page-cached copy.
+
+Layout of the store folder:
+
+    PID.bin, DC1117EW_C_AGE.bin, HID.bin  one value per person
+    households.bin                        first row of each household, then
+                                          the total number of persons (int64)
+    areas.csv                             msoa, lad, start, stop, hh_start,
+                                          hh_stop
+
+"""
+import os
+import shutil
+import functools
+
+import numpy as np
+
+import core
+import schemas
+
+#column name and type of each array in the store
+COLUMNS = {
+    'PID': 'int32',
+    'DC1117EW_C_AGE': 'int16',
+    'HID': 'int32',
+}
+
+HOUSEHOLDS_FILENAME = 'households.bin'
+AREAS_FILENAME = 'areas.csv'
+
+
+def get_sources(folder):
+    """
+    Return the (msoa, lad, path) of every per area household file, sorted
+    by MSOA.
+
+    """
+    sources = []
+
+    for lad in sorted(os.listdir(folder)):
+
+        directory = os.path.join(folder, lad)
+        if not os.path.isdir(directory):
+            continue
+
+        for filename in os.listdir(directory):
+            if filename.endswith('.csv'):
+                sources.append((filename[:-4], lad, os.path.join(directory, filename)))
+
+    return sorted(sources)
+
+
+def build_store(folder, root):
+    """
+    Convert the per area household files in folder into a store at root,
+    replacing any existing store. Areas are read and appended one at a time,
+    so memory use does not grow with the national population.
+
+    """
+    import pandas as pd
+
+    path_tmp = root + '.tmp'
+    if os.path.exists(path_tmp):
+        shutil.rmtree(path_tmp)
+    os.makedirs(path_tmp)
+
+    files = {name: open(os.path.join(path_tmp, name + '.bin'), 'wb') for name in COLUMNS}
+    households = open(os.path.join(path_tmp, HOUSEHOLDS_FILENAME), 'wb')
+
+    areas = []
+    rows = 0
+    household_count = 0
+
+    try:
+        for msoa, lad, path in get_sources(folder):
+
+            data = schemas.read_csv(path, 'hh_demographics', list(COLUMNS))
+
+            #a stable sort keeps persons within a household in file order
+            data = data.sort_values('HID', kind='stable')
+
+            for name, dtype in COLUMNS.items():
+                data[name].to_numpy(dtype=dtype).tofile(files[name])
+
+            hids = data['HID'].to_numpy()
+            starts = np.flatnonzero(np.diff(hids, prepend=hids[:1] - 1))
+            (starts.astype('int64') + rows).tofile(households)
+
+            areas.append({
+                'msoa': msoa,
+                'lad': lad,
+                'start': rows,
+                'stop': rows + len(data),
+                'hh_start': household_count,
+                'hh_stop': household_count + len(starts),
+            })
+
+            rows += len(data)
+            household_count += len(starts)
+
+        np.array([rows], dtype='int64').tofile(households)
+
+    finally:
+        for handle in files.values():
+            handle.close()
+        households.close()
+
+    pd.DataFrame(areas, columns=['msoa', 'lad', 'start', 'stop', 'hh_start',
+        'hh_stop']).to_csv(os.path.join(path_tmp, AREAS_FILENAME), index=False)
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.replace(path_tmp, root)
+
+    clear_cache()
+
+    return len(areas), rows
+
+
+def exists(root=None):
+    """
+    Check whether a complete store exists.
+
+    """
+    if root is None:
+        root = core.get_path('population_store')
+
+    return os.path.exists(os.path.join(root, AREAS_FILENAME))
+
+
+@functools.lru_cache(maxsize=None)
+def open_store(root=None):
+    """
+    Open the store read-only, returning the memory-mapped columns, the
+    household offsets and the area index (msoa: row of areas.csv).
+
+    """
+    import pandas as pd
+
+    if root is None:
+        root = core.get_path('population_store')
+
+    columns = {}
+    for name, dtype in COLUMNS.items():
+        path = os.path.join(root, name + '.bin')
+        if os.path.getsize(path) > 0:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r')
+        else:
+            columns[name] = np.empty(0, dtype=dtype)
+
+    households = np.memmap(os.path.join(root, HOUSEHOLDS_FILENAME), dtype='int64', mode='r')
+
+    areas = pd.read_csv(os.path.join(root, AREAS_FILENAME), dtype={'msoa': str, 'lad': str})
+    areas = {row['msoa']: row for row in areas.to_dict('records')}
+
+    return {
+        'columns': columns,
+        'households': households,
+        'areas': areas,
+    }
+
+
+def get_area(area_id, root=None):
+    """
+    Return the persons in an area as a dict of column arrays, which are
+    views on the store rather than copies, or None for an unknown area.
+
+    """
+    store = open_store(root)
+
+    if area_id not in store['areas']:
+        return None
+
+    area = store['areas'][area_id]
+
+    return {
+        name: values[area['start']:area['stop']]
+        for name, values in store['columns'].items()
+    }
+
+
+def get_household_offsets(area_id, root=None):
+    """
+    Return the row of each household within an area's arrays, followed by
+    the number of persons, so household i is rows offsets[i]:offsets[i + 1].
+
+    """
+    store = open_store(root)
+    area = store['areas'][area_id]
+
+    offsets = store['households'][area['hh_start']:area['hh_stop']]
+
+    return np.append(offsets, area['stop']) - area['start']
+
+
+def load_area(area_id, root=None):
+    """
+    Return the persons in an area as a DataFrame with the columns of the
+    household demographics files, or None for an unknown area.
+
+    """
+    import pandas as pd
+
+    area = get_area(area_id, root)
+
+    if area is None:
+        return None
+
+    data = pd.DataFrame(area)
+    data.insert(1, 'Area', area_id)
+
+    return data
+
+
+def clear_cache():
+    """
+    Close the open store, e.g. after it is rebuilt.
+
+    """
+    open_store.cache_clear()
+
+
+if __name__ == '__main__':
+
+    print('Building the population store from the per area household files')
+    areas, rows = build_store(core.get_path('hh_by_lad_msoa'),
+        core.get_path('population_store'))
+    print('Stored {} persons in {} areas'.format(rows, areas))
@@ -8,18 +8,21 @@ May 2020
 """
 import os
 import csv
-import configparser
 import pandas as pd
 import geopandas as gpd
 from shapely.geometry import mapping, Polygon
-from shapely import wkt
 import numpy as np
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(os.path.dirname(__file__), 'script_config.ini'))
-BASE_PATH = CONFIG['file_locations']['base_path']
+from chunks import ChunkAccumulator
+import core
+import instrument
+import schemas
+import subset
 
+BASE_PATH = core.BASE_PATH
 
+
+@instrument.timed
 def subset_areas_with_data(oa_areas, oa_area_shapes):
     """
     Only return those output area shapes for which we have data for.
@@ -51,6 +54,7 @@ def subset_areas_with_data(oa_areas, oa_area_shapes):
     return shapes, points
 
 
+@instrument.timed
 def get_lad_list(lads, oa_points):
     """
     Get a list of the local authority districts for which we have data for.
@@ -63,6 +67,7 @@ def get_lad_list(lads, oa_points):
     return oa_points, lad_list
 
 
+@instrument.timed
 def get_oa_area_boundaries(lad_id, oa_points, oa_shapes):
     """
     Return only the output area shapes in a single local authority district.
@@ -92,56 +97,39 @@ def get_oa_area_boundaries(lad_id, oa_points, oa_shapes):
 if __name__ == '__main__':
 
     print('Loading oa list')
-    path = os.path.join(BASE_PATH, 'intermediate', 'oa_list.csv')
-    oa_areas = pd.read_csv(path)
-    oa_areas = oa_areas['msoa'].tolist()
+    oa_areas = pd.read_csv(core.get_path('oa_list'))
+    oa_areas = subset.select(oa_areas['msoa'])
 
     print('Load and subset oa areas')
-    path = os.path.join(BASE_PATH, 'intermediate', 'output_areas.shp')
-    oa_shapes = gpd.read_file(path)
-    oa_shapes.crs = 'epsg:27700'
-    oa_shapes = oa_shapes.to_crs('epsg:27700')
+    oa_shapes = core.load_output_areas()
     oa_shapes, oa_points = subset_areas_with_data(oa_areas, oa_shapes)
 
     print('Load and subset lads')
-    path = os.path.join(BASE_PATH, 'shapes', 'lad_uk_2016-12.shp')
-    lads = gpd.read_file(path, crs='epsg:27700')
+    lads = core.load_lad_shapes()
     oa_points.crs = 'epsg:27700'
 
     oa_points, lad_list = get_lad_list(lads, oa_points)
 
-    for lad_id in lad_list:
+    for lad_id in instrument.track(lad_list, 'prems_lad', label='lad'):
 
         print('Loading data for {}'.format(lad_id))
 
         path = os.path.join(BASE_PATH, 'prems_by_lad', lad_id)
 
-        prems_by_lad = []
+        prems_by_lad = ChunkAccumulator()
 
         for file in os.listdir(path):
             if file.endswith(".csv"):
+                prems_by_lad.add(schemas.read_csv(os.path.join(path, file), 'premises'))
+
+        if len(prems_by_lad) == 0:
+            print('Unable to find premises data for {}'.format(lad_id))
+            continue
 
-                prems = pd.read_csv(os.path.join(path, file))
-
-                for idx, prem in prems.iterrows():
-                    geom = wkt.loads(prem['geom'])
-                    prems_by_lad.append({
-                        'type': 'Feature',
-                        'geometry': geom.representative_point(),
-                        'properties': {
-                            'mistral_function_class': prem['mistral_function_class'],
-                            'mistral_building_class': prem['mistral_building_class'],
-                            'res_count': prem['res_count'],
-                            'floor_area': prem['floor_area'],
-                            'height_toroofbase': prem['height_toroofbase'],
-                            'height_torooftop': prem['height_torooftop'],
-                            'nonres_count': prem['nonres_count'],
-                            'number_of_floors': prem['number_of_floors'],
-                            'footprint_area': prem['footprint_area'],
-                        }
-                    })
-
-        prems_by_lad = gpd.GeoDataFrame.from_features(prems_by_lad)
+        prems_by_lad = prems_by_lad.to_frame()
+        geometry = gpd.GeoSeries.from_wkt(prems_by_lad.pop('geom')).representative_point()
+        prems_by_lad = gpd.GeoDataFrame(prems_by_lad, geometry=geometry)
+        instrument.add_rows(len(prems_by_lad))
 
         oa_shapes_subset = get_oa_area_boundaries(lad_id, oa_points, oa_shapes)
 
@@ -149,7 +137,8 @@ if __name__ == '__main__':
         if not os.path.exists(lad_folder):
             os.makedirs(lad_folder)
 
-        for oa_shape_id in oa_shapes_subset['msoa'].unique():
+        for oa_shape_id in instrument.track(oa_shapes_subset['msoa'].unique(),
+            'prems_area', lad=lad_id):
 
             path = os.path.join(lad_folder, oa_shape_id + '.csv')
 
@@ -162,3 +151,5 @@ if __name__ == '__main__':
                 prems_within_oa = gpd.overlay(prems_by_lad, curent_oa, how='intersection')
 
                 prems_within_oa.to_csv(path, index=False)
+
+    instrument.write_report('prems')
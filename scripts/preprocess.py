@@ -4,21 +4,26 @@ Preprocess OA lookup table
 """
 import os
 import csv
-import configparser
 import pandas as pd
 import geopandas as gpd
 import math
 import random
-from shapely.geometry import mapping, MultiPolygon
+from shapely.geometry import mapping
 from tqdm import tqdm
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(os.path.dirname(__file__), 'script_config.ini'))
-BASE_PATH = CONFIG['file_locations']['base_path']
+import boundaries
+import core
+import instrument
+import population
+import schemas
+from chunks import ChunkAccumulator
+
+BASE_PATH = core.BASE_PATH
 
 random.seed(43)
 
 
+@instrument.timed
 def process_shapes(path_output, path_ew, path_scot, lookup):
     """
     Process all shape boundaries for ~8,000 areas.
@@ -36,26 +41,28 @@ def process_shapes(path_output, path_ew, path_scot, lookup):
         data_scot = data_scot[['InterZone', 'geometry']]
         data_scot.columns = ['msoa', 'geometry']
 
-        all_data = data_ew.append(data_scot, ignore_index=True)
-
-        all_data['geometry'] = all_data.apply(remove_small_shapes, axis=1)
+        all_data = ChunkAccumulator()
+        all_data.add(data_ew)
+        all_data.add(data_scot)
+        all_data = all_data.to_geoframe(crs='epsg:27700')
 
-        all_data['geometry'] = all_data.simplify(
-            tolerance = 10,
-            preserve_topology=True).buffer(0.0001).simplify(
-                tolerance = 10,
-                preserve_topology=True
-            )
+        all_data = remove_small_shapes(all_data)
 
         all_data['area_km2'] = all_data['geometry'].area / 1e6
 
-        lookup = pd.read_csv(lookup)
-        lookup = lookup[['MSOA11CD', 'RGN11NM']]
+        lookup_path = lookup
+        lookup = schemas.read_csv(lookup, 'oa_lut', ['MSOA11CD', 'RGN11NM'])
         lookup = lookup.drop_duplicates()
         lookup.columns = ['msoa', 'region']
+        #shapefiles cannot hold categoricals
+        lookup['region'] = lookup['region'].astype(str)
         all_data = (pd.merge(all_data, lookup, on='msoa'))
 
-        all_data.to_file(path_output, crs='epsg:27700')
+        for level in boundaries.LEVELS:
+            simplified = simplify_shapes(all_data, level, folder,
+                [path_ew, path_scot, lookup_path])
+            if level == 10:
+                simplified.to_file(path_output, crs='epsg:27700')
 
         all_data = all_data[['msoa', 'area_km2', 'region']]
         out_path = os.path.join(folder, 'output_areas.csv')
@@ -67,39 +74,59 @@ def process_shapes(path_output, path_ew, path_scot, lookup):
     return all_data
 
 
-def remove_small_shapes(x):
+@instrument.timed
+def remove_small_shapes(data, area1=1e7, threshold=5e6):
     """
     Get rid of small geometries.
 
+    Multipolygons are exploded into a table of parts. Parts smaller than the
+    threshold are dropped (unless the total area is already very small, below
+    area1), and the remaining parts are dissolved back together by area.
+
     """
-    # if its a single polygon, just return the polygon geometry
-    if x.geometry.geom_type == 'Polygon':
-        return x.geometry
+    parts = data[['msoa', 'geometry']].copy()
+    parts['total_area'] = parts.area
 
-    # if its a multipolygon, we start trying to simplify
-    # and remove shapes if its too big.
-    elif x.geometry.geom_type == 'MultiPolygon':
+    parts = parts.explode(index_parts=False)
 
-        area1 = 1e7
-        area2 = 5e7
+    keep = (parts['total_area'] < area1) | (parts.area > threshold)
+    parts = parts.loc[keep, ['msoa', 'geometry']].dissolve(by='msoa')
 
-        # don't remove shapes if total area is already very small
-        if x.geometry.area < area1:
-            return x.geometry
+    data = data.copy()
+    data['geometry'] = parts.geometry.reindex(data['msoa']).values
 
-        if x.geometry.area > area2:
-            threshold = 5e6
-        else:
-            threshold = 5e6
+    return data
+
+
+@instrument.timed
+def simplify_shapes(data, tolerance, folder, inputs=()):
+    """
+    Simplify shapes to a given tolerance (m), caching the result on disk by
+    tolerance so it is only computed once, or again when any of the input
+    files the shapes were made from is newer. A tolerance of None keeps the
+    full resolution shapes. Each layer is written with a spatial index.
+
+    """
+    path = boundaries.get_boundaries_path(tolerance, folder)
+
+    if os.path.exists(path):
+        modified = os.path.getmtime(path)
+        inputs = [core.get_mtime(item) for item in inputs]
+        if all(item <= modified for item in inputs if item is not None):
+            return gpd.read_file(path, crs='epsg:27700')
+
+    data = data.copy()
+    if tolerance is not None:
+        data['geometry'] = data.simplify(
+            tolerance = tolerance,
+            preserve_topology=True).buffer(0.0001).simplify(
+                tolerance = tolerance,
+                preserve_topology=True
+            )
 
-        # save remaining polygons as new multipolygon for
-        # the specific country
-        new_geom = []
-        for y in x.geometry:
-            if y.area > threshold:
-                new_geom.append(y)
+    data.to_file(path, crs='epsg:27700', SPATIAL_INDEX='YES')
 
-        return MultiPolygon(new_geom)
+    return data
 
 
 def process_area_features(path_output, data):
@@ -120,6 +147,7 @@ def process_area_features(path_output, data):
     return output
 
 
+@instrument.timed
 def get_lads(path):
     """
     Get all unique Local Authority District IDs.
@@ -130,35 +158,21 @@ def get_lads(path):
     if not os.path.exists(path_output):
         os.makedirs(path_output)
 
-    all_data = pd.read_csv(path)
+    all_data = schemas.read_csv(path, 'oa_lut',
+        ['OA11CD', 'LSOA11CD', 'MSOA11CD', 'LAD17CD'])
 
-    all_data = all_data.to_dict('records')
+    unique_lads = []
 
-    unique_lads = set()
+    for lad, lookup in all_data.groupby('LAD17CD', observed=True, sort=False):
 
-    for item in all_data:
-        unique_lads.add(item['LAD17CD'])
-
-    unique_lads = list(unique_lads)#[:10]
-
-    for lad in list(unique_lads):
+        unique_lads.append(lad)
 
         path_lad = os.path.join(path_output, lad)
 
         if not os.path.exists(path_lad):
             os.makedirs(path_lad)
 
-        lookup = []
-
-        for item in all_data:
-            if lad == item['LAD17CD']:
-                lookup.append({
-                    'OA11CD': item['OA11CD'],
-                    'LSOA11CD': item['LSOA11CD'],
-                    'MSOA11CD': item['MSOA11CD']
-                })
-
-        lookup = pd.DataFrame(lookup)
+        lookup = lookup[['OA11CD', 'LSOA11CD', 'MSOA11CD']]
 
         lookup.to_csv(os.path.join(path_lad, 'lookup.csv'), index=False)
 
@@ -173,24 +187,22 @@ def get_lookup(lad):
     """
     folder = os.path.join(BASE_PATH, 'intermediate', 'prems_by_lad_msoa', lad)
     path = os.path.join(folder, 'lookup.csv')
-    all_data = pd.read_csv(path)
+    all_data = schemas.read_csv(path, 'oa_lut', ['OA11CD', 'MSOA11CD'])
 
     unique_msoas = all_data['MSOA11CD'].unique()
 
-    all_data = all_data.to_dict('records')
+    positions = all_data.groupby('MSOA11CD', sort=False).indices
+    oa_ids = all_data['OA11CD'].values
 
     lookup = {}
 
     for msoa in unique_msoas:
-        oa_ids = []
-        for item in all_data:
-            if msoa == item['MSOA11CD']:
-                oa_ids.append(item['OA11CD'])
-        lookup[msoa] = oa_ids
+        lookup[msoa] = oa_ids[positions[msoa]].tolist()
 
     return unique_msoas, lookup
 
 
+@instrument.timed
 def write_premises_data(lad):
     """
     Aggregate Output Area premises data into Middle Super Output Areas and write.
@@ -211,7 +223,7 @@ def write_premises_data(lad):
 
         oas = lookup[msoa]
 
-        prems_by_msoa = []
+        prems_by_msoa = ChunkAccumulator()
 
         for oa in oas:
 
@@ -220,31 +232,18 @@ def write_premises_data(lad):
             if not os.path.exists(path_oa):
                 continue
 
-            prems = pd.read_csv(path_oa)
-
-            prems = prems.to_dict('records')
-
-            for prem in prems:
-                prems_by_msoa.append({
-                    'mistral_function_class': prem['mistral_function_class'],
-                    'mistral_building_class': prem['mistral_building_class'],
-                    'res_count': prem['res_count'],
-                    'floor_area': prem['floor_area'],
-                    'height_toroofbase': prem['height_toroofbase'],
-                    'height_torooftop': prem['height_torooftop'],
-                    'nonres_count': prem['nonres_count'],
-                    'number_of_floors': prem['number_of_floors'],
-                    'footprint_area': prem['footprint_area'],
-                    'geometry': prem['geom'],
-                })
-
-        prems_by_msoa = pd.DataFrame(prems_by_msoa)
+            prems_by_msoa.add(schemas.read_csv(path_oa, 'premises'))
+
+        prems_by_msoa = prems_by_msoa.to_frame()
+        prems_by_msoa = prems_by_msoa.rename(columns={'geom': 'geometry'})
         prems_by_msoa.to_csv(path_output, index=False)
 
 
+@instrument.timed
 def write_hh_data(lad):
     """
-    Get the estimated household demographics for each area.
+    Get the estimated household demographics for each area, writing all
+    columns of the LAD file to one file per MSOA.
 
     """
     filename = 'ass_{}_area11_2018.csv'.format(lad)
@@ -260,7 +259,10 @@ def write_hh_data(lad):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    hh_data = pd.read_csv(path)
+    hh_data = schemas.read_csv(path, 'hh_demographics', all_columns=True)
+    instrument.add_rows(len(hh_data))
+
+    positions = hh_data.groupby('Area', sort=False, observed=True).indices
 
     for msoa in unique_msoas:
 
@@ -269,11 +271,12 @@ def write_hh_data(lad):
         if os.path.exists(path_output):
             continue
 
-        hh_msoa_data = hh_data.loc[hh_data['Area'] == msoa]
+        hh_msoa_data = hh_data.iloc[positions.get(msoa, [])]
 
         hh_msoa_data.to_csv(path_output, index=False)
 
 
+@instrument.timed
 def generate_msoa_lookup(unique_lads, area_features):
     """
     Load in all data for each area to generate a single lookup table.
@@ -288,7 +291,7 @@ def generate_msoa_lookup(unique_lads, area_features):
 
         unique_msoas, lookup = get_lookup(lad)
 
-        for msoa in unique_msoas:
+        for msoa in instrument.track(unique_msoas, 'preprocess_area_stats', lad=lad):
 
             results = get_area_stats(msoa, lad, hh_folder, prems_folder, area_features)
 
@@ -308,15 +311,10 @@ def get_area_stats(msoa, lad, hh_folder, prems_folder, area_features):
     if not os.path.exists(path):
         return 'path does not exist'
 
-    hh_data = pd.read_csv(path)
-    hh_data = hh_data.to_dict('records')
+    hh_data = schemas.read_csv(path, 'hh_demographics', ['HID', 'PID'])
 
-    households = set()
-    population = set()
-
-    for row in hh_data:
-        households.add(row['HID'])
-        population.add(row['PID'])
+    households = hh_data['HID'].nunique()
+    population = hh_data['PID'].nunique()
 
     path = os.path.join(prems_folder, msoa + '.csv')
 
@@ -324,7 +322,8 @@ def get_area_stats(msoa, lad, hh_folder, prems_folder, area_features):
         return 'path does not exist'
 
     try:
-        prems_data = pd.read_csv(path)
+        prems_data = schemas.read_csv(path, 'premises_msoa',
+            ['mistral_function_class', 'floor_area', 'footprint_area'])
     except:
         return 'path does not exist'
 
@@ -355,7 +354,7 @@ def get_area_stats(msoa, lad, hh_folder, prems_folder, area_features):
     region = area_features[msoa]['region'].lower().replace(' ', '')
     # fb_aps = area_features[msoa]['fb_ap_estimate']
 
-    pop_density_km2 = len(population) / area_km2
+    pop_density_km2 = population / area_km2
 
     if pop_density_km2 > 7959:
         geotype = 'urban'
@@ -368,11 +367,11 @@ def get_area_stats(msoa, lad, hh_folder, prems_folder, area_features):
         'msoa': msoa,
         'lad': lad,
         'region': region,
-        'population': len(population),
+        'population': population,
         'area_km2': area_km2,
         'pop_density_km2': pop_density_km2,
         'geotype': geotype,
-        'households': len(households),
+        'households': households,
         'prems_residential': residential,
         'prems_residential_floor_area': residential_floor_area,
         'prems_residential_footprint_area': residential_footprint_area,
@@ -395,7 +394,7 @@ if __name__ == '__main__':
     path_scot = os.path.join(BASE_PATH, 'scottish_iz_shapes', filename)
     filename = 'Output_Area_to_LSOA_to_area_to_Local_Authority_District__December_2017__Lookup_with_Area_Classifications_in_Great_Britain.csv'
     lookup = os.path.join(BASE_PATH, 'oa_lut', filename)
-    path_output = os.path.join(BASE_PATH, 'intermediate', 'output_areas.shp')
+    path_output = core.get_path('output_areas')
     all_data = process_shapes(path_output, path_ew, path_scot, lookup)#[:10]
 
     print('Processing area features')
@@ -407,7 +406,7 @@ if __name__ == '__main__':
     path = os.path.join(BASE_PATH, 'oa_lut', filename)
     unique_lads = get_lads(path)#[:1]
 
-    for lad in tqdm(unique_lads):
+    for lad in instrument.track(tqdm(unique_lads), 'preprocess_lad', label='lad'):
 
         print('Writing lower area premises data into each LAD folder')
         write_premises_data(lad)
@@ -415,10 +414,15 @@ if __name__ == '__main__':
         print('Writing household demographic data')
         write_hh_data(lad)
 
+    print('Building the population store')
+    population.build_store(core.get_path('hh_by_lad_msoa'),
+        core.get_path('population_store'))
+
     print('Generating area lookup for all data')
     results = generate_msoa_lookup(unique_lads, area_features)
 
     print('Exporting area lookup')
     results = pd.DataFrame(results)
-    path = os.path.join(BASE_PATH, 'intermediate', 'oa_lookup.csv')
-    results.to_csv(path, index=False)
+    results.to_csv(core.get_path('oa_lookup'), index=False)
+
+    instrument.write_report('preprocess')
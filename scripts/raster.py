@@ -0,0 +1,314 @@
+"""
+Rasterized AP and premises density surfaces.
+
+Collected APs, premises and modelled APs (households with Wi-Fi and
+business APs from ns.py) are binned onto a British National Grid raster
+covering the areas with collected data. Each count grid is convolved (by
+FFT) with a circular kernel for every configured radius, giving the number
+per km2 within that distance of each cell. The density around any location
+and for any configured buffer size is then a single array lookup, rather
+than a buffer and overlay per location.
+
+The raster is split into square tiles, and only tiles overlapping the
+studied areas are made, so memory depends on the tile size rather than on
+how far apart the studied areas are. Each tile is convolved with a margin
+of the largest radius taken from its neighbours, so densities are the same
+as for one grid. Surfaces are saved as compressed numpy arrays in
+results/raster/<layer>, one file per tile, with the origin and resolution
+needed to look up locations.
+
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import ap_store
+import core
+import instrument
+import maup
+
+CONFIG = core.CONFIG
+
+RESOLUTION = CONFIG.getint('raster', 'resolution', fallback=50)
+RADII = [
+    int(radius) for radius in
+    CONFIG.get('raster', 'radii', fallback='200, 300, 400').split(',')
+]
+TILE_SIZE = CONFIG.getint('raster', 'tile_size', fallback=20000)
+
+
+def get_tile_ids(x, y, tile_size=TILE_SIZE):
+    """
+    Return the column and row of the tile holding each location.
+
+    """
+    tx = np.floor(np.asarray(x, dtype=np.float64) / tile_size).astype(np.int64)
+    ty = np.floor(np.asarray(y, dtype=np.float64) / tile_size).astype(np.int64)
+
+    return tx, ty
+
+
+def get_tiles(bounds, tile_size=TILE_SIZE):
+    """
+    Return the (column, row) of every tile overlapping any of a set of
+    (minx, miny, maxx, maxy) bounds, e.g. those of the studied areas.
+
+    """
+    tiles = set()
+
+    for minx, miny, maxx, maxy in np.asarray(bounds).reshape(-1, 4):
+        for tx in range(int(minx // tile_size), int(maxx // tile_size) + 1):
+            for ty in range(int(miny // tile_size), int(maxy // tile_size) + 1):
+                tiles.add((tx, ty))
+
+    return sorted(tiles)
+
+
+def get_tile_grid(tile, margin=0, tile_size=TILE_SIZE, resolution=RESOLUTION):
+    """
+    Return the origin (x, y of the south-west corner) and shape (rows,
+    cols) of the grid of a tile, plus a margin rounded up to whole cells.
+
+    """
+    if tile_size % resolution != 0:
+        raise ValueError('Tile size {}m is not a multiple of the {}m resolution'.format(
+            tile_size, resolution))
+
+    margin = int(np.ceil(margin / resolution)) * resolution
+    cells = (tile_size + 2 * margin) // resolution
+
+    return (tile[0] * tile_size - margin, tile[1] * tile_size - margin), (cells, cells)
+
+
+def get_tile_path(folder, tile):
+    """
+    Return the path of the file holding a tile of a surface.
+
+    """
+    return os.path.join(folder, '{}_{}.npz'.format(tile[0], tile[1]))
+
+
+def group_by_tile(x, y, tile_size=TILE_SIZE):
+    """
+    Return a dict of the positions of the locations within each tile.
+
+    """
+    tx, ty = get_tile_ids(x, y, tile_size)
+
+    return pd.DataFrame({'tx': tx, 'ty': ty}).groupby(['tx', 'ty']).indices
+
+
+def get_cells(x, y, origin, shape, resolution=RESOLUTION):
+    """
+    Return the row and column of each location, and whether it is on the grid.
+
+    """
+    rows = np.floor((np.asarray(y) - origin[1]) / resolution).astype(np.int64)
+    cols = np.floor((np.asarray(x) - origin[0]) / resolution).astype(np.int64)
+
+    valid = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+
+    return rows, cols, valid
+
+
+def rasterize(x, y, origin, shape, weights=None, resolution=RESOLUTION):
+    """
+    Count (or sum weights of) the locations in each grid cell.
+
+    """
+    rows, cols, valid = get_cells(x, y, origin, shape, resolution)
+
+    if weights is None:
+        weights = np.ones(len(rows))
+    weights = np.asarray(weights, dtype=np.float64)[valid]
+
+    index = rows[valid] * shape[1] + cols[valid]
+    counts = np.bincount(index, weights=weights, minlength=shape[0] * shape[1])
+
+    return counts.reshape(shape).astype(np.float32)
+
+
+def get_kernel(radius, resolution=RESOLUTION):
+    """
+    Return a circular kernel of the cells whose centres are within radius
+    of the centre cell.
+
+    """
+    size = int(radius // resolution)
+    offsets = np.arange(-size, size + 1) * resolution
+    distance = np.hypot(offsets[:, None], offsets[None, :])
+
+    return (distance <= radius).astype(np.float32)
+
+
+def get_density(counts, radius, resolution=RESOLUTION):
+    """
+    Return the number per km2 within radius of each cell.
+
+    """
+    from scipy.signal import fftconvolve
+
+    kernel = get_kernel(radius, resolution)
+    area_km2 = kernel.sum() * resolution ** 2 / 1e6
+
+    total = fftconvolve(counts.astype(np.float64), kernel.astype(np.float64), mode='same')
+
+    #remove the rounding noise of the transform around empty cells, which is
+    #relative to the largest window sum (weights can be small fractions)
+    scale = np.abs(counts).max(initial=0) * kernel.sum()
+    total[np.abs(total) <= 1e-9 * scale] = 0
+
+    return (total / area_km2).astype(np.float32)
+
+
+def write_surface(folder, x, y, weights, tiles, resolution=RESOLUTION, radii=RADII,
+    tile_size=TILE_SIZE):
+    """
+    Save the count grid and density surfaces for each radius of a layer,
+    one file per tile.
+
+    """
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if weights is None:
+        weights = np.ones(len(x))
+    weights = np.asarray(weights, dtype=np.float64)
+
+    if max(radii) > tile_size:
+        raise ValueError('Radii must be no larger than the {}m tile size'.format(tile_size))
+
+    positions = group_by_tile(x, y, tile_size)
+    margin = int(np.ceil(max(radii) / resolution))
+
+    for tile in tiles:
+
+        #locations within the tile and its neighbours, for the margin
+        index = [
+            positions[(tile[0] + dx, tile[1] + dy)]
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            if (tile[0] + dx, tile[1] + dy) in positions
+        ]
+        index = np.concatenate(index) if len(index) > 0 else np.array([], dtype=np.int64)
+
+        origin, shape = get_tile_grid(tile, margin * resolution, tile_size, resolution)
+        counts = rasterize(x[index], y[index], origin, shape, weights[index], resolution)
+
+        inner = slice(margin, shape[0] - margin)
+
+        arrays = {
+            'origin': np.array((tile[0] * tile_size, tile[1] * tile_size), dtype=np.float64),
+            'resolution': np.array(resolution),
+            'radii': np.array(radii),
+            'counts': counts[inner, inner],
+        }
+
+        for radius in radii:
+            density = get_density(counts, radius, resolution)
+            arrays['density_{}m'.format(radius)] = density[inner, inner]
+
+        np.savez_compressed(get_tile_path(folder, tile), **arrays)
+
+
+def load_surface(path):
+    """
+    Load the arrays of a saved surface tile.
+
+    """
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def sample(folder, x, y, radius, tile_size=TILE_SIZE):
+    """
+    Return the density within radius of each location (NaN outside the
+    saved tiles), for one of the radii the surface was saved with.
+
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    output = np.full(len(x), np.nan, dtype=np.float32)
+
+    for tile, index in group_by_tile(x, y, tile_size).items():
+
+        path = get_tile_path(folder, tile)
+        if not os.path.exists(path):
+            continue
+
+        surface = load_surface(path)
+        values = surface['density_{}m'.format(radius)]
+        rows, cols, valid = get_cells(x[index], y[index], surface['origin'],
+            values.shape, int(surface['resolution']))
+
+        output[index[valid]] = values[rows[valid], cols[valid]]
+
+    return output
+
+
+@instrument.timed
+def get_modelled_aps(premises, ns_results):
+    """
+    Spread the modelled APs of each MSOA over its premises: household Wi-Fi
+    over residential premises, and business APs over other premises.
+
+    """
+    ns_results = ns_results.set_index('msoa')
+
+    weights = np.zeros(len(premises))
+
+    for residential, column in [(True, 'hh_wifi_access'), (False, 'baps_total_baseline')]:
+
+        selected = (premises['residential'] == residential).values
+        counts = premises.loc[selected].groupby('msoa')['msoa'].transform('size')
+        totals = premises.loc[selected, 'msoa'].map(ns_results[column]).fillna(0)
+
+        weights[selected] = (totals / counts).values
+
+    return weights
+
+
+if __name__ == '__main__':
+
+    print('----Working on density surfaces')
+    print('----')
+
+    areas = pd.read_csv(core.get_path('oa_list'))['msoa'].tolist()
+    lookup = core.load_oa_lookup()
+
+    shapes = core.load_output_areas()
+    shapes = shapes.loc[shapes['msoa'].isin(areas)]
+
+    tiles = get_tiles(shapes.bounds.values)
+    print('Using {} tiles of {}m at {}m'.format(len(tiles), TILE_SIZE, RESOLUTION))
+
+    print('Loading premises and collected APs')
+    premises = maup.load_premises(areas, lookup)
+    points = ap_store.load_partitions(core.get_path('ap_store'), areas)
+
+    #object typed when no premises were found
+    residential = premises['residential'].astype(bool)
+
+    layers = {
+        'aps': (points.geometry.x.values, points.geometry.y.values, None),
+        'premises': (premises['x'], premises['y'], None),
+        'residential': (premises['x'], premises['y'], residential),
+        'non_residential': (premises['x'], premises['y'], ~residential),
+    }
+
+    path = core.get_path('ns_results')
+    if os.path.exists(path):
+        weights = get_modelled_aps(premises, pd.read_csv(path))
+        layers['modelled_aps'] = (premises['x'], premises['y'], weights)
+
+    folder = os.path.join(core.RESULTS_PATH, 'raster')
+
+    for layer, (x, y, weights) in layers.items():
+
+        print('Writing {} surfaces'.format(layer))
+        write_surface(os.path.join(folder, layer), x, y, weights, tiles)
+
+    instrument.write_report('raster')
@@ -0,0 +1,414 @@
+"""
+Run the pipeline stages in dependency order.
+
+Each stage declares the files it reads and writes. A stage depends on the
+stages which write its inputs, independent stages run at the same time
+(e.g. ns.py alongside the oa_list, prems and sc chain), and a stage is
+skipped when its outputs exist and it last succeeded after its inputs and
+its script were changed. Logs and completion stamps are kept in
+results/logs.
+
+Run from the root of the repository:
+
+    python scripts/run.py
+    python scripts/run.py sc --msoas E02000001 E02000002
+    python scripts/run.py ns --regions London --jobs 2
+
+Naming stages runs them and any stages they depend on. With --msoas or
+--regions, stages which loop over areas only process the subset and are
+always rerun, while the national stages they depend on run only if out of
+date.
+
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import core
+
+BASE_PATH = core.BASE_PATH
+RESULTS_PATH = core.RESULTS_PATH
+VIS_PATH = core.VIS_PATH
+
+SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
+INTERMEDIATE = core.INTERMEDIATE_PATH
+
+STAGES = [
+    {
+        'name': 'preprocess',
+        'script': os.path.join(SCRIPTS_PATH, 'preprocess.py'),
+        'inputs': [
+            os.path.join(BASE_PATH, 'msoa_shapes'),
+            os.path.join(BASE_PATH, 'scottish_iz_shapes'),
+            os.path.join(BASE_PATH, 'oa_lut'),
+            os.path.join(BASE_PATH, 'prems_by_lad'),
+            os.path.join(BASE_PATH, 'hh_demographics_msoa_2018'),
+        ],
+        'outputs': [
+            os.path.join(INTERMEDIATE, 'oa_lookup.csv'),
+            os.path.join(INTERMEDIATE, 'output_areas.shp'),
+            os.path.join(INTERMEDIATE, 'boundaries_full.shp'),
+            os.path.join(INTERMEDIATE, 'boundaries_100m.shp'),
+            os.path.join(INTERMEDIATE, 'hh_by_lad_msoa'),
+            os.path.join(INTERMEDIATE, 'population_store'),
+        ],
+        'per_area': False,
+    },
+    {
+        'name': 'oa_list',
+        'script': os.path.join(SCRIPTS_PATH, 'oa_list.py'),
+        'inputs': [
+            os.path.join(BASE_PATH, 'wigle', 'all_kml_data'),
+            os.path.join(INTERMEDIATE, 'boundaries_full.shp'),
+            os.path.join(INTERMEDIATE, 'boundaries_100m.shp'),
+        ],
+        'outputs': [
+            os.path.join(INTERMEDIATE, 'oa_list.csv'),
+            os.path.join(INTERMEDIATE, 'ap_store'),
+        ],
+        'per_area': False,
+    },
+    {
+        'name': 'prems',
+        'script': os.path.join(SCRIPTS_PATH, 'prems.py'),
+        'inputs': [
+            os.path.join(INTERMEDIATE, 'oa_list.csv'),
+            os.path.join(INTERMEDIATE, 'output_areas.shp'),
+            os.path.join(BASE_PATH, 'shapes', 'lad_uk_2016-12.shp'),
+            os.path.join(BASE_PATH, 'prems_by_lad'),
+        ],
+        'outputs': [
+            os.path.join(INTERMEDIATE, 'prems_by_lad_msoa'),
+        ],
+        'per_area': True,
+    },
+    {
+        'name': 'sc',
+        'script': os.path.join(SCRIPTS_PATH, 'sc.py'),
+        'inputs': [
+            os.path.join(INTERMEDIATE, 'oa_list.csv'),
+            os.path.join(INTERMEDIATE, 'oa_lookup.csv'),
+            os.path.join(INTERMEDIATE, 'boundaries_100m.shp'),
+            os.path.join(INTERMEDIATE, 'ap_store'),
+            os.path.join(INTERMEDIATE, 'prems_by_lad_msoa'),
+            os.path.join(BASE_PATH, 'shapes', 'lad_uk_2016-12.shp'),
+        ],
+        'outputs': [
+            os.path.join(RESULTS_PATH, 'all_buffered_points_200m.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_300m.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_400m.csv'),
+        ],
+        'per_area': True,
+    },
+    {
+        'name': 'ns',
+        'script': os.path.join(SCRIPTS_PATH, 'ns.py'),
+        'inputs': [
+            os.path.join(BASE_PATH, 'ons_local_business_counts', 'business_counts.csv'),
+            os.path.join(INTERMEDIATE, 'oa_lookup.csv'),
+            os.path.join(INTERMEDIATE, 'population_store'),
+        ],
+        'outputs': [
+            os.path.join(RESULTS_PATH, 'estimated_adoption_ns.csv'),
+        ],
+        'per_area': True,
+    },
+    {
+        'name': 'sectors',
+        'script': os.path.join(SCRIPTS_PATH, 'sectors.py'),
+        'inputs': [
+            os.path.join(BASE_PATH, 'pcd_sector_geotypes', 'pcd_sector_geotypes.csv'),
+            core.get_path('pcd_sector_shapes'),
+            os.path.join(INTERMEDIATE, 'oa_lookup.csv'),
+            os.path.join(RESULTS_PATH, 'estimated_adoption_ns.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_200m.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_300m.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_400m.csv'),
+        ],
+        #named as approximate without sector shapes (see sectors.py)
+        'outputs': [
+            core.get_path('ns_results_pcd_sectors')
+            if os.path.exists(core.get_path('pcd_sector_shapes'))
+            else core.get_path('ns_results_pcd_sectors_approx'),
+        ],
+        'per_area': False,
+    },
+    {
+        'name': 'maup',
+        'script': os.path.join(SCRIPTS_PATH, 'maup.py'),
+        'inputs': [
+            os.path.join(INTERMEDIATE, 'oa_list.csv'),
+            os.path.join(INTERMEDIATE, 'oa_lookup.csv'),
+            os.path.join(INTERMEDIATE, 'output_areas.shp'),
+            os.path.join(INTERMEDIATE, 'ap_store'),
+            os.path.join(INTERMEDIATE, 'prems_by_lad_msoa'),
+        ],
+        'outputs': [
+            os.path.join(RESULTS_PATH, 'maup', 'maup_summary.csv'),
+        ],
+        'per_area': False,
+    },
+    {
+        'name': 'raster',
+        'script': os.path.join(SCRIPTS_PATH, 'raster.py'),
+        'inputs': [
+            os.path.join(INTERMEDIATE, 'oa_list.csv'),
+            os.path.join(INTERMEDIATE, 'output_areas.shp'),
+            os.path.join(INTERMEDIATE, 'ap_store'),
+            os.path.join(INTERMEDIATE, 'prems_by_lad_msoa'),
+            os.path.join(RESULTS_PATH, 'estimated_adoption_ns.csv'),
+        ],
+        'outputs': [
+            os.path.join(RESULTS_PATH, 'raster', 'aps'),
+            os.path.join(RESULTS_PATH, 'raster', 'modelled_aps'),
+        ],
+        'per_area': False,
+    },
+    {
+        'name': 'effort',
+        'script': os.path.join(SCRIPTS_PATH, 'effort.py'),
+        'inputs': [
+            os.path.join(BASE_PATH, 'gps_trajectories.csv'),
+            os.path.join(INTERMEDIATE, 'oa_list.csv'),
+            os.path.join(INTERMEDIATE, 'output_areas.shp'),
+            os.path.join(INTERMEDIATE, 'ap_store'),
+        ],
+        'outputs': [
+            os.path.join(RESULTS_PATH, 'effort', 'effort_msoa.csv'),
+            os.path.join(RESULTS_PATH, 'effort', 'grid'),
+        ],
+        'per_area': False,
+    },
+    {
+        'name': 'vis',
+        'script': os.path.join(SCRIPTS_PATH, '..', 'vis', 'vis.py'),
+        'inputs': [
+            os.path.join(INTERMEDIATE, 'oa_lookup.csv'),
+            os.path.join(RESULTS_PATH, 'estimated_adoption_ns.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_200m.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_300m.csv'),
+            os.path.join(RESULTS_PATH, 'all_buffered_points_400m.csv'),
+        ],
+        'outputs': [
+            os.path.join(VIS_PATH, 'all_data_to_plot.csv'),
+        ],
+        'per_area': False,
+    },
+]
+
+
+def get_dependencies(stages):
+    """
+    Return a dict of the stages each stage depends on, being those which
+    write one of its inputs.
+
+    """
+    output = {}
+
+    for stage in stages:
+        inputs = set(os.path.normpath(path) for path in stage['inputs'])
+        output[stage['name']] = [
+            other['name'] for other in stages
+            if other['name'] != stage['name']
+            and inputs & set(os.path.normpath(path) for path in other['outputs'])
+        ]
+
+    return output
+
+
+def check_cycles(dependencies):
+    """
+    Raise an error if any stages depend on each other in a cycle.
+
+    """
+    remaining = {name: set(deps) for name, deps in dependencies.items()}
+
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps & set(remaining)]
+        if len(ready) == 0:
+            raise ValueError('Stages depend on each other in a cycle: {}'.format(
+                ', '.join(sorted(remaining))))
+        for name in ready:
+            del remaining[name]
+
+
+def get_subgraph(names, dependencies):
+    """
+    Return the named stages and every stage they depend on.
+
+    """
+    selected = set()
+    to_visit = list(names)
+
+    while to_visit:
+        name = to_visit.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        to_visit += dependencies[name]
+
+    return selected
+
+
+def get_stamp_path(stage, folder):
+    """
+    Return the path of the file marking a stage's last successful run.
+
+    """
+    return os.path.join(folder, stage['name'] + '.done')
+
+
+def is_up_to_date(stage, folder):
+    """
+    Return True if every output of a stage exists and the stage last
+    succeeded after all of its inputs and its script were modified.
+
+    Stages which add to existing folders (and skip work already done) do not
+    always touch their outputs, so the completion stamp is compared instead.
+
+    """
+    if any(not os.path.exists(path) for path in stage['outputs']):
+        return False
+
+    finished = core.get_mtime(get_stamp_path(stage, folder))
+    if finished is None:
+        return False
+
+    inputs = [core.get_mtime(path) for path in stage['inputs'] + [stage['script']]]
+    inputs = [mtime for mtime in inputs if mtime is not None]
+    if len(inputs) == 0:
+        return True
+
+    return finished >= max(inputs)
+
+
+def run_stage(stage, env, folder, stamp=True):
+    """
+    Run a stage's script in its own process, writing its output to a log
+    and, if it succeeds, marking it complete. A run for a subset of areas is
+    not marked complete. Returns the exit code and wall time (s).
+
+    """
+    log_path = os.path.join(folder, stage['name'] + '.log')
+    stamp_path = get_stamp_path(stage, folder)
+
+    if os.path.exists(stamp_path):
+        os.remove(stamp_path)
+
+    start = time.perf_counter()
+    with open(log_path, 'w') as log:
+        process = subprocess.run([sys.executable, stage['script']],
+            stdout=log, stderr=subprocess.STDOUT, env=env)
+
+    if process.returncode == 0 and stamp:
+        open(stamp_path, 'w').close()
+
+    return process.returncode, time.perf_counter() - start
+
+
+def run_pipeline(names, msoas=None, regions=None, jobs=2, force=False, dry_run=False):
+    """
+    Run the named stages (and those they depend on), running stages whose
+    dependencies have finished concurrently, up to the given number at once.
+    Returns a dict of the outcome of each stage.
+
+    """
+    dependencies = get_dependencies(STAGES)
+    check_cycles(dependencies)
+    selected = get_subgraph(names, dependencies)
+    stages = {stage['name']: stage for stage in STAGES if stage['name'] in selected}
+
+    subset = bool(msoas) or bool(regions)
+
+    env = dict(os.environ)
+    env['STAWPY_MSOAS'] = ','.join(msoas or [])
+    env['STAWPY_REGIONS'] = ','.join(regions or [])
+
+    folder = os.path.join(RESULTS_PATH, 'logs')
+    if not dry_run and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    outcomes = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+
+        while len(outcomes) < len(stages):
+
+            for name, stage in stages.items():
+
+                if name in outcomes or name in running.values():
+                    continue
+
+                deps = [dep for dep in dependencies[name] if dep in stages]
+                if any(dep not in outcomes for dep in deps):
+                    continue
+
+                if any(outcomes[dep] not in ('ok', 'up to date') for dep in deps):
+                    outcomes[name] = 'not run'
+                    print('-- {}: not run, a dependency did not succeed'.format(name))
+                    continue
+
+                partial = subset and stage['per_area']
+                rerun = force or partial
+                if not rerun and (
+                    all(outcomes[dep] == 'up to date' for dep in deps)
+                    and is_up_to_date(stage, folder)):
+                    outcomes[name] = 'up to date'
+                    print('-- {}: up to date'.format(name))
+                    continue
+
+                if dry_run:
+                    outcomes[name] = 'ok'
+                    print('-- {}: would run'.format(name))
+                    continue
+
+                print('-- {}: running'.format(name))
+                running[executor.submit(run_stage, stage, env, folder, not partial)] = name
+
+            if len(running) == 0:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+                status, wall_time = future.result()
+                outcomes[name] = 'ok' if status == 0 else 'failed ({})'.format(status)
+                print('-- {}: {} in {:.1f}s (log in {})'.format(name, outcomes[name],
+                    wall_time, os.path.join(folder, name + '.log')))
+
+    return outcomes
+
+
+if __name__ == '__main__':
+
+    names = [stage['name'] for stage in STAGES]
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('stages', nargs='*', default=[],
+        metavar='stage', help='stages to run (default all): {}'.format(', '.join(names)))
+    parser.add_argument('--msoas', nargs='+', help='only process these MSOAs')
+    parser.add_argument('--regions', nargs='+', help='only process MSOAs in these regions')
+    parser.add_argument('--jobs', type=int, default=2,
+        help='maximum number of stages to run at once')
+    parser.add_argument('--force', action='store_true',
+        help='run stages even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true',
+        help='show which stages would run')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.stages if name not in names]
+    if unknown:
+        parser.error('unknown stage(s): {} (choose from {})'.format(
+            ', '.join(unknown), ', '.join(names)))
+
+    outcomes = run_pipeline(args.stages or names, args.msoas, args.regions,
+        args.jobs, args.force, args.dry_run)
+
+    failed = [name for name, outcome in outcomes.items()
+        if outcome not in ('ok', 'up to date')]
+    sys.exit(1 if failed else 0)
@@ -8,21 +8,24 @@ April 2020
 """
 import os
 import csv
-import configparser
 import math
 import pandas as pd
 import geopandas as gpd
-from pykml import parser
 from shapely.geometry import mapping, Polygon
 from shapely import wkt
-import numpy as np
-import seaborn as sns; sns.set()
-import matplotlib.pyplot as plt
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(os.path.dirname(__file__), 'script_config.ini'))
-BASE_PATH = CONFIG['file_locations']['base_path']
-RESULTS_PATH = CONFIG['file_locations']['results']
+import ap_store
+import boundaries
+from chunks import ChunkAccumulator
+import core
+import ingest
+import instrument
+import schemas
+import subset
+from oa_list import assign_msoa, deduplicate_aps
+
+BASE_PATH = core.BASE_PATH
+RESULTS_PATH = core.RESULTS_PATH
 
 def process_area_data(area_data):
     """
@@ -46,12 +49,13 @@ def process_area_data(area_data):
     return output
 
 
+@instrument.timed
 def load_collected_ap_data(folder, files):
     """
     Load existing AP data collected.
 
     """
-    all_data = []
+    all_data = ChunkAccumulator()
 
     for filename in files:
 
@@ -63,10 +67,9 @@ def load_collected_ap_data(folder, files):
 
         data = load_data(path)
 
-        all_data = all_data + data
+        all_data.add(data)
 
-    all_data = gpd.GeoDataFrame.from_features(all_data)
-    all_data.crs = 'epsg:4326'
+    all_data = all_data.to_geoframe(crs='epsg:4326')
     all_data = all_data.to_crs('epsg:27700')
 
     return all_data
@@ -77,6 +80,8 @@ def load_data(path):
     Load existing AP data collected from Wigle to geojson.
 
     """
+    from pykml import parser
+
     with open(path) as f:
         folder = parser.parse(f).getroot().Document.Folder
 
@@ -109,6 +114,7 @@ def load_data(path):
     return output
 
 
+@instrument.timed
 def process_points(points, buffer_size):
     """
     First, merge very close points with a union. Second, add
@@ -120,7 +126,7 @@ def process_points(points, buffer_size):
     points_union = points.unary_union
 
     if points_union.geom_type == 'MultiPolygon':
-        points = list(points_union)
+        points = list(points_union.geoms)
     if points_union.geom_type == 'Polygon':
         points = []
         points.append(points_union)
@@ -140,6 +146,7 @@ def process_points(points, buffer_size):
     return points
 
 
+@instrument.timed
 def get_geojson_buildings(loaded_buildings):
     """
     Return loaded buildings as a geojson object.
@@ -166,13 +173,14 @@ def get_geojson_buildings(loaded_buildings):
 
     return output
 
+@instrument.timed
 def intersect_w_points(buffered_points, all_data, buildings, oa_data):
     """
     Convert point data to buffered points by intersecting.
 
     """
     print('Intersecting buffers with collected waps data')
-    f = lambda x:np.sum(all_data.intersects(x))
+    f = lambda x:len(boundaries.points_in_area(all_data, x))
     buffered_points['waps_collected'] = buffered_points['geometry'].apply(f)
 
     buffered_points['area_km2'] = buffered_points['geometry'].area / 1e6
@@ -205,28 +213,31 @@ def intersect_w_points(buffered_points, all_data, buildings, oa_data):
         'waps_km2'
     ]]
 
-    merged = merged.to_dict('records')
+    #buffers are numbered 0, 1, 2... by process_points, so the FID is an
+    #integer code and buildings are totalled for every buffer in one pass
+    grouped = merged.groupby('FID')
+    totals = pd.DataFrame({
+        'res_count': grouped['rc'].sum(),
+        'floor_area': grouped['fa'].sum(),
+        'building_count': grouped.size(),
+        'nonres_count': grouped['nrc'].sum(),
+    })
+    #a missing floor area leaves the buffer total unknown
+    missing = merged['fa'].isna().groupby(merged['FID']).any()
+    totals.loc[missing.index[missing.values], 'floor_area'] = math.nan
+    totals = totals.to_dict('index')
+
+    no_buildings = {'res_count': 0, 'floor_area': 0, 'building_count': 0, 'nonres_count': 0}
 
     buffered_points_aggregated = []
 
     for idx, buffered_point in buffered_points.iterrows():
 
-        res_count = 0
-        floor_area = 0
-        building_count = 0
-        nonres_count = 0
-
-        for merged_points in merged:
-            if buffered_point['FID'] == merged_points['FID']:
-                if not merged_points['rc'] is None:
-                    if not math.isnan(merged_points['rc']):
-                        res_count += merged_points['rc']
-                if not merged_points['fa'] is None:
-                    floor_area += merged_points['fa']
-                building_count += 1
-                if not merged_points['nrc'] is None:
-                    if not math.isnan(merged_points['nrc']):
-                        nonres_count += merged_points['nrc']
+        total = totals.get(buffered_point['FID'], no_buildings)
+        res_count = total['res_count']
+        floor_area = total['floor_area']
+        building_count = total['building_count']
+        nonres_count = total['nonres_count']
 
         area_km2 = buffered_point['geometry'].area / 1e6
 
@@ -244,9 +255,8 @@ def intersect_w_points(buffered_points, all_data, buildings, oa_data):
                 'geotype': oa_data['geotype'],
                 'lad': oa_data['lad'],
                 'population': oa_data['population'],
-                'area_km2': oa_data['area_km2'],
+                'oa_area_km2': oa_data['area_km2'],
                 'pop_density_km2': oa_data['pop_density_km2'],
-                'geotype': oa_data['geotype'],
             }
         })
 
@@ -259,48 +269,85 @@ def intersect_w_points(buffered_points, all_data, buildings, oa_data):
     return buffered_points_aggregated
 
 
+def clear_cached_points(folder):
+    """
+    Remove cached collected and buffered points (and any results derived
+    from them) for an area, so they are recomputed on the next run.
+
+    """
+    if not os.path.exists(folder):
+        return
+
+    for filename in os.listdir(folder):
+        if filename.startswith(('collected_points', 'buffered_points', 'oa_aps_buffered')):
+            os.remove(os.path.join(folder, filename))
+
+
+@instrument.timed
 def collate_data(oa_data, area_data, buffer_sizes):
     """
     Collect data from each area folder and place in a single csv.
 
+    Area results are streamed into the output files one at a time, so memory
+    use does not grow with the number of areas. The headers of all area
+    files are read first, so every output holds the union of their columns
+    (blank where an area's file lacks one). Each output is written to a
+    temporary file and only renamed into place when complete.
+
     """
+    outputs = {}
+
     for buffer_size in buffer_sizes:
+        filename = 'all_buffered_points_{}m.csv'.format(buffer_size)
+        outputs[buffer_size] = {
+            'path': os.path.join(RESULTS_PATH, filename),
+            'columns': [],
+            'files': [],
+        }
 
-        all_data = []
+    for oa_area in oa_data['msoa'].unique():
 
-        for idx, row in oa_data.iterrows():
+        if oa_area in area_data:
+            area_lut = area_data[oa_area]
+        else:
+            continue
 
-            oa_area = row['msoa']
+        folder = os.path.join(BASE_PATH, '..', 'results', oa_area)
 
-            if oa_area in [p for p in area_data.keys()]:
-                area_lut = area_data[oa_area]
-            else:
-                continue
+        for buffer_size in buffer_sizes:
 
-            folder = os.path.join(BASE_PATH, '..', 'results', oa_area)
             filename = 'oa_aps_buffered_{}.csv'.format(buffer_size)
             path = os.path.join(folder, filename)
 
-            print('-- Getting data for {}'.format(oa_area))
+            if not os.path.exists(path):
+                continue
 
-            if os.path.exists(path):
+            output = outputs[buffer_size]
+            columns = list(pd.read_csv(path, nrows=0).columns) + ['geotype']
+            for column in columns:
+                if column not in output['columns']:
+                    output['columns'].append(column)
+            output['files'].append((oa_area, path, area_lut['geotype']))
 
-                data = pd.read_csv(path)
+    for buffer_size, output in outputs.items():
 
-                geotype =  area_lut['geotype']
-                data['geotype'] = geotype
+        header = True
 
-                data = data.to_dict('records')
+        for oa_area, path, geotype in output['files']:
 
-                all_data = all_data + data
-            else:
-                pass
+            print('-- Getting {}m data for {}'.format(buffer_size, oa_area))
 
-        aps = pd.DataFrame(all_data)
+            data = pd.read_csv(path)
+            data['geotype'] = geotype
 
-        filename = 'all_buffered_points_{}m.csv'.format(buffer_size)
-        path_output = os.path.join(RESULTS_PATH, filename)
-        aps.to_csv(path_output, index=False)
+            data = data.reindex(columns=output['columns'])
+            data.to_csv(output['path'] + '.tmp', index=False,
+                mode='w' if header else 'a', header=header)
+            header = False
+
+        if header:
+            pd.DataFrame().to_csv(output['path'] + '.tmp', index=False)
+        os.replace(output['path'] + '.tmp', output['path'])
 
     return print('Completed data collation')
 
@@ -308,29 +355,21 @@ def collate_data(oa_data, area_data, buffer_sizes):
 if __name__ == '__main__':
 
     print('Loading a list of the areas with data')
-    path = os.path.join(BASE_PATH, 'intermediate', 'oa_list.csv')
+    path = core.get_path('oa_list')
     oa_data = pd.read_csv(path)#[:1]
 
     print('Loading in area boundary shapes')
-    path = os.path.join(BASE_PATH, 'intermediate', 'output_areas.shp')
-    oa_shapes = gpd.read_file(path)
-    oa_shapes.crs = 'epsg:27700'
-    oa_shapes = oa_shapes.to_crs('epsg:27700')
+    boundary_level = 100
+    oa_shapes = boundaries.load_boundaries(boundary_level)
 
     print('Loading in local authority district boundary shapes')
-    path = os.path.join(BASE_PATH, 'shapes', 'lad_uk_2016-12.shp')
-    lad_shapes = gpd.read_file(path)
-    lad_shapes.crs = 'epsg:27700'
-    lad_shapes = lad_shapes.to_crs('epsg:27700')
+    lad_shapes = core.load_lad_shapes()
 
     print('Processing area lookup data')
-    filename = 'oa_lookup.csv'
-    path = os.path.join(BASE_PATH, 'intermediate', filename)
-    area_data = pd.read_csv(path)
-    area_data = process_area_data(area_data)
+    area_data = process_area_data(core.load_oa_lookup())
 
     print('Getting filenames of kml files')
-    folder_kml = os.path.join(BASE_PATH, 'wigle', 'all_kml_data')
+    folder_kml = core.get_path('kml')
     files = os.listdir(folder_kml)
 
     print('Creating results folder if it does not already exist')
@@ -338,21 +377,35 @@ if __name__ == '__main__':
     if not os.path.exists(results):
         os.makedirs(results)
 
-    print('Processing or loading the collected points')
-    path = os.path.join(BASE_PATH, 'intermediate', 'all_collected_points.shp')
-    if not os.path.exists(path):
-        all_data = load_collected_ap_data(folder_kml, files)
-    else:
-        all_data = gpd.read_file(path, crs='epsg:27700')
+    print('Clearing cached results for areas with newly ingested points')
+    path_stale = core.get_path('stale_msoas')
+    for oa in ingest.load_stale(path_stale):
+        clear_cached_points(os.path.join(results, oa))
+
+    store = core.get_path('ap_store')
+    if not ap_store.exists(store):
+        print('Processing or loading the collected points')
+        path = os.path.join(BASE_PATH, 'intermediate', 'all_collected_points.shp')
+        if not os.path.exists(path):
+            all_data = load_collected_ap_data(folder_kml, files)
+        else:
+            all_data = gpd.read_file(path, crs='epsg:27700')
+        all_data = deduplicate_aps(all_data)
+        if not 'msoa' in all_data.columns:
+            all_data = assign_msoa(all_data, boundaries.load_boundaries(None),
+                oa_shapes, boundary_level)
+        ap_store.write_partitions(all_data, store, scheme='msoa')
+        del all_data
 
     buffer_sizes = [200, 300, 400]
     problem_oa_data = []
 
     for buffer_size in buffer_sizes:
 
-        for idx, row in oa_data.iterrows():
+        areas = subset.select(oa_data['msoa'])
+        areas = instrument.track(areas, 'sc_area', buffer_size=buffer_size)
 
-            oa = row['msoa']
+        for oa in instrument.profile(areas, label=buffer_size):
 
             print('Creating a results folder (if one does not exist already)')
             folder = os.path.join(BASE_PATH, '..', 'results', str(oa))
@@ -374,7 +427,8 @@ if __name__ == '__main__':
                 boundary = gpd.read_file(path, crs='epsg:27700')
 
             print('Getting the LAD(s) which intersect the output area')
-            bbox = boundary.envelope
+            bbox = boundary.envelope.buffer(
+                boundaries.get_max_error(boundary_level), join_style=2)
             geo = gpd.GeoDataFrame()
             geo = gpd.GeoDataFrame({'geometry': bbox}, crs='epsg:27700')
             merged = gpd.overlay(geo, lad_shapes, how='intersection')
@@ -388,12 +442,11 @@ if __name__ == '__main__':
             print('Subsetting the collected points for the output area')
             collected_data = os.path.join(folder, 'collected_points.shp')
             if not os.path.exists(collected_data):
-                points_subset = all_data[all_data.intersects(boundary.unary_union)]
-                points_subset['netid_short'] = points_subset['network_id'].str[:20]
-                points_subset = points_subset.drop_duplicates('netid_short')
+                points_subset = ap_store.load_partitions(store, [oa])
                 points_subset.to_file(collected_data, crs='epsg:27700')
             else:
                 points_subset = gpd.read_file(collected_data, crs='epsg:27700')
+            instrument.add_rows(len(points_subset))
 
             print('Getting buffered points')
             collected_data = os.path.join(folder, 'buffered_points_{}.shp'.format(buffer_size))
@@ -406,8 +459,8 @@ if __name__ == '__main__':
 
             print('Subsetting the premises data for the output area')
             path = os.path.join(folder, 'buildings.shp')
-            buildings = gpd.GeoDataFrame()
             if not os.path.exists(path):
+                buildings = ChunkAccumulator()
                 for lad_id in lad_ids:
                     directory = os.path.join(BASE_PATH, 'intermediate', 'prems_by_lad_msoa', lad_id)
                     path_buildings = os.path.join(directory, oa + '.csv')
@@ -416,17 +469,15 @@ if __name__ == '__main__':
                         print('Unable to find building data for {}'.format(oa))
                         continue
                     else:
-                        loaded_buildings = pd.read_csv(path_buildings)
+                        loaded_buildings = schemas.read_csv(path_buildings, 'premises_msoa')
                         loaded_buildings = get_geojson_buildings(loaded_buildings)
-                        loaded_buildings = gpd.GeoDataFrame.from_features(loaded_buildings)
-                        buildings = buildings.append(loaded_buildings, ignore_index=True)
+                        buildings.add(loaded_buildings)
 
-                    if len(buildings) > 0:
-                        buildings.to_file(path, crs='epsg:27700')
-                    else:
-                        print('Unable to find building data for {}'.format(oa))
-                        continue
-                buildings.crs = 'epsg:27700'
+                buildings = buildings.to_geoframe(crs='epsg:27700')
+                if len(buildings) > 0:
+                    buildings.to_file(path, crs='epsg:27700')
+                else:
+                    print('Unable to find building data for {}'.format(oa))
             else:
                 buildings = gpd.read_file(path, crs='epsg:27700')
 
@@ -439,7 +490,8 @@ if __name__ == '__main__':
                         filename = 'oa_aps_buffered_{}.shp'.format(buffer_size)
                         path_out = os.path.join(folder, filename)
                         oa_aps.to_file(path_out, crs='epsg:27700')
-                        oa_aps.to_csv(output_path, index=False)
+                        oa_aps.to_csv(output_path + '.tmp', index=False)
+                        os.replace(output_path + '.tmp', output_path)
                     else:
                         print('Unable to process {}'.format(oa))
                         problem_oa_data.append(str(oa))
@@ -449,4 +501,9 @@ if __name__ == '__main__':
     print('Collect a data and place in a single csv')
     collate_data(oa_data, area_data, buffer_sizes)
 
+    ingest.clear_stale(path_stale)
+
     print('Finished processing self-collected (SC) data')
+
+    instrument.write_report('sc')
+    instrument.write_profiles('sc')
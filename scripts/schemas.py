@@ -0,0 +1,160 @@
+"""
+Column schemas for the csv inputs, and a reader which applies them.
+
+Each schema lists only the columns the pipeline uses and a compact type for
+each: categoricals for repeated labels (regions, geotypes, building
+classes), 32-bit integers for identifiers and counts (nullable where values
+can be missing) and 32-bit floats for measures only used in memory. Data
+written back out to csv keep 64-bit floats, so values are not rounded. A
+type of None leaves it to the parser. Reading only these columns,
+already typed, cuts both parse time and memory.
+
+"""
+import importlib.util
+
+#the pyarrow csv parser is multithreaded, and used if installed
+ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') is not None else 'c'
+
+SCHEMAS = {
+    #Output Area to LSOA to MSOA to LAD lookup (~230,000 rows for GB)
+    'oa_lut': {
+        'OA11CD': 'str',
+        'LSOA11CD': 'str',
+        'MSOA11CD': 'str',
+        'LAD17CD': 'category',
+        'RGN11NM': 'category',
+    },
+    #synthetic population by person (ass_<lad>_area11_2018.csv), also the
+    #per area files written from it by preprocess.py
+    'hh_demographics': {
+        'PID': 'int32',
+        'Area': 'category',
+        'DC1117EW_C_AGE': 'int16',
+        'HID': 'int32',
+    },
+    #ONS business counts by employee size band
+    'business_counts': {
+        'Area': 'str',
+        'mnemonic': 'str',
+        'Micro (0 to 9)': 'int32',
+        'Small (10 to 49)': 'int32',
+        'Medium-sized (50 to 249)': 'int32',
+        '250 to 499': 'int32',
+        '500 to 999': 'int32',
+        '1000+': 'int32',
+    },
+    #ITRC premises by output area, with the footprint as wkt (measures are
+    #written back out by preprocess.py and prems.py, so kept at full precision)
+    'premises': {
+        'mistral_function_class': 'category',
+        'mistral_building_class': 'category',
+        'res_count': 'Int32',
+        'floor_area': 'float64',
+        'height_toroofbase': 'float64',
+        'height_torooftop': 'float64',
+        'nonres_count': 'Int32',
+        'number_of_floors': 'Int32',
+        'footprint_area': 'float64',
+        'geom': 'str',
+    },
+    #premises by area written by preprocess.py (totals are summed from these,
+    #so measures are kept at full precision, and counts are written to
+    #shapefiles by sc.py, which cannot hold nullable integers)
+    'premises_msoa': {
+        'mistral_function_class': 'category',
+        'mistral_building_class': 'category',
+        'res_count': None,
+        'floor_area': 'float64',
+        'height_toroofbase': 'float64',
+        'height_torooftop': 'float64',
+        'nonres_count': None,
+        'number_of_floors': None,
+        'footprint_area': 'float64',
+        'geometry': 'str',
+    },
+    #household adoption estimates cached by ns.py
+    'hh_estimates': {
+        'Area': 'str',
+        'hh_fixed_access': 'int8',
+        'hh_wifi_access': 'int8',
+    },
+    #GPS fixes of the drive tracks
+    'gps_trajectories': {
+        'Lat': 'float64',
+        'Lng': 'float64',
+        'Speed(km/h)': 'float32',
+        'Accuracy': 'float32',
+        'Date2': 'str',
+    },
+    #802.11 frames exported from a packet capture
+    'packet_capture': {
+        'No.': 'int64',
+        'Time': 'str',
+        'Source': 'str',
+        'Info': 'str',
+    },
+    #postcode sectors with their LAD, population and area
+    'pcd_sectors': {
+        'id': 'str',
+        'lad': 'str',
+        'population': 'float64',
+        'area_km2': 'float64',
+        'pop_density_km2': 'float64',
+        'lte_4G': 'int8',
+    },
+    #share of each source area in each target area, written by crosswalk.py
+    'crosswalk': {
+        'source': 'str',
+        'target': 'str',
+        'weight': 'float64',
+    },
+    #area lookup written by preprocess.py
+    'oa_lookup': {
+        'msoa': 'str',
+        'lad': 'category',
+        'region': 'category',
+        'population': 'int32',
+        'area_km2': 'float64',
+        'pop_density_km2': 'float64',
+        'geotype': 'category',
+        'households': 'int32',
+        'prems_residential': 'int32',
+        'prems_residential_floor_area': 'float64',
+        'prems_residential_footprint_area': 'float64',
+        'prems_non_residential': 'int32',
+        'prems_non_residential_floor_area': 'float64',
+        'prems_non_residential_footprint_area': 'float64',
+    },
+}
+
+
+def read_csv(path, schema, columns=None, chunksize=None, all_columns=False):
+    """
+    Read a csv file with a registered schema, optionally only a subset of
+    its columns, or in chunks of rows. With all_columns, every column in
+    the file is read, with the schema types for those it lists.
+
+    """
+    import pandas as pd
+
+    schema = SCHEMAS[schema]
+    if columns is None:
+        columns = list(schema)
+
+    dtypes = {column: schema[column] for column in columns if schema[column] is not None}
+
+    if all_columns:
+        columns = None
+
+    if chunksize is not None:
+        #the pyarrow parser cannot read in chunks
+        return pd.read_csv(path, usecols=columns, dtype=dtypes, engine='c',
+            chunksize=chunksize)
+
+    try:
+        return pd.read_csv(path, usecols=columns, dtype=dtypes, engine=ENGINE)
+    except (ValueError, TypeError):
+        if ENGINE == 'c':
+            raise
+        #options the pyarrow parser does not support
+        return pd.read_csv(path, usecols=columns, dtype=dtypes, engine='c')
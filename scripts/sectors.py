@@ -0,0 +1,183 @@
+"""
+Aggregate the ns and sc results from MSOAs to postcode sectors.
+
+Results are moved to sectors through a sparse MSOA to sector crosswalk,
+built once and stored in data/intermediate. Where sector boundaries are
+available (data/shapes/pcd_sectors.shp, with an 'id' field) the crosswalk
+is the area-weighted overlay of the MSOA and sector shapes.
+
+Otherwise each MSOA is split across all sectors of its LAD in proportion to
+sector area, so every sector of a LAD gets the same densities and rates:
+these are LAD averages spread over sectors, not sector figures. The
+crosswalk and results are then written with an '_approx' suffix.
+
+"""
+import os
+import re
+
+import pandas as pd
+
+import core
+import crosswalk
+import instrument
+import schemas
+
+BASE_PATH = core.BASE_PATH
+RESULTS_PATH = core.RESULTS_PATH
+
+#additive ns columns, moved to sectors by the crosswalk
+NS_COLUMNS = [
+    'households', 'hh_fixed_access', 'hh_wifi_access', 'businesses',
+    'ba_micro', 'ba_small', 'ba_medium', 'ba_large', 'ba_very_large', 'ba_total',
+    'bafa_micro', 'bafa_small', 'bafa_medium', 'bafa_large', 'bafa_very_large',
+    'bafa_total', 'baps_total_low', 'baps_total_baseline', 'baps_total_high',
+]
+
+#additive sc columns, summed by MSOA and then moved to sectors
+SC_COLUMNS = [
+    'res_count', 'floor_area', 'building_count', 'nonres_count',
+    'waps_collected', 'area_km2',
+]
+
+SECTOR_COLUMNS = ['id', 'lad', 'population', 'area_km2', 'pop_density_km2', 'lte_4G']
+
+
+def is_approximate():
+    """
+    Check whether results can only be approximated, without sector shapes.
+
+    """
+    return not os.path.exists(core.get_path('pcd_sector_shapes'))
+
+
+def get_crosswalk(path, lookup, sectors):
+    """
+    Load the MSOA to postcode sector crosswalk, building it first if it does
+    not exist or is older than its inputs.
+
+    """
+    path_shapes = core.get_path('pcd_sector_shapes')
+
+    inputs = [core.get_path('pcd_sectors'), core.get_path('oa_lookup')]
+    if os.path.exists(path_shapes):
+        inputs.append(path_shapes)
+
+    if os.path.exists(path):
+        modified = os.path.getmtime(path)
+        if all(os.path.getmtime(item) <= modified for item in inputs if os.path.exists(item)):
+            return crosswalk.load(path)
+
+    if os.path.exists(path_shapes):
+        import geopandas as gpd
+
+        print('Overlaying MSOA and postcode sector shapes')
+        shapes = gpd.read_file(path_shapes).to_crs('epsg:27700')
+        data = crosswalk.from_overlay(core.load_output_areas(), shapes, 'msoa', 'id')
+
+    else:
+        print('Splitting MSOAs by sector area within each LAD')
+        data = crosswalk.from_shares(lookup, sectors, 'lad', 'msoa', 'id', 'area_km2')
+
+    crosswalk.write(data, path)
+
+    return data
+
+
+def add_sector_data(data, sectors):
+    """
+    Add the sector statistics to results aggregated to sectors.
+
+    """
+    sectors = sectors[SECTOR_COLUMNS].rename(columns={'id': 'pcd_sector'})
+
+    return sectors.merge(data, on='pcd_sector', how='inner')
+
+
+@instrument.timed
+def aggregate_ns(data, xwalk, sectors):
+    """
+    Aggregate the ns results to postcode sectors, recomputing rates and
+    densities from the aggregated counts.
+
+    """
+    output = crosswalk.aggregate(data, xwalk, 'msoa', NS_COLUMNS,
+        target_id='pcd_sector')
+    output = add_sector_data(output, sectors)
+
+    households = output['households'].where(output['households'] > 0)
+
+    output['households_km2'] = output['households'] / output['area_km2']
+    output['perc_hh_fixed_access'] = (output['hh_fixed_access'] / households * 100).fillna(0)
+    output['perc_hh_wifi_access'] = (output['hh_wifi_access'] / households * 100).fillna(0)
+    output['business_density_km2'] = output['businesses'] / output['area_km2']
+
+    for level in ['low', 'baseline', 'high']:
+        output['baps_density_km2_{}'.format(level)] = (
+            output['baps_total_{}'.format(level)] / output['area_km2'])
+
+    return output
+
+
+@instrument.timed
+def aggregate_sc(data, xwalk, sectors):
+    """
+    Aggregate the buffered sc points to postcode sectors, via MSOA totals.
+
+    """
+    data = data.groupby('msoa', as_index=False)[SC_COLUMNS].sum()
+
+    output = crosswalk.aggregate(data, xwalk, 'msoa', SC_COLUMNS,
+        target_id='pcd_sector')
+    #the area covered by buffers, not that of the sector
+    output = output.rename(columns={'area_km2': 'buffer_area_km2'})
+    output = add_sector_data(output, sectors)
+
+    buffer_area = output['buffer_area_km2'].where(output['buffer_area_km2'] > 0)
+    output['waps_km2'] = (output['waps_collected'] / buffer_area).fillna(0)
+
+    return output
+
+
+if __name__ == '__main__':
+
+    print('----Working on aggregating results to postcode sectors')
+    print('----')
+
+    suffix = ''
+    if is_approximate():
+        print('No postcode sector shapes, so writing approximate results (LAD '
+            'averages spread over sectors) with an _approx suffix')
+        suffix = '_approx'
+
+    print('Loading postcode sectors')
+    sectors = schemas.read_csv(core.get_path('pcd_sectors'), 'pcd_sectors')
+
+    print('Loading the MSOA to postcode sector crosswalk')
+    xwalk = get_crosswalk(core.get_path('crosswalk_msoa_pcd_sector' + suffix),
+        core.load_oa_lookup(), sectors)
+
+    path = core.get_path('ns_results')
+    if os.path.exists(path):
+        print('Aggregating ns results')
+        results = aggregate_ns(pd.read_csv(path), xwalk, sectors)
+        results.to_csv(core.get_path('ns_results_pcd_sectors' + suffix), index=False)
+
+    for filename in sorted(os.listdir(RESULTS_PATH)):
+
+        match = re.match(r'all_buffered_points_(\d+)m\.csv$', filename)
+        if not match:
+            continue
+
+        print('Aggregating sc results for {}m buffers'.format(match.group(1)))
+        try:
+            data = pd.read_csv(os.path.join(RESULTS_PATH, filename),
+                usecols=['msoa'] + SC_COLUMNS)
+        except ValueError:
+            #no points were collated
+            continue
+
+        results = aggregate_sc(data, xwalk, sectors)
+        filename = 'sc_pcd_sectors{}_{}m.csv'.format(suffix, match.group(1))
+        results.to_csv(os.path.join(RESULTS_PATH, filename), index=False)
+
+    instrument.write_report('sectors')
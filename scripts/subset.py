@@ -0,0 +1,67 @@
+"""
+Restrict a run to a subset of areas.
+
+The pipeline driver (run.py) passes the requested MSOAs and regions to each
+stage in the STAWPY_MSOAS and STAWPY_REGIONS environment variables (comma
+separated). Stages which loop over areas only process those selected, while
+national steps run as normal.
+
+"""
+import os
+
+import core
+
+
+def parse_list(value):
+    """
+    Split a comma separated string into a list of stripped, non-empty values.
+
+    """
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+MSOAS = parse_list(os.environ.get('STAWPY_MSOAS', ''))
+REGIONS = parse_list(os.environ.get('STAWPY_REGIONS', ''))
+
+
+def is_active():
+    """
+    Return True if the run is restricted to a subset of areas.
+
+    """
+    return len(MSOAS) > 0 or len(REGIONS) > 0
+
+
+def get_area_regions():
+    """
+    Return a dict of region by MSOA from the area lookup.
+
+    """
+    lookup = core.load_oa_lookup()
+
+    return dict(zip(lookup['msoa'], lookup['region']))
+
+
+def select(areas):
+    """
+    Return the areas (MSOA codes) in the subset, keeping their order. All
+    areas are returned if no subset is set.
+
+    Regions match the start of the region name in the area lookup, ignoring
+    case (e.g. 'london' or 'east').
+
+    """
+    areas = list(areas)
+
+    if not is_active():
+        return areas
+
+    selected = set(MSOAS)
+
+    if len(REGIONS) > 0:
+        regions = tuple(region.lower() for region in REGIONS)
+        for msoa, region in get_area_regions().items():
+            if str(region).lower().startswith(regions):
+                selected.add(msoa)
+
+    return [area for area in areas if area in selected]
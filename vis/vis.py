@@ -8,76 +8,62 @@ July 2020
 """
 import os
 import sys
-import configparser
 import csv
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from shapely import wkt
 
-CONFIG = configparser.ConfigParser()
-CONFIG.read(os.path.join(os.path.dirname(__file__), '..', 'scripts', 'script_config.ini'))
-BASE_PATH = CONFIG['file_locations']['base_path']
-RESULTS_PATH = CONFIG['file_locations']['results']
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+from chunks import ChunkAccumulator
+import core
+
+BASE_PATH = core.BASE_PATH
+RESULTS_PATH = core.RESULTS_PATH
 
 
 def process_lookup(lookup):
     """
-    Process all output area lookup data into easily accessible dict.
+    Process all output area lookup data into a table indexed by area.
 
     """
-    output = {}
-
-    for idx, row in lookup.iterrows():
-
-        output[row['msoa']] = {
-            'lad': row['lad'],
-            'region': row['region'],
-            'population': row['population'],
-            'area_km2': row['area_km2'],
-            'pop_density_km2': row['pop_density_km2'],
-            'geotype': row['geotype'],
-            'households': row['households'],
-            'prems_residential': row['prems_residential'],
-            'prems_residential_floor_area': row['prems_residential_floor_area'],
-            'prems_residential_footprint_area': row['prems_residential_footprint_area'],
-            'prems_non_residential': row['prems_non_residential'],
-            'prems_non_residential_floor_area': row['prems_non_residential_floor_area'],
-            'prems_non_residential_footprint_area': row['prems_non_residential_footprint_area'],
-            'total_prems': (
-                row['prems_residential'] + row['prems_non_residential']
-            ),
-            'total_prems_density_km2': (
-                row['prems_residential'] + row['prems_non_residential']
-            ) / row['area_km2'],
-        }
+    output = lookup[['msoa', 'geotype', 'area_km2']].copy()
+
+    output['total_prems'] = (
+        lookup['prems_residential'] + lookup['prems_non_residential']
+    )
+    output['total_prems_density_km2'] = (
+        output['total_prems'] / lookup['area_km2']
+    )
+
+    return output.set_index('msoa')
 
-    return output
 
-def add_lut_data_to_ns(data, lookup, ap_coverage):
+def add_lut_data_to_ns(data, lookup, ap_coverage_levels):
     """
-    Add the output area data to the national stats estimate.
+    Add the output area data to the national stats estimate, for every
+    AP coverage level.
 
     """
+    data = data.drop(columns=lookup.columns, errors='ignore')
+    data = data.join(lookup, on='msoa', how='inner')
+
     output = []
 
-    for datum in data:
-        area = datum['msoa']
-        area = lookup[area]
+    for ap_coverage in ap_coverage_levels:
 
-        number_of_aps = datum['hh_wifi_access'] + datum['baps_total_{}'.format(ap_coverage)]
+        number_of_aps = (
+            data['hh_wifi_access'] + data['baps_total_{}'.format(ap_coverage)]
+        )
 
-        output.append({
-            'msoa': datum['msoa'],
-            'urban_rural': area['geotype'],
-            'total_prems': area['total_prems'],
-            'total_prems_density_km2': area['total_prems_density_km2'],
-            'number_of_aps': number_of_aps ,
-            'number_of_aps_density_km2': number_of_aps / area['area_km2'],
-        })
+        output.append(pd.DataFrame({
+            'msoa': data['msoa'],
+            'urban_rural': data['geotype'],
+            'total_prems': data['total_prems'],
+            'total_prems_density_km2': data['total_prems_density_km2'],
+            'number_of_aps': number_of_aps,
+            'number_of_aps_density_km2': number_of_aps / data['area_km2'],
+            'ap_coverage': ap_coverage,
+        }))
 
-    output = pd.DataFrame(output)
+    output = pd.concat(output, ignore_index=True)
 
     return output
 
@@ -86,41 +72,53 @@ def process_sc_data(data):
     """
     Process the self-collected wardriving data.
 
-    """
-    output = []
+    Buffers are aggregated by area (and by buffer size, if the data contain
+    more than one) in a single groupby pass.
 
-    unique_areas = data['msoa'].unique()
-
-    data = data.to_dict('records')
-
-    for area in unique_areas:
-
-        n = 0
-        floor_area = 0
-        adjusted_floor_area = 0
-        total_prems = 0
-        waps_collected = 0
-        area_km2 = 0
-
-        for item in data:
-            if area == item['msoa']:
-                n += 1
-                floor_area += item['floor_area']
-                adjusted_floor_area += item['adjusted_floor_area']
-                total_prems += item['building_count']
-                waps_collected += item['waps_collected']
-                area_km2 += wkt.loads(item['geometry']).area / 1e6
-
-        output.append({
-            'msoa': area,
-            'floor_area': floor_area / n,
-            'adjusted_floor_area': adjusted_floor_area / n,
-            'total_prems': total_prems / n,
-            'total_prems_density_km2': (total_prems / n) / (area_km2 / n),
-            'number_of_aps': waps_collected / n,
-            'number_of_aps_density_km2': waps_collected / area_km2,
-            'area_km2': area_km2 / n,
-        })
+    """
+    data = data.copy()
+
+    if 'oa_area_km2' not in data.columns:
+        # older sc results hold the area's own size in 'area_km2', so the
+        # buffer area has to come from the buffer geometry
+        import geopandas as gpd
+        data['area_km2'] = gpd.GeoSeries.from_wkt(data['geometry']).area / 1e6
+
+    if 'adjusted_floor_area' not in data.columns:
+        data['adjusted_floor_area'] = data['floor_area']
+
+    keys = ['msoa']
+    if 'buffer_size' in data.columns:
+        keys = ['buffer_size', 'msoa']
+
+    grouped = data.groupby(keys, sort=False)
+
+    output = grouped.agg(
+        n=('msoa', 'size'),
+        floor_area=('floor_area', 'mean'),
+        adjusted_floor_area=('adjusted_floor_area', 'mean'),
+        building_count=('building_count', 'sum'),
+        waps_collected=('waps_collected', 'sum'),
+        area_km2=('area_km2', 'sum'),
+    ).reset_index()
+
+    output['total_prems'] = output['building_count'] / output['n']
+    output['total_prems_density_km2'] = (
+        output['building_count'] / output['area_km2'])
+    output['number_of_aps'] = output['waps_collected'] / output['n']
+    output['number_of_aps_density_km2'] = (
+        output['waps_collected'] / output['area_km2'])
+    output['area_km2'] = output['area_km2'] / output['n']
+
+    output = output[keys + [
+        'floor_area',
+        'adjusted_floor_area',
+        'total_prems',
+        'total_prems_density_km2',
+        'number_of_aps',
+        'number_of_aps_density_km2',
+        'area_km2',
+    ]]
 
     return output
 
@@ -130,23 +128,11 @@ def add_lut_data_to_sc(data, lookup):
     Add the output area data to the self-collected wardriving data.
 
     """
-    output = []
+    data = data.join(lookup[['geotype']], on='msoa', how='inner')
 
-    for datum in data:
-        area = datum['msoa']
-        area = lookup[area]
-        output.append({
-            'msoa': datum['msoa'],
-            'urban_rural': area['geotype'],
-            'total_prems': datum['total_prems'],
-            'total_prems_density_km2': datum['total_prems_density_km2'],
-            'number_of_aps': datum['number_of_aps'],
-            'number_of_aps_density_km2': datum['number_of_aps_density_km2'],
-        })
+    data = data.rename(columns={'geotype': 'urban_rural'})
 
-    output = pd.DataFrame(output)
-
-    return output
+    return data
 
 
 def catplot_by_urban_rural(data, folder, buffer_size):
@@ -154,6 +140,9 @@ def catplot_by_urban_rural(data, folder, buffer_size):
     Generate category plots for urban and rural areas.
 
     """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     data = data[[
             'msoa',
             'urban_rural',
@@ -165,6 +154,7 @@ def catplot_by_urban_rural(data, folder, buffer_size):
             'buffer_size',
     ]]
 
+    data['urban_rural'] = data['urban_rural'].astype(str)
     data.loc[data['urban_rural'] == 'urban', 'urban_rural'] = 'Urban'
     data.loc[data['urban_rural'] == 'suburban', 'urban_rural'] = 'Suburban'
     data.loc[data['urban_rural'] == 'rural', 'urban_rural'] = 'Rural'
@@ -242,15 +232,12 @@ def catplot_by_urban_rural(data, folder, buffer_size):
 if __name__ == '__main__':
 
     print('Loading area lut')
-    filename = 'oa_lookup.csv'
-    path = os.path.join(BASE_PATH, 'intermediate', filename)
-    lookup = pd.read_csv(path)
-    lookup = process_lookup(lookup)
+    lookup = process_lookup(core.load_oa_lookup())
 
     buffer_sizes = [
-        100,
         200,
         300,
+        400,
         ]
 
     ap_coverage_levels = [
@@ -259,43 +246,43 @@ if __name__ == '__main__':
         'high'
     ]
 
-    all_data = pd.DataFrame()
+    columns = ['msoa', 'urban_rural', 'total_prems',
+        'total_prems_density_km2', 'number_of_aps', 'number_of_aps_density_km2'
+    ]
+
+    print('Loading national statistics estimates')
+    path = core.get_path('ns_results')
+    data_ns = pd.read_csv(path)
+    data_ns = add_lut_data_to_ns(data_ns, lookup, ap_coverage_levels)
+    data_ns = data_ns[columns + ['ap_coverage']]
+    data_ns['source'] = 'Predictive Model'
+
+    print('Loading self-collected data for all buffer sizes')
+    data_sc = ChunkAccumulator()
+    for buffer_size in buffer_sizes:
+        filename = 'all_buffered_points_{}m.csv'.format(buffer_size)
+        path = os.path.join(RESULTS_PATH, filename)
+        data = pd.read_csv(path)
+        data['buffer_size'] = buffer_size
+        data_sc.add(data)
+    data_sc = data_sc.to_frame()
+    data_sc = process_sc_data(data_sc)
+    data_sc = add_lut_data_to_sc(data_sc, lookup)
+    data_sc = data_sc[columns + ['buffer_size']]
+    data_sc['source'] = 'Wardriving'
+
+    all_data = ChunkAccumulator()
 
     for buffer_size in buffer_sizes:
 
-        print('Working on buffer size: {}'.format(buffer_size))
+        all_data.add(data_ns.assign(buffer_size=buffer_size))
 
         for ap_coverage in ap_coverage_levels:
+            all_data.add(data_sc.loc[
+                data_sc['buffer_size'] == buffer_size
+            ].assign(ap_coverage=ap_coverage))
 
-            print('Working on AP coverage: {}'.format(ap_coverage))
-
-            path = os.path.join(RESULTS_PATH, 'estimated_adoption_ns.csv')
-            data_ns = pd.read_csv(path)
-            data_ns = data_ns.to_dict('records')
-            data_ns = add_lut_data_to_ns(data_ns, lookup, ap_coverage)
-            data_ns = pd.DataFrame(data_ns)
-            data_ns = data_ns[['msoa', 'urban_rural', 'total_prems',
-                'total_prems_density_km2', 'number_of_aps', 'number_of_aps_density_km2'
-            ]]
-            data_ns['ap_coverage'] = ap_coverage
-            data_ns['source'] = 'Predictive Model'
-            data_ns['buffer_size'] = buffer_size
-
-            filename = 'all_buffered_points_{}m.csv'.format(buffer_size)
-            path = os.path.join(RESULTS_PATH, filename)
-            data_sc = pd.read_csv(path)
-            data_sc = process_sc_data(data_sc)
-            data_sc = add_lut_data_to_sc(data_sc, lookup)
-            data_sc = data_sc[['msoa', 'urban_rural', 'total_prems',
-                'total_prems_density_km2', 'number_of_aps', 'number_of_aps_density_km2'
-            ]]
-            data_sc['source'] = 'Wardriving'
-            data_sc['buffer_size'] = buffer_size
-            data_sc['ap_coverage'] = ap_coverage
-            data_sc = data_sc.append(data_sc)
-
-            all_data = all_data.append(data_ns)
-            all_data = all_data.append(data_sc)
+    all_data = all_data.to_frame()
 
     path = os.path.join(BASE_PATH, '..', 'vis', 'all_data_to_plot.csv')
     all_data.to_csv(path, index=False)